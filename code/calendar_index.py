@@ -0,0 +1,128 @@
+# CALENDAR INDEX
+#
+# This file builds the calendar features of the hours of a year (date,
+# hour of the day, weekday, month, season and Portuguese holidays) once
+# and keeps them for the session, so the simulations do not parse the
+# "Date/Hour" strings of every sheet on every call.
+#
+# The features are positional (one value per row of the hourly sheet),
+# read from the labels of the sheet when they are given: leap years with
+# or without 29 Feb and the repeated / missing hour of the DST changes
+# are taken as they are in the sheet. Without labels, the hours of the
+# year are counted from 1 January (29 Feb is dropped when the year has
+# only 8760 hours).
+#
+# The calendars are keyed by the file they come from (path, modification
+# time and sheet). Labels given without their file are keyed by a digest
+# of all the labels.
+
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+
+# Meteorological seasons of the months (January first): 0 = winter, 1 = spring, 2 = summer, 3 = autumn
+SEASONS = np.array([0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3, 0], dtype=np.int8)
+
+# Fixed Portuguese national holidays (day, month)
+FIXED_HOLIDAYS = [(1, 1), (25, 4), (1, 5), (10, 6), (15, 8), (5, 10), (1, 11), (1, 12), (8, 12), (25, 12)]
+
+# Calendars already built: {(path, mtime, sheet) or (year, labels digest) or (year, number of hours): features}
+_calendars = {}
+
+
+# Function that returns the date of Easter Sunday of a year (Gregorian calendar)
+def easter(year):
+
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return pd.Timestamp(year, month, day + 1)
+
+
+# Function that lists the Portuguese national holidays of a year
+# Good Friday, Easter and Corpus Christi move with Easter
+def holidays(year):
+
+    easter_sunday = easter(year)
+    movable = [easter_sunday - pd.Timedelta(days=2), easter_sunday, easter_sunday + pd.Timedelta(days=60)]
+    return pd.DatetimeIndex([pd.Timestamp(year, month, day) for day, month in FIXED_HOLIDAYS] + movable)
+
+
+# Function that builds the dates of the hours from the "Date/Hour" labels ("01Jan 00:00")
+# Only the different days are parsed, the hours are read from the labels
+def _label_dates(year, labels):
+
+    labels = pd.Series(labels).astype(str)
+    day_codes, days = pd.factorize(labels.str[:5])
+    day_dates = pd.to_datetime(pd.Index(days) + str(year), format="%d%b%Y")
+
+    hour_minute = labels.str[5:].str.strip()
+    hours = hour_minute.str[:2].astype(np.int64).to_numpy()
+    minutes = hour_minute.str[3:5].astype(np.int64).to_numpy()
+    offsets = (hours * 60 + minutes) * np.timedelta64(1, "m")
+    return day_dates.to_numpy()[day_codes] + offsets
+
+
+# Function that builds the dates of the hours of a year without labels
+def _year_dates(year, n_hours):
+
+    dates = pd.date_range(f"{year}-01-01", f"{year}-12-31 23:00", freq="h")
+    if n_hours == 8760 and len(dates) == 8784:
+        dates = dates[~((dates.month == 2) & (dates.day == 29))]
+    if n_hours > len(dates):
+        raise ValueError(f"{year} has {len(dates)} hours, {n_hours} were asked")
+    return dates[:n_hours].to_numpy()
+
+
+# Function that returns the cache key of the sheet of a data file: (path, modification time, sheet)
+# file_path is relative to the data folder, as in get_data
+def source_key(file_path, sheet):
+
+    from extract_data import BASE_DIR
+
+    path = os.path.join(BASE_DIR, file_path)
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    return (path, mtime, str(sheet))
+
+
+# Function that returns the calendar features of the hours of a year
+# labels are the "Date/Hour" strings of the sheet (optional); source is the (file, sheet) they were read from (optional)
+# The arrays returned are shared, they cannot be changed
+def calendar_features(year, labels=None, n_hours=None, source=None):
+
+    if labels is not None:
+        labels = np.asarray(labels)
+        if source is not None:
+            key = source_key(*source)
+        else:
+            key = (year, hashlib.sha1("\n".join(map(str, labels)).encode()).hexdigest())
+    elif n_hours is not None:
+        key = (year, n_hours)
+    else:
+        raise ValueError("calendar_features needs the labels or the number of hours")
+
+    if key not in _calendars:
+        dates = pd.DatetimeIndex(_label_dates(year, labels) if labels is not None else _year_dates(year, n_hours))
+        month = dates.month.to_numpy().astype(np.int8)
+        features = {
+            "Date/Hour": dates.to_numpy().astype("datetime64[ns]"),
+            "Hour": dates.hour.to_numpy().astype(np.int8),
+            "Weekday": dates.weekday.to_numpy().astype(np.int8),  # 0 = Monday, 6 = Sunday
+            "Month": month,
+            "Season": SEASONS[month - 1],
+            "Holiday": dates.normalize().isin(holidays(year)),
+        }
+        features["Sunday"] = features["Weekday"] == 6
+        for values in features.values():
+            values.flags.writeable = False
+        _calendars[key] = features
+
+    return _calendars[key]
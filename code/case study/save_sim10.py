@@ -1,4 +1,11 @@
 import pandas as pd
+import sys
+import os
+
+# When run directly, extract_data (one folder up) must be importable by sim10
+# When imported (h2sim) the caller already has it in the path
+if __name__ == "__main__":
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from sim10_caseStudy import results_simulation 
 
@@ -7,38 +14,46 @@ years = [2030, 2035, 2040, 2050]
 storage_cap = [1000, 3500, 6000]
 threshold_excel_name = "thresholds_sim11"
 
-summaries = []
 
-for scenario in scenarios:
-    print(f"\n--- Processing scenario: {scenario} ---")
+def run_sweep(scenarios=scenarios, storage_cap=storage_cap, threshold_excel_name=threshold_excel_name, output_file="sim12_results2.xlsx"):
+
+    summaries = []
+
+    for scenario in scenarios:
+        print(f"\n--- Processing scenario: {scenario} ---")
+
+        df_thresholds = pd.read_excel(f"{threshold_excel_name}.xlsx", f"{scenario}")
+
 
-    df_thresholds = pd.read_excel(f"{threshold_excel_name}.xlsx", f"{scenario}")
+        for _, row in df_thresholds.iterrows():
+            year = int(row["Years"])
 
+            thresholds = [
+                row["Avg Electricity Cost [€/MWh]"],
+                row["Avg Electricity Cost During Deficits [€/MWh]"],
+                row["Manual Threshold [€/MWh]"]
+            ]
+            threshold_labels = ["Average Cost", "Deficit Cost", "Manual Threshold"]
 
-    for _, row in df_thresholds.iterrows():
-        year = int(row["Years"])
+            for threshold, label in zip(thresholds, threshold_labels):
+                for cap in storage_cap:
+                    print(f"Running: {scenario} {year} | Threshold: {label} ({threshold:.2f}) | Capacity: {cap} tons")
 
-        thresholds = [
-            row["Avg Electricity Cost [€/MWh]"],
-            row["Avg Electricity Cost During Deficits [€/MWh]"],
-            row["Manual Threshold [€/MWh]"]
-        ]
-        threshold_labels = ["Average Cost", "Deficit Cost", "Manual Threshold"]
+                    try:
+                        df, summary = results_simulation(scenario, year, cap, threshold)
+                        summary["Scenario"] = scenario
+                        summary["Year"] = year
+                        summary["Threshold Type"] = label
+                        summary["Threshold Value [€/MWh]"] = threshold
+                        summaries.append(summary)
+                    except Exception as e:
+                        print(f"Erro em {scenario}-{year}-{threshold} ({cap}%): {e}")
 
-        for threshold, label in zip(thresholds, threshold_labels):
-            for cap in storage_cap:
-                print(f"Running: {scenario} {year} | Threshold: {label} ({threshold:.2f}) | Capacity: {cap} tons")
+    df_summary = pd.DataFrame(summaries)
+    df_summary.to_excel(output_file, sheet_name="Case Study Results", index=False)
+    print(f"\nResultados guardados em '{output_file}'")
+    return df_summary
 
-                try:
-                    df, summary = results_simulation(scenario, year, cap, threshold)
-                    summary["Scenario"] = scenario
-                    summary["Year"] = year
-                    summary["Threshold Type"] = label
-                    summary["Threshold Value [€/MWh]"] = threshold
-                    summaries.append(summary)
-                except Exception as e:
-                    print(f"Erro em {scenario}-{year}-{threshold} ({cap}%): {e}")
 
-df_summary = pd.DataFrame(summaries)
-df_summary.to_excel("sim12_results2.xlsx", sheet_name="Case Study Results", index=False)
-print("\nResultados guardados em 'sim12_results2.xlsx'")
+if __name__ == "__main__":
+    run_sweep()
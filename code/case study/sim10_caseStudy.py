@@ -8,56 +8,60 @@ import pandas as pd
 import sys
 import os
 
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# When run directly, extract_data (one folder up) must be importable
+# When imported (h2sim, save_sim10) the caller already has it in the path
+if __name__ == "__main__":
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from extract_data import get_data, df_electrolyzers, df_fuel_cells, df_compressors_saltCaverns  
+from extract_data import load_tables, df_electrolyzers, df_fuel_cells, df_compressors_saltCaverns  
+from calendar_index import calendar_features
 
-def results_simulation(scenario, year, storage_cap, threshold_selling):
+# Default selling strategy: selling starts when the cavern reaches 80% and stops at 20%,
+# from 08:00 to 17:00 except on Sundays, with exports limited to 70% of the interconnection
+START_SELLING = 0.8
+STOP_SELLING = 0.2
+SELLING_HOURS = (8, 17)
+SELL_ON_SUNDAY = False
+EXPORT_DERATE = 0.7
+
+
+# Function that loads the data of the case study and computes its technical and economic parameters
+# Returns the hourly dataframe (with "Date/Hour" as dates and the "Hour" of the day) and a dictionary of parameters
+def case_study_parameters(scenario, year, storage_cap, threshold_selling):
 
     #################################################################################
     # DATAFRAMES INITIALIZATION
 
-    # HOURLY DATA DF
-    year_string = str(year)
-    df = get_data(year_string, f"{scenario}.xlsx", "Index")
-
-    # H2 SELLING PRICES DF
-    h2_prices_df = get_data("Prices", "H2_prices.xlsx", "Year")
-
-    # CAPACITY DF
-    if scenario == "NT":
-        installed_cap_df = get_data(scenario, "data_caseStudy.xlsx", "Years")
-        exchange_cap_df = get_data(scenario, "Exchange_Capacity.xlsx", "Years")
-    elif scenario == "DE":
-        installed_cap_df = get_data(scenario, "data_caseStudy.xlsx", "Years")
-        exchange_cap_df = get_data(scenario, "Exchange_Capacity.xlsx", "Years")
-    elif scenario == "GA":
-        installed_cap_df = get_data(scenario, "data_caseStudy.xlsx", "Years")
-        exchange_cap_df = get_data(scenario, "Exchange_Capacity.xlsx", "Years")
-    else:
+    if scenario not in ("NT", "DE", "GA"):
         raise ValueError(f"Unknown scenario: {scenario}")
 
-    df["Date/Hour"] = pd.to_datetime(
-        df["Date/Hour"].str[:5] + str(year) + " " + df["Date/Hour"].str[5:], 
-        format="%d%b%Y %H:%M"
-    )
-
-    df["Hour"] = df["Date/Hour"].dt.hour
-    df["In_Selling_Window"] = df["Hour"].between(8, 17) # 10 hours working
-
-    df["Is_Sunday"] = df["Date/Hour"].dt.weekday == 6  # 6 = Sunday
-
-
-    # STORAGE DF
+    # STORAGE SHEET
     if storage_cap <= 3000:
-        df_storage = get_data("Salt Caverns 123", "data_caseStudy.xlsx", "Years")
+        storage_sheet = "Salt Caverns 123"
     elif storage_cap > 3000:
-        df_storage = get_data("Salt Caverns 456", "data_caseStudy.xlsx", "Years")
+        storage_sheet = "Salt Caverns 456"
     else:
         raise ValueError("Could not find dataframe")
-    
-    # COMPRESSORS DF    
-    #################################################################################
+
+    # All the sheets are read together, each excel is opened once
+    year_string = str(year)
+    tables = load_tables({
+        "hourly": (year_string, f"{scenario}.xlsx", "Index"),              # HOURLY DATA DF
+        "h2_prices": ("Prices", "H2_prices.xlsx", "Year"),                 # H2 SELLING PRICES DF
+        "installed_cap": (scenario, "data_caseStudy.xlsx", "Years"),       # CAPACITY DF
+        "exchange_cap": (scenario, "Exchange_Capacity.xlsx", "Years"),
+        "storage": (storage_sheet, "data_caseStudy.xlsx", "Years"),        # STORAGE DF
+    })
+    df = tables["hourly"]
+    h2_prices_df = tables["h2_prices"]
+    installed_cap_df = tables["installed_cap"]
+    exchange_cap_df = tables["exchange_cap"]
+    df_storage = tables["storage"]
+
+    # The dates and hours come from the calendar of the year, built once per session
+    calendar = calendar_features(year, df["Date/Hour"], source=(f"{scenario}.xlsx", year_string))
+    df["Date/Hour"] = calendar["Date/Hour"]
+    df["Hour"] = calendar["Hour"]
 
     h2_sellingPrice = h2_prices_df.loc[year, "H2 Cost [€/kg]"]
 
@@ -104,32 +108,8 @@ def results_simulation(scenario, year, storage_cap, threshold_selling):
     # Exchange
 
     cap_exchange = exchange_cap_df.loc[year, "Capacity (MWH2)"]
-    max_export_cap = cap_exchange * 0.7
-    cost_export = 0.2 # 0.2€/kg
-    export_loss_rate = 0.05  # 5% de perdas
-
 
-    #################################################################################
-    # INITIALIZATION OF VARIABLES
-    
     cap_storage_kg = storage_cap * 1000 # storage_cap is in tons, 1 ton = 1 000 kg 
-    current_storage = 0  # H2 in storage at each hour (kg)
-    storage_list = []  # to track storage levels hour by hour
-
-    current_H2stored = 0
-
-    h2_total_production = 0
-    h2_total_conversion = 0
-    electricity_used = 0
-    total_deficits = 0
-
-    total_revenue = 0
-    revenue = 0
-
-    flag_sell_H2 = False
-    start_selling = 0.8 * cap_storage_kg
-    stop_selling = 0.2 * cap_storage_kg
-    total_h2_sold = 0.0
 
     capex_total = ( 
         capex_anual_electrolyzer * cap_electrolyzer * 1000 + 
@@ -157,6 +137,80 @@ def results_simulation(scenario, year, storage_cap, threshold_selling):
 
     threshold_buying = threshold_selling * eff_total_equipments
 
+    params = {
+        "eff_electrolyzer": eff_electrolyzer,
+        "comsumption_compressors": comsumption_compressors,
+        "eff_compressors": eff_compressors,
+        "eff_storage": eff_storage,
+        "capex_storage": capex_storage,
+        "eff_fuel_cell": eff_fuel_cell,
+        "cap_exchange": cap_exchange,
+        "cap_storage_kg": cap_storage_kg,
+        "capex_total": capex_total,
+        "opex_total": opex_total,
+        "threshold_buying": threshold_buying,
+        "threshold_selling": threshold_selling,
+        "h2_sellingPrice": h2_sellingPrice,
+        "cost_export": 0.2, # 0.2€/kg
+        "export_loss_rate": 0.05,  # 5% de perdas
+        "calendar": calendar, # calendar features of the hours (calendar_index)
+    }
+    return df, params
+
+
+# start_selling and stop_selling are shares of the cavern capacity, selling_hours the first and last hour of the
+# selling window, export_derate the share of the interconnection available for H2 exports
+def results_simulation(scenario, year, storage_cap, threshold_selling, start_selling=START_SELLING, stop_selling=STOP_SELLING,
+                       selling_hours=SELLING_HOURS, sell_on_sunday=SELL_ON_SUNDAY, export_derate=EXPORT_DERATE):
+
+    df, params = case_study_parameters(scenario, year, storage_cap, threshold_selling)
+
+    calendar = params["calendar"]
+    in_selling_window = (calendar["Hour"] >= selling_hours[0]) & (calendar["Hour"] <= selling_hours[1]) # 10 hours working by default
+    is_sunday = calendar["Sunday"] & (not sell_on_sunday) # with Sunday sales, Sundays are treated as any other day
+
+    df["In_Selling_Window"] = in_selling_window
+    df["Is_Sunday"] = is_sunday
+
+
+    eff_electrolyzer = params["eff_electrolyzer"]
+    comsumption_compressors = params["comsumption_compressors"]
+    eff_compressors = params["eff_compressors"]
+    eff_storage = params["eff_storage"]
+    capex_storage = params["capex_storage"]
+    eff_fuel_cell = params["eff_fuel_cell"]
+    cap_storage_kg = params["cap_storage_kg"]
+    capex_total = params["capex_total"]
+    opex_total = params["opex_total"]
+    threshold_buying = params["threshold_buying"]
+    h2_sellingPrice = params["h2_sellingPrice"]
+
+    max_export_cap = params["cap_exchange"] * export_derate
+    cost_export = params["cost_export"]
+    export_loss_rate = params["export_loss_rate"]
+
+
+    #################################################################################
+    # INITIALIZATION OF VARIABLES
+    
+    current_storage = 0  # H2 in storage at each hour (kg)
+    storage_list = []  # to track storage levels hour by hour
+
+    current_H2stored = 0
+
+    h2_total_production = 0
+    h2_total_conversion = 0
+    electricity_used = 0
+    total_deficits = 0
+
+    total_revenue = 0
+    revenue = 0
+
+    flag_sell_H2 = False
+    start_selling = start_selling * cap_storage_kg
+    stop_selling = stop_selling * cap_storage_kg
+    total_h2_sold = 0.0
+
     #################################################################################
     # COLUMNS FOR OUTPUTS
 
@@ -182,7 +236,7 @@ def results_simulation(scenario, year, storage_cap, threshold_selling):
     #################################################################################
 
 
-    for i, row in df.iterrows(): # Iterates each row of the df, i is the index, the row contains the info about balance, cost, etc
+    for position, (i, row) in enumerate(df.iterrows()): # Iterates each row of the df, i is the index, the row contains the info about balance, cost, etc
 
         balance_pt = row["PT Balance [MW]"] * 1000 # Stores the current balance value
         balance_es = row["ES Balance [MW]"] * 1000
@@ -310,9 +364,9 @@ def results_simulation(scenario, year, storage_cap, threshold_selling):
         ##############
         # SELLING H2 #
         ##############
-        if ((current_storage >= stop_selling) and (flag_sell_H2 == True)  and (not df.at[i, "Is_Sunday"]) ):
+        if ((current_storage >= stop_selling) and (flag_sell_H2 == True)  and (not is_sunday[position]) ):
 
-            if df.at[i, "In_Selling_Window"]: # Can we sell H2 at this hour?
+            if in_selling_window[position]: # Can we sell H2 at this hour?
                 h2_available_for_sale  = min(((max_export_cap * 1000) /33.3), (current_storage - stop_selling)) # Either sell the max of exchange capacity or until it reaches the minimum selling point
                 
                 h2_toSell = h2_available_for_sale * (1 - export_loss_rate)
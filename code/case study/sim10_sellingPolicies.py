@@ -0,0 +1,269 @@
+# SIMULATION 10 - SELLING POLICIES
+#
+# This file evaluates many H2 selling strategies of the case study at
+# once: the level of the cavern at which selling starts and stops, the
+# hours of the selling window, selling on Sundays or not and the share of
+# the interconnection available for exports. The hourly data and the
+# parameters are read once (as in sim10) and all the policies advance
+# together through the hours inside one compiled loop, each with its own
+# storage level and selling flag, keeping only their yearly totals.
+#
+# Every policy gives the same results as sim10 run with that policy.
+
+import itertools
+
+import numpy as np
+import pandas as pd
+import sys
+import os
+
+# When run directly, the modules one folder up must be importable
+if __name__ == "__main__":
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dispatch_kernel import njit, HOURLY_COLUMNS, H_BALANCE_PT, H_BALANCE_ES, H_PT_COST, H_ES_COST
+from schema import column_array
+from sim10_caseStudy import case_study_parameters
+
+POLICY_COLUMNS = ["Start Selling (%)", "Stop Selling (%)", "Window Start (h)", "Window End (h)", "Sunday Sales", "Export Derate"]
+
+# Constants of the case study, by position
+C_EFF_ELECTROLYZER = 0
+C_CONSUMPTION_COMPRESSORS = 1
+C_EFF_COMPRESSORS = 2
+C_EFF_STORAGE = 3
+C_EFF_FUEL_CELL = 4
+C_CAP_STORAGE = 5
+C_THRESHOLD_BUYING = 6
+C_THRESHOLD_SELLING = 7
+C_H2_PRICE = 8
+C_COST_EXPORT = 9
+C_EXPORT_LOSS = 10
+N_CONSTANTS = 11
+
+# Policies, by position (levels in kg, H2 that can be exported per hour in kg)
+Q_START = 0
+Q_STOP = 1
+Q_WINDOW_START = 2
+Q_WINDOW_END = 3
+Q_SUNDAY = 4
+Q_MAX_SALE = 5
+N_POLICY_FIELDS = 6
+
+# Yearly totals of every policy, by position
+T_PRODUCED = 0
+T_CONVERTED = 1
+T_SOLD = 2
+T_DEFICITS = 3
+T_RECOVERED = 4
+T_FROM_H2 = 5
+T_ELEC_COST = 6
+T_EXPORT_COST = 7
+T_REVENUE = 8
+T_STORAGE = 9
+T_ELEC_USED = 10
+N_TOTALS = 11
+
+
+# Function that builds the grid of selling policies (every combination of the given values)
+# Combinations that stop selling at or above the level where they start are dropped
+def policy_grid(start_selling=(0.6, 0.7, 0.8, 0.9), stop_selling=(0.1, 0.2, 0.3, 0.4),
+                selling_windows=((8, 17), (6, 21), (0, 23)), sunday_sales=(False, True), export_derates=(0.5, 0.7, 0.9)):
+
+    rows = [
+        [start, stop, window[0], window[1], sunday, derate]
+        for start, stop, window, sunday, derate in itertools.product(
+            start_selling, stop_selling, selling_windows, sunday_sales, export_derates)
+        if start > stop
+    ]
+    return pd.DataFrame(rows, columns=POLICY_COLUMNS)
+
+
+# Dispatches all the policies hour by hour (same rules as sim10) and accumulates their yearly totals
+# flags is the selling flag (hysteresis) of every policy
+@njit(cache=True)
+def dispatch_policies(hourly, hours, sundays, C, Q, storage, flags, totals):
+
+    eff_total = C[C_EFF_ELECTROLYZER] + C[C_CONSUMPTION_COMPRESSORS]
+
+    for t in range(hourly.shape[0]):
+        pt_electricityCost = hourly[t, H_PT_COST]
+        es_electricityCost = hourly[t, H_ES_COST]
+
+        # Checks the difference between the Portuguese electricity cost and the Spanish electricity cost
+        if pt_electricityCost > 0:
+            price_diff = abs(pt_electricityCost - es_electricityCost) / pt_electricityCost
+        elif es_electricityCost > 0:
+            price_diff = abs(es_electricityCost - pt_electricityCost) / es_electricityCost
+        else:
+            price_diff = 0.0
+        can_exchange = price_diff <= 0.2
+
+        # The exports to ES do not depend on the storage, they are the same for every policy
+        balance_pt = hourly[t, H_BALANCE_PT] * 1000
+        balance_es = hourly[t, H_BALANCE_ES] * 1000
+        surplus = balance_pt >= 1
+        if surplus and pt_electricityCost <= C[C_THRESHOLD_BUYING] and balance_es < -1 and can_exchange:
+            balance_pt -= min(balance_pt, abs(balance_es))
+
+        for k in range(Q.shape[0]):
+            current_storage = storage[k]
+
+            # SURPLUS
+            if surplus:
+                if balance_pt >= 1 and pt_electricityCost <= C[C_THRESHOLD_BUYING] and current_storage < C[C_CAP_STORAGE]:
+                    h2_produced = balance_pt / eff_total
+                    if current_storage + h2_produced > C[C_CAP_STORAGE]:
+                        h2_produced = C[C_CAP_STORAGE] - current_storage
+                        electricity_used = (h2_produced / C[C_EFF_COMPRESSORS]) * eff_total
+                    else:
+                        electricity_used = balance_pt
+                    current_storage += h2_produced
+                    totals[k, T_PRODUCED] += h2_produced
+                    totals[k, T_ELEC_COST] += electricity_used * pt_electricityCost / 1000
+                    totals[k, T_ELEC_USED] += electricity_used
+
+                if current_storage >= Q[k, Q_START] and not flags[k]:
+                    flags[k] = True
+
+            # DEFICIT
+            elif pt_electricityCost >= C[C_THRESHOLD_SELLING]:
+                deficit_energy = abs(balance_pt)
+                totals[k, T_DEFICITS] += deficit_energy
+                energy_imported = 0.0
+                energy_recovered = 0.0
+
+                if es_electricityCost < C[C_THRESHOLD_BUYING] and balance_es > 0 and can_exchange:
+                    energy_imported = min(balance_es, deficit_energy)
+                    deficit_energy = max(deficit_energy - energy_imported, 0.0)
+
+                if deficit_energy > 0:
+                    if current_storage > 0:
+                        h2_needed_storage = deficit_energy / (C[C_EFF_FUEL_CELL] * 33.33) / C[C_EFF_STORAGE]
+                        h2_converted = min(current_storage, h2_needed_storage)
+                        energy_recovered = min(h2_converted * C[C_EFF_STORAGE] * C[C_EFF_FUEL_CELL] * 33.33, deficit_energy)
+                        current_storage -= h2_converted
+                        totals[k, T_CONVERTED] += h2_converted
+                        totals[k, T_FROM_H2] += energy_recovered
+
+                    if deficit_energy - energy_recovered > 0 and energy_imported == 0 and balance_es > 0 and can_exchange:
+                        energy_imported += min(balance_es, deficit_energy - energy_recovered)
+
+                if current_storage <= Q[k, Q_STOP] and flags[k]:
+                    flags[k] = False
+                totals[k, T_RECOVERED] += energy_recovered + energy_imported
+
+            # SELLING H2
+            if current_storage >= Q[k, Q_STOP] and flags[k] and (Q[k, Q_SUNDAY] > 0 or not sundays[t]):
+                if Q[k, Q_WINDOW_START] <= hours[t] <= Q[k, Q_WINDOW_END]:
+                    h2_available_for_sale = min(Q[k, Q_MAX_SALE], current_storage - Q[k, Q_STOP])
+                    h2_toSell = h2_available_for_sale * (1 - C[C_EXPORT_LOSS])
+                    cost_H2_toSell = h2_toSell * C[C_COST_EXPORT]
+                    totals[k, T_REVENUE] += h2_toSell * C[C_H2_PRICE] - cost_H2_toSell
+                    totals[k, T_EXPORT_COST] += cost_H2_toSell
+                    totals[k, T_SOLD] += h2_toSell
+                    current_storage -= h2_available_for_sale
+
+                if current_storage <= Q[k, Q_STOP]:
+                    flags[k] = False
+
+            storage[k] = current_storage
+            totals[k, T_STORAGE] += current_storage
+
+
+# Function that puts the constants of the case study (case_study_parameters dictionary) in an array
+def case_constants(params):
+
+    C = np.zeros(N_CONSTANTS)
+    C[C_EFF_ELECTROLYZER] = params["eff_electrolyzer"]
+    C[C_CONSUMPTION_COMPRESSORS] = params["comsumption_compressors"]
+    C[C_EFF_COMPRESSORS] = params["eff_compressors"]
+    C[C_EFF_STORAGE] = params["eff_storage"]
+    C[C_EFF_FUEL_CELL] = params["eff_fuel_cell"]
+    C[C_CAP_STORAGE] = params["cap_storage_kg"]
+    C[C_THRESHOLD_BUYING] = params["threshold_buying"]
+    C[C_THRESHOLD_SELLING] = params["threshold_selling"]
+    C[C_H2_PRICE] = params["h2_sellingPrice"]
+    C[C_COST_EXPORT] = params["cost_export"]
+    C[C_EXPORT_LOSS] = params["export_loss_rate"]
+    return C
+
+
+# Function that puts the policies (policy_grid dataframe) in an array, with the levels in kg of the cavern
+def policy_array(policies, params):
+
+    cap_storage_kg = params["cap_storage_kg"]
+    Q = np.zeros((len(policies), N_POLICY_FIELDS))
+    Q[:, Q_START] = policies["Start Selling (%)"].to_numpy(dtype=float) * cap_storage_kg
+    Q[:, Q_STOP] = policies["Stop Selling (%)"].to_numpy(dtype=float) * cap_storage_kg
+    Q[:, Q_WINDOW_START] = policies["Window Start (h)"].to_numpy(dtype=float)
+    Q[:, Q_WINDOW_END] = policies["Window End (h)"].to_numpy(dtype=float)
+    Q[:, Q_SUNDAY] = policies["Sunday Sales"].to_numpy(dtype=float)
+    Q[:, Q_MAX_SALE] = (params["cap_exchange"] * policies["Export Derate"].to_numpy(dtype=float) * 1000) / 33.3
+    return Q
+
+
+# Function that evaluates a grid of selling policies (policy_grid dataframe) for the case study
+# Returns a dataframe with the policy and the yearly indicators of sim10 in every row
+def results_policies(scenario, year, storage_cap, threshold_selling, policies=None):
+
+    policies = policy_grid() if policies is None else policies.reset_index(drop=True)
+    df, params = case_study_parameters(scenario, year, storage_cap, threshold_selling)
+
+    hourly = column_array(df, HOURLY_COLUMNS)
+    hours = params["calendar"]["Hour"]
+    sundays = params["calendar"]["Sunday"]
+
+    cap_storage_kg = params["cap_storage_kg"]
+    C = case_constants(params)
+    Q = policy_array(policies, params)
+
+    storage = np.zeros(len(policies))
+    flags = np.zeros(len(policies), dtype=np.bool_)
+    totals = np.zeros((len(policies), N_TOTALS))
+    dispatch_policies(hourly, hours, sundays, C, Q, storage, flags, totals)
+
+    # Final results (same formulas as sim10, one value per policy)
+    capex_total, opex_total = params["capex_total"], params["opex_total"]
+    capex_storage = params["capex_storage"]
+    total_deficits = totals[:, T_DEFICITS]
+    h2_total_production = totals[:, T_PRODUCED]
+    total_cost_electricity_used = totals[:, T_ELEC_COST]
+    total_revenue = totals[:, T_REVENUE]
+    has_deficits = total_deficits > 0
+    has_production = h2_total_production > 0
+    has_revenue = total_revenue > 0
+    safe_deficits = np.where(has_deficits, total_deficits, 1)
+    safe_production = np.where(has_production, h2_total_production, 1)
+    safe_revenue = np.where(has_revenue, total_revenue, 1)
+
+    lcoh_standard = np.where(has_production, (capex_total + opex_total + total_cost_electricity_used) / safe_production, 0)
+    lcoh_net = np.where(has_production, (capex_total + opex_total + total_cost_electricity_used - total_revenue) / safe_production, 0)
+    cave_cost = capex_storage * cap_storage_kg
+
+    results = policies.copy()
+    results.insert(0, "Scenario", scenario)
+    results.insert(1, "Year", year)
+    results["H2 Produced (kg)"] = h2_total_production
+    results["H2 Converted (kg)"] = totals[:, T_CONVERTED]
+    results["H2 Sold (kg)"] = totals[:, T_SOLD]
+    results["Energy Recovered (kWh)"] = totals[:, T_RECOVERED]
+    results["Electricity Cost [€]"] = total_cost_electricity_used
+    results["Revenue H2 Sold [€]"] = total_revenue
+    results["Profit [€]"] = total_revenue - (capex_total + opex_total + total_cost_electricity_used + totals[:, T_EXPORT_COST])
+    results["Payback Salt Cavern (years)"] = np.where(has_revenue, cave_cost / safe_revenue, np.inf)
+    results["Payback Full System (years)"] = np.where(has_revenue, (capex_total + opex_total + total_cost_electricity_used) / safe_revenue, np.inf)
+    results["Storage Utilization (%)"] = totals[:, T_STORAGE] / (cap_storage_kg * len(df)) * 100
+    results["Flexibility Index (%)"] = np.where(has_deficits, totals[:, T_RECOVERED] / safe_deficits * 100, 0)
+    # sim10 divides without checking the deficits (NaN in a year without deficits)
+    results["Flexibility Index H2(%)"] = np.where(has_deficits, totals[:, T_FROM_H2] / safe_deficits * 100, np.nan)
+    # H2 is only produced for storage in sim10, so the P2G2P and standard LCOH are the same
+    results["LCOH P2G2P (€/kg)"] = lcoh_standard
+    results["LCOH Standard (€/kg)"] = lcoh_standard
+    results["LCOH Adjusted (€/kg)"] = np.maximum(lcoh_net, 0)
+    return results
+
+
+if __name__ == "__main__":
+    df_policies = results_policies("DE", 2050, 1000, 55)
+    print(df_policies.sort_values("Profit [€]", ascending=False).head(10).to_string())
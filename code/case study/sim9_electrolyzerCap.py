@@ -3,14 +3,60 @@
 # This case study simulation estimates electrolyzer and fuel cell
 # capacity requirements based on Portugal’s net balance after exchanges,
 # using both maximum and average deficit conditions.
+#
+# The capacities are also given for percentiles (P90, P95, P99) of the
+# surplus and of the deficits, for one year or for an ensemble of weather
+# years, using quantile sketches that are filled year by year and merged
+# across processes.
 
 import pandas as pd
+import numpy as np
 import sys
 import os
+from concurrent.futures import ProcessPoolExecutor
 
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+# When run directly, extract_data (one folder up) must be importable
+# When imported (h2sim, save_sim10) the caller already has it in the path
+if __name__ == "__main__":
+    sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from extract_data import get_data, df_electrolyzers, df_NT_installed_cap, df_fuel_cells, df_GA_installed_cap, df_DE_installed_cap
+from network_dispatch import exchange_allowed
+from quantile_sketch import QuantileSketch
+
+PERCENTILES = [90, 95, 99]
+
+
+# Function that computes the balance left for H2 after exporting to Spain and the deficits (MW) of every hour
+def final_balances(balance_pt, balance_es, pt_cost, es_cost):
+
+    can_exchange = exchange_allowed(pt_cost, es_cost)
+    export = (balance_pt >= 1) & (balance_es < -1) & can_exchange
+    final_balance = np.where(export, balance_pt - np.minimum(balance_pt, np.abs(balance_es)), balance_pt)
+    final_balance = np.where((balance_pt >= 1) & (final_balance >= 1), final_balance, 0.0)
+    deficit = np.where(balance_pt < 0, balance_pt, 0.0)
+    return final_balance, deficit
+
+
+# Function that adds the surplus and deficit hours of one year to the sketches
+def update_sketches(surplus_sketch, deficit_sketch, final_balance, deficit):
+
+    surplus_sketch.update(final_balance[final_balance > 0])
+    deficit_sketch.update(-deficit[deficit < 0])
+
+
+# Function that converts the sketches into capacities for every percentile
+def percentile_sizing(surplus_sketch, deficit_sketch, eff_fuel_cell, percentiles=PERCENTILES):
+
+    qs = np.array(percentiles) / 100
+    surplus = surplus_sketch.quantiles(qs)
+    deficits = deficit_sketch.quantiles(qs)
+    return pd.DataFrame({
+        "Percentile": [f"P{p}" for p in percentiles],
+        "Electrolyzers (MW)": surplus,
+        "Deficit (MW)": deficits,
+        "Fuel Cells (MW)": deficits / eff_fuel_cell,
+    })
 
 def storage_simulation(scenario, year):
 
@@ -30,43 +76,14 @@ def storage_simulation(scenario, year):
     
     eff_fuel_cell = df_fuel_cells.loc[year, "Efficiency (%)"]
 
-    df["Final Balance [MW]"] = 0.0
-    df["Deficits [MW]"] = 0.0
-
-    for i, row in df.iterrows():
-        balance_pt = row["PT Balance [MW]"]
-        balance_es = row["ES Balance [MW]"]
-
-        pt_cost = row["PT Marginal Cost [€]"]
-        es_cost = row["ES Marginal Cost [€]"]
-
-        if pt_cost > 0:
-            price_diff = abs(pt_cost - es_cost) / pt_cost
-        elif es_cost > 0:
-            price_diff = abs(es_cost - pt_cost) / es_cost
-        else:
-            price_diff = 0
-
-        can_exchange = price_diff <= 0.2
-
-        final_balance = 0.0
-        deficit = 0.0
-
-        if balance_pt >= 1:
-            if balance_es < -1 and can_exchange:
-                max_export = min(balance_pt, abs(balance_es))
-                final_balance = balance_pt - max_export
-            else:
-                final_balance = balance_pt
-        if balance_pt < 0:
-            deficit = balance_pt
-
-        df.at[i, "Final Balance [MW]"] = final_balance
-        df.at[i, "Deficits [MW]"] = deficit
-
+    # Balance left after exports (only surpluses of at least 1 MW) and deficits of every hour
+    final_balance, deficit = final_balances(
+        df["PT Balance [MW]"].to_numpy(dtype=float), df["ES Balance [MW]"].to_numpy(dtype=float),
+        df["PT Marginal Cost [€]"].to_numpy(dtype=float), df["ES Marginal Cost [€]"].to_numpy(dtype=float))
+    df["Final Balance [MW]"] = final_balance
+    df["Deficits [MW]"] = deficit
 
     # Final results
-    df["Final Balance [MW]"] = df["Final Balance [MW]"].apply(lambda x: x if x >= 1 else 0)
 
     max_balance = df["Final Balance [MW]"].max()
     row_max = df.loc[df["Final Balance [MW]"].idxmax()]
@@ -89,6 +106,12 @@ def storage_simulation(scenario, year):
     print(f"Fuel Cells Min Cap: {fuel_cells_min:.2f} MW")
     print(f"Mean deficit: {average_deficit:.2f} MW")
     print(f"Fuel Cells Mean Cap: {fuel_cells_average:.2f} MW")
+
+    surplus_sketch, deficit_sketch = QuantileSketch(), QuantileSketch()
+    update_sketches(surplus_sketch, deficit_sketch, final_balance, deficit)
+    sizing = percentile_sizing(surplus_sketch, deficit_sketch, eff_fuel_cell)
+    for _, row in sizing.iterrows():
+        print(f"{row['Percentile']}: Electrolyzers {row['Electrolyzers (MW)']:.2f} MW, Fuel Cells {row['Fuel Cells (MW)']:.2f} MW")
     #print(df["Final Balance [MW]"].describe())
     #print(f"Row id: {row_min}")
 
@@ -96,4 +119,42 @@ def storage_simulation(scenario, year):
     return df
 
 
-storage_simulation("GA", 2050)
\ No newline at end of file
+# Fills the sketches with some weather years of a store (run in a worker process)
+def _sketch_years(store_dir, weather_years, seed):
+
+    from ensemble import load_weather_year
+    import dispatch_kernel as kernel
+
+    surplus_sketch, deficit_sketch = QuantileSketch(seed=seed), QuantileSketch(seed=seed + 1)
+    for weather_year in weather_years:
+        hourly = load_weather_year(store_dir, weather_year)
+        final_balance, deficit = final_balances(
+            hourly[:, kernel.H_BALANCE_PT], hourly[:, kernel.H_BALANCE_ES],
+            hourly[:, kernel.H_PT_COST], hourly[:, kernel.H_ES_COST])
+        update_sketches(surplus_sketch, deficit_sketch, final_balance, deficit)
+    return surplus_sketch, deficit_sketch
+
+
+# Function that sizes electrolyzers and fuel cells from the percentiles of an ensemble of weather years
+# (store built with ensemble.build_weather_store); every worker sketches a share of the years and the sketches are merged
+def ensemble_sizing(store_dir, eff_fuel_cell, percentiles=PERCENTILES, workers=None, years=None):
+
+    from ensemble import weather_years
+
+    years = weather_years(store_dir) if years is None else years
+    workers = workers or os.cpu_count()
+    shares = [years[k::workers] for k in range(workers) if years[k::workers]]
+
+    surplus_sketch, deficit_sketch = QuantileSketch(), QuantileSketch()
+    with ProcessPoolExecutor(max_workers=len(shares)) as executor:
+        for surplus_part, deficit_part in executor.map(_sketch_years, [store_dir] * len(shares), shares, range(0, 2 * len(shares), 2)):
+            surplus_sketch.merge(surplus_part)
+            deficit_sketch.merge(deficit_part)
+
+    sizing = percentile_sizing(surplus_sketch, deficit_sketch, eff_fuel_cell, percentiles)
+    sizing["Hours"] = surplus_sketch.count + deficit_sketch.count
+    return sizing
+
+
+if __name__ == "__main__":
+    storage_simulation("GA", 2050)
@@ -0,0 +1,165 @@
+# CHECKPOINTS
+#
+# This file runs the dispatch kernel in blocks of hours and saves its
+# state after every block, so a long run (many years of hours) that is
+# stopped continues from the last block instead of hour 0 with empty
+# storage. The state array of the kernel holds everything the next hour
+# depends on (storage, reservoir levels and yearly accumulators), so the
+# resumed run gives exactly the same outputs as a run without stops.
+#
+# A checkpoint folder has:
+#   outputs.bin               the output rows already computed (float64)
+#   snapshot_<hour>.bin       the cursor (next hour) and state at that hour
+#
+# The snapshots are small (a header and the state), one is kept for every
+# block, and they also give the state at any earlier date of the run to
+# start a what-if from there with other parameters.
+
+import glob
+import hashlib
+import os
+import struct
+
+import numpy as np
+
+import dispatch_kernel as kernel
+
+MAGIC = b"H2CK"
+VERSION = 1
+# magic, version, cursor, number of hours, parameters, state values, fingerprint of the run
+HEADER = struct.Struct("<4sHqqii8s")
+
+
+# Function that identifies a run (hourly data and parameters), so a checkpoint is not resumed with other data
+def run_fingerprint(hourly, p):
+
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(np.ascontiguousarray(hourly, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(p, dtype=np.float64).tobytes())
+    return digest.digest()
+
+
+def _snapshot_path(checkpoint_dir, cursor):
+    return os.path.join(checkpoint_dir, f"snapshot_{cursor:08d}.bin")
+
+
+# Function that writes a snapshot of the state at an hour (written to a temporary file and then moved)
+def write_snapshot(checkpoint_dir, cursor, n_hours, p, state, fingerprint):
+
+    path = _snapshot_path(checkpoint_dir, cursor)
+    with open(path + ".tmp", "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, cursor, n_hours, len(p), len(state), fingerprint))
+        f.write(np.ascontiguousarray(p, dtype=np.float64).tobytes())
+        f.write(np.ascontiguousarray(state, dtype=np.float64).tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    return path
+
+
+# Function that reads a snapshot: returns a dictionary with the cursor, number of hours, parameters, state and fingerprint
+def read_snapshot(path):
+
+    with open(path, "rb") as f:
+        data = f.read()
+
+    magic, version, cursor, n_hours, n_p, n_state, fingerprint = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a dispatch snapshot")
+    values = np.frombuffer(data, dtype=np.float64, offset=HEADER.size)
+    if len(values) != n_p + n_state:
+        raise ValueError(f"{path} is incomplete")
+
+    return {
+        "cursor": cursor,
+        "n_hours": n_hours,
+        "p": values[:n_p].copy(),
+        "state": values[n_p:].copy(),
+        "fingerprint": fingerprint,
+    }
+
+
+# Function that lists the hours with a snapshot in a checkpoint folder
+def snapshot_hours(checkpoint_dir):
+
+    paths = glob.glob(os.path.join(checkpoint_dir, "snapshot_*.bin"))
+    return sorted(int(os.path.basename(path)[len("snapshot_"):-len(".bin")]) for path in paths)
+
+
+# Function that runs the dispatch saving the state every `every` hours (24 * 7 = once a week)
+# With resume, a folder with snapshots of the same run continues from the last one
+# Returns the hourly outputs and the final state, like kernel.run_dispatch
+def run_checkpointed(hourly, p, checkpoint_dir, every=24 * 7, state=None, resume=True):
+
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    n_hours = hourly.shape[0]
+    fingerprint = run_fingerprint(hourly, p)
+    outputs_path = os.path.join(checkpoint_dir, "outputs.bin")
+    row_bytes = kernel.N_OUTPUTS * 8
+    out = np.zeros((n_hours, kernel.N_OUTPUTS))
+
+    hours = snapshot_hours(checkpoint_dir)
+    if resume and hours:
+        snapshot = read_snapshot(_snapshot_path(checkpoint_dir, hours[-1]))
+        if snapshot["fingerprint"] != fingerprint or snapshot["n_hours"] != n_hours:
+            raise ValueError(f"The checkpoints in {checkpoint_dir} are from another run (hourly data or parameters)")
+        cursor, state = snapshot["cursor"], snapshot["state"]
+        with open(outputs_path, "rb") as f:
+            done = np.frombuffer(f.read(cursor * row_bytes), dtype=np.float64)
+        if len(done) != cursor * kernel.N_OUTPUTS:
+            raise ValueError(f"{outputs_path} has fewer hours than the last snapshot ({cursor})")
+        out[:cursor] = done.reshape(cursor, kernel.N_OUTPUTS)
+    else:
+        for hour in hours:
+            os.remove(_snapshot_path(checkpoint_dir, hour))
+        cursor = 0
+        state = kernel.initial_state(p) if state is None else state.copy()
+        open(outputs_path, "wb").close()
+        write_snapshot(checkpoint_dir, cursor, n_hours, p, state, fingerprint)
+
+    with open(outputs_path, "r+b") as outputs:
+        while cursor < n_hours:
+            stop = min(cursor + every, n_hours)
+            kernel.dispatch_range(hourly, p, state, out, cursor, stop)
+
+            # The outputs are on disk before the snapshot that points after them
+            outputs.seek(cursor * row_bytes)
+            outputs.write(out[cursor:stop].tobytes())
+            outputs.flush()
+            os.fsync(outputs.fileno())
+
+            cursor = stop
+            write_snapshot(checkpoint_dir, cursor, n_hours, p, state, fingerprint)
+
+    return out, state
+
+
+# Function that returns the state of a checkpointed run at the start of a given hour
+# The run continues from the last snapshot before that hour with its own parameters
+def state_at(checkpoint_dir, hourly, hour):
+
+    earlier = [h for h in snapshot_hours(checkpoint_dir) if h <= hour]
+    if not earlier:
+        raise ValueError(f"No snapshot before hour {hour} in {checkpoint_dir}")
+
+    snapshot = read_snapshot(_snapshot_path(checkpoint_dir, earlier[-1]))
+    if snapshot["fingerprint"] != run_fingerprint(hourly, snapshot["p"]):
+        raise ValueError(f"The checkpoints in {checkpoint_dir} are from other hourly data")
+
+    state = snapshot["state"]
+    out = np.zeros((hourly.shape[0], kernel.N_OUTPUTS))
+    kernel.dispatch_range(hourly, snapshot["p"], state, out, snapshot["cursor"], hour)
+    return state
+
+
+# Function that runs a what-if: the checkpointed run until `hour`, then the parameters p_whatif until the end
+# hour can be found from a date with calendar_index (position of the date in "Date/Hour")
+# Returns the outputs of the what-if from that hour on and its final state
+def run_whatif(checkpoint_dir, hourly, hour, p_whatif):
+
+    state = state_at(checkpoint_dir, hourly, hour)
+    if len(state) != len(kernel.initial_state(p_whatif)):
+        raise ValueError("The what-if must have the same number of reservoirs as the checkpointed run")
+    out = np.zeros((hourly.shape[0], kernel.N_OUTPUTS))
+    kernel.dispatch_range(hourly, p_whatif, state, out, hour, hourly.shape[0])
+    return out[hour:], state
@@ -0,0 +1,121 @@
+# CYCLIC STORAGE
+#
+# This file finds the storage level the year should start with so that
+# it ends at the same level (cyclic steady state), instead of starting
+# every simulation with empty storage, which understates what seasonal
+# storage covers in the first months and makes the results depend on an
+# arbitrary initial condition.
+#
+# The year is run again from the level it ended with (fixed point). When
+# the storage is emptied or filled at some hour, the hours after it no
+# longer depend on the start and the level is found in 2 - 3 runs of the
+# kernel. A storage that never reaches its limits drifts by the same
+# amount every year, so the end level is the start level plus a constant
+# until the storage fills (or empties) on the way: the start is moved in
+# one step to the level where the highest (lowest) hour of the year just
+# reaches the limit (a Newton step on that piecewise-linear map), and the
+# fixed point is found from there in 1 - 2 more runs.
+
+import numpy as np
+import pandas as pd
+
+import dispatch_kernel as kernel
+from schema import hourly_data
+from system_parameters import case_parameters
+
+
+# Function that returns the storage entries of a state (total storage and the level of every reservoir)
+def storage_levels(state):
+
+    return np.concatenate((state[kernel.S_STORAGE:kernel.S_STORAGE + 1], state[kernel.S_LEVELS:]))
+
+
+# Function that builds the initial state of a year with the given storage entries (accumulators at 0)
+def start_state(p, levels):
+
+    state = kernel.initial_state(p)
+    state[kernel.S_STORAGE] = levels[0]
+    state[kernel.S_LEVELS:] = levels[1:]
+    return state
+
+
+# Function that dispatches a year starting from the storage level that it ends with
+# run is the function that dispatches the year (kernel.run_dispatch, or segment_dispatch.run_segments)
+# tolerance is the largest difference between the start and end levels (kg)
+# Returns the hourly outputs, the final state, the initial state and the runs made (dataframe)
+def cyclic_dispatch(hourly, p, tolerance=1e-3, max_iterations=20, run=None):
+
+    run = run or kernel.run_dispatch
+    capacities = p[kernel.N_PARAMETERS + kernel.R_CAPACITY::kernel.N_RESERVOIR_FIELDS]
+    history = []
+
+    def year(levels):
+        state = start_state(p, levels)
+        out, end = run(hourly, p, state)
+        history.append({
+            "Run": len(history) + 1,
+            "Initial Storage (kg)": levels[0],
+            "Final Storage (kg)": end[kernel.S_STORAGE],
+            "Gap (kg)": np.abs(storage_levels(end) - levels).max(),
+        })
+        return out, end, state
+
+    levels = storage_levels(kernel.initial_state(p))
+    for iteration in range(max_iterations):
+        out, end, state = year(levels)
+        if history[-1]["Gap (kg)"] <= tolerance:
+            return out, end, state, pd.DataFrame(history)
+
+        # The storage did not reach a limit: the year ends higher (lower) by the same amount whatever the start,
+        # until the start is high (low) enough for the storage to fill (empty) at some hour; jump to that start
+        drift = end[kernel.S_STORAGE] - levels[0]
+        highest, lowest = out[:, kernel.O_STORAGE].max(), out[:, kernel.O_STORAGE].min()
+        if lowest > 0 and highest < p[kernel.P_CAP_STORAGE] * 0.999 and capacities.sum() > 0:
+            shift = p[kernel.P_CAP_STORAGE] - highest if drift > 0 else -lowest
+            levels = levels + shift * np.concatenate(([1.0], capacities / capacities.sum()))
+            continue
+        levels = storage_levels(end)
+
+    print(f"Cyclic storage not found in {max_iterations} runs (gap {history[-1]['Gap (kg)']:.3g} kg)")
+    return out, end, state, pd.DataFrame(history)
+
+
+# Function that runs sim8 (selling=True) or sim7 (selling=False) with the cyclic initial storage
+# Returns the (df, summary) of kernel.results_simulation, with the initial storage and the runs made in the summary
+def results_simulation(scenario, year, storage_ratio, threshold_selling, selling=True, run=None):
+
+    df = hourly_data(scenario, year)
+    params = case_parameters(scenario, year, storage_ratio, threshold_selling, selling=selling)
+    solved = {}
+
+    def cyclic_run(hourly, p):
+        out, end, state, solved["history"] = cyclic_dispatch(hourly, p, run=run)
+        solved["initial"] = state[kernel.S_STORAGE]
+        return out, end
+
+    df, summary = kernel.results_from_dataframe(df, params, selling=selling, run=cyclic_run, validated=True)
+    summary["Initial Storage (kg)"] = solved["initial"]
+    summary["Final Storage (kg)"] = df["Storage H2 [kg]"].iloc[-1]
+    summary["Cyclic Runs"] = len(solved["history"])
+    return df, summary
+
+
+# Function that compares the empty and cyclic initial storage for several storage ratios
+def results_comparison(scenario, year, threshold_selling, storage_ratios=(100, 60, 50, 0), selling=True):
+
+    rows = []
+    for ratio in storage_ratios:
+        _, empty = kernel.results_simulation(scenario, year, ratio, threshold_selling, selling=selling)
+        _, cyclic = results_simulation(scenario, year, ratio, threshold_selling, selling=selling)
+        rows.append({
+            "Scenario": scenario,
+            "Year": year,
+            "Storage in Salt Caverns (%)": ratio,
+            "Initial Storage (kg)": cyclic["Initial Storage (kg)"],
+            "Cyclic Runs": cyclic["Cyclic Runs"],
+            "Flexibility Index (%) Empty Start": empty["Flexibility Index (%)"],
+            "Flexibility Index (%) Cyclic": cyclic["Flexibility Index (%)"],
+            "LCOH (€/kg) Empty Start": empty["LCOH (€/kg)"],
+            "LCOH (€/kg) Cyclic": cyclic["LCOH (€/kg)"],
+        })
+    return pd.DataFrame(rows)
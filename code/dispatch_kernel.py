@@ -0,0 +1,473 @@
+# DISPATCH KERNEL
+#
+# This file contains an array version of the hourly loop of sim7 and sim8
+# (production with a buying threshold, exports and imports with Spain,
+# reconversion with a selling threshold and, in sim8, selling H2 when the
+# storage is full). Instead of iterating the dataframe rows, the loop runs
+# over contiguous float arrays addressed by position and is compiled with
+# numba when it is installed.
+#
+# The state of the dispatch (storage levels and accumulators) is kept in a
+# small array, so a year can be run in pieces, continued with a different
+# year or restarted from any hour.
+
+import numpy as np
+import pandas as pd
+
+from system_parameters import LHV_H2
+from schema import validate_hourly, column_array, hourly_data
+
+try:
+    from numba import njit
+except ImportError:
+    # Without numba the kernel runs as plain python (same results, slower)
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda function: function
+
+
+# Hourly input columns (MW and €/MWh, as in the scenario sheets)
+H_BALANCE_PT = 0
+H_BALANCE_ES = 1
+H_PT_COST = 2
+H_ES_COST = 3
+HOURLY_COLUMNS = ["PT Balance [MW]", "ES Balance [MW]", "PT Marginal Cost [€]", "ES Marginal Cost [€]"]
+
+# Parameters
+P_EFF_ELECTROLYZER = 0
+P_EFF_FUEL_CELL = 1
+P_CAP_STORAGE = 2
+P_THRESHOLD_BUYING = 3
+P_THRESHOLD_SELLING = 4
+P_H2_PRICE = 5
+P_SELLING = 6              # 1 sells H2 when the storage is full (sim8)
+P_TRACK_RESERVOIRS = 7     # 0 reproduces sim7, where a single open reservoir is not updated
+P_MAX_PRICE_DIFF = 8
+P_N_RESERVOIRS = 9
+P_CAP_ELECTROLYZER = 10    # kW of electricity the electrolyzers can take (inf = no limit, as in sim7/sim8)
+P_CAP_FUEL_CELL = 11       # kW the fuel cells can deliver (inf = no limit, as in sim7/sim8)
+N_PARAMETERS = 12
+
+# Reservoir fields, stored in the parameters after N_PARAMETERS (one block of N_RESERVOIR_FIELDS per reservoir)
+R_CAPACITY = 0             # kg
+R_SHARE = 1                # share of the electricity sent to the reservoir when several are available
+R_ELEC_PER_KG = 2          # electrolysis + compression (kWh/kgH2)
+R_CHARGE_EFFICIENCY = 3    # compression yield when the reservoir is charged alone
+R_STORAGE_EFFICIENCY = 4
+N_RESERVOIR_FIELDS = 5
+RESERVOIR_COLUMNS = [
+    "Capacity (kg)", "Share (%)", "Consumption (kWh/kgH2)", "Charge Efficiency (%)", "Storage Efficiency (%)",
+]
+
+# State (the level of every reservoir follows the fixed entries)
+S_STORAGE = 0
+S_TOTAL_DEFICITS = 1
+S_H2_CONVERTED = 2
+S_H2_SOLD = 3
+S_REVENUE = 4
+S_LEVELS = 5
+N_STATE = 5
+
+# Hourly outputs
+O_H2_PRODUCED = 0
+O_H2_PRODUCED_P2G2P = 1
+O_H2_CONVERTED = 2
+O_STORAGE = 3
+O_ELEC_USED = 4
+O_ELEC_FROM_H2 = 5
+O_ELEC_RECOVERED = 6
+O_H2_SOLD = 7
+O_ELEC_SOLD = 8
+O_REVENUE = 9
+O_ELEC_TOTAL = 10
+N_OUTPUTS = 11
+OUTPUT_COLUMNS = [
+    "H2_produced [kg]", "H2_produced_P2G2P [kg]", "H2_converted [kg]", "Storage H2 [kg]",
+    "Elec_used_for_H2 [kWh]", "Elec_from_H2 [kWh]", "Elec_recovered [kWh]",
+    "H2_sold [kg]", "Elec_used_for_H2_sold [kWh]", "Revenue_H2_sold [€]", "Elec_used_total [kWh]",
+]
+
+
+# Function that describes the reservoirs of a system_parameters dictionary
+# Returns a dataframe indexed by reservoir with the RESERVOIR_COLUMNS (salt caverns and/or pressurised tanks)
+def storage_reservoirs(params):
+
+    caverns = [
+        params["cap_storage_caverns"], params["storage_saltCaverns_percentage"],
+        params["eff_electrolyzer"] + params["comsumption_compressors_saltCaverns"],
+        params["eff_compressors_saltCaverns"], params["eff_storage_saltCaverns"],
+    ]
+    tanks = [
+        params["cap_storage_tanks"], params["storage_pressurisedTanks_percentage"],
+        params["eff_electrolyzer"], 1.0, params["eff_storage_pressurisedTanks"],
+    ]
+
+    if params["storage_ratio"] == 100:
+        rows = {"Salt Caverns": caverns}
+    elif params["storage_ratio"] == 0:
+        rows = {"Pressurised Tanks": tanks}
+    else:
+        rows = {"Salt Caverns": caverns, "Pressurised Tanks": tanks}
+    return pd.DataFrame.from_dict(rows, orient="index", columns=RESERVOIR_COLUMNS)
+
+
+# Function that converts the dictionary of system_parameters into the kernel parameter array
+# reservoirs is a dataframe like the one of storage_reservoirs (line-pack, LOHC, ... can be added as rows);
+# by default the caverns and tanks of params are used
+# With power_limits the electrolyzers and fuel cells are limited to their capacities (as in rolling_horizon)
+def kernel_parameters(params, selling=True, track_reservoirs=True, max_price_diff=0.2, reservoirs=None, power_limits=False):
+
+    if reservoirs is None:
+        reservoirs = storage_reservoirs(params)
+        cap_storage_kg = params["cap_storage_kg"]
+    else:
+        cap_storage_kg = reservoirs["Capacity (kg)"].sum()
+
+    p = np.zeros(N_PARAMETERS + N_RESERVOIR_FIELDS * len(reservoirs))
+    p[P_EFF_ELECTROLYZER] = params["eff_electrolyzer"]
+    p[P_EFF_FUEL_CELL] = params["eff_fuel_cell"]
+    p[P_CAP_STORAGE] = cap_storage_kg
+    p[P_THRESHOLD_BUYING] = params["threshold_buying"]
+    p[P_THRESHOLD_SELLING] = params["threshold_selling"]
+    p[P_H2_PRICE] = params["h2_sellingPrice"]
+    p[P_SELLING] = 1 if selling else 0
+    p[P_TRACK_RESERVOIRS] = 1 if track_reservoirs else 0
+    p[P_MAX_PRICE_DIFF] = max_price_diff
+    p[P_N_RESERVOIRS] = len(reservoirs)
+    p[P_CAP_ELECTROLYZER] = params["cap_electrolyzer"] * 1000 if power_limits else np.inf
+    p[P_CAP_FUEL_CELL] = params["cap_fuel_cell"] * 1000 if power_limits else np.inf
+    p[N_PARAMETERS:] = reservoirs[RESERVOIR_COLUMNS].to_numpy(dtype=np.float64).ravel()
+    return p
+
+
+# Function that returns the initial state of the dispatch (empty storage) for a parameter array
+def initial_state(p):
+
+    return np.zeros(N_STATE + int(p[P_N_RESERVOIRS]))
+
+
+# Function that checks a scenario dataframe and stacks its hourly columns into a contiguous array
+# validated=True skips the check, for the dataframes of schema.hourly_data (already checked when loaded)
+def hourly_array(df, source="hourly data", validated=False):
+
+    return column_array(df if validated else validate_hourly(df, source), HOURLY_COLUMNS)
+
+
+# Charges the storage with the electricity available (kWh)
+# Returns (h2_produced, electricity_used) and updates the reservoirs in the state
+@njit(cache=True)
+def charge_storage(electricity_available, p, state):
+
+    n = int(p[P_N_RESERVOIRS])
+    storage = state[S_STORAGE]
+
+    if n == 1: # A single reservoir holds the whole storage
+        r = N_PARAMETERS
+        h2_produced = electricity_available / p[r + R_ELEC_PER_KG]
+        if storage + h2_produced > p[r + R_CAPACITY]:
+            h2_produced = p[r + R_CAPACITY] - storage
+            electricity_used = (h2_produced / p[r + R_CHARGE_EFFICIENCY]) * p[r + R_ELEC_PER_KG]
+        else:
+            electricity_used = electricity_available
+        state[S_STORAGE] = storage + h2_produced
+        state[S_LEVELS] = state[S_STORAGE]
+        return h2_produced, electricity_used
+
+    # Reservoirs that are not full
+    n_open = 0
+    last_open = 0
+    for i in range(n):
+        if state[S_LEVELS + i] != p[N_PARAMETERS + i * N_RESERVOIR_FIELDS + R_CAPACITY]:
+            n_open += 1
+            last_open = i
+
+    if n_open == 0:
+        return 0.0, 0.0
+
+    if n_open == 1: # The others are full, store only in this one
+        r = N_PARAMETERS + last_open * N_RESERVOIR_FIELDS
+        level = state[S_LEVELS + last_open]
+        h2_produced = electricity_available / p[r + R_ELEC_PER_KG] * p[r + R_CHARGE_EFFICIENCY]
+        if level + h2_produced > p[r + R_CAPACITY]:
+            h2_produced = p[r + R_CAPACITY] - level
+            electricity_used = (h2_produced / p[r + R_CHARGE_EFFICIENCY]) * p[r + R_ELEC_PER_KG]
+        else:
+            electricity_used = electricity_available
+        if p[P_TRACK_RESERVOIRS] == 1:
+            state[S_LEVELS + last_open] += h2_produced
+        state[S_STORAGE] = storage + h2_produced
+        return h2_produced, electricity_used
+
+    # Several reservoirs are available: split the electricity by their shares (among the open ones)
+    share_open = 0.0
+    for i in range(n):
+        if state[S_LEVELS + i] != p[N_PARAMETERS + i * N_RESERVOIR_FIELDS + R_CAPACITY]:
+            share_open += p[N_PARAMETERS + i * N_RESERVOIR_FIELDS + R_SHARE]
+
+    available = np.empty(n)
+    stored = np.empty(n)
+    remaining = np.empty(n)
+    for i in range(n):
+        r = N_PARAMETERS + i * N_RESERVOIR_FIELDS
+        available[i] = p[r + R_CAPACITY] - state[S_LEVELS + i]
+        target_energy = 0.0
+        if available[i] != 0:
+            share = p[r + R_SHARE] if n_open == n else p[r + R_SHARE] / share_open
+            target_energy = electricity_available * share
+        stored[i] = min(target_energy / p[r + R_ELEC_PER_KG], available[i])
+        remaining[i] = max(0.0, target_energy - (stored[i] * p[r + R_ELEC_PER_KG]))
+        available[i] -= stored[i]
+
+    # The electricity a reservoir could not take goes to the others with space left (single pass)
+    for i in range(n):
+        for j in range(n):
+            if j != i and available[j] > 0:
+                elec_per_kg = p[N_PARAMETERS + j * N_RESERVOIR_FIELDS + R_ELEC_PER_KG]
+                extra = min(remaining[i] / elec_per_kg, available[j])
+                stored[j] += extra
+                available[j] -= extra
+                remaining[i] -= extra * elec_per_kg
+
+    h2_produced = 0.0
+    electricity_used = 0.0
+    for i in range(n):
+        state[S_LEVELS + i] += stored[i]
+        h2_produced += stored[i]
+        electricity_used += stored[i] * p[N_PARAMETERS + i * N_RESERVOIR_FIELDS + R_ELEC_PER_KG]
+
+    state[S_STORAGE] = storage + h2_produced
+    return h2_produced, electricity_used
+
+
+# Uses the stored H2 to cover a deficit (kWh)
+# Returns (h2_converted, energy_recovered) and updates the reservoirs in the state
+@njit(cache=True)
+def discharge_storage(deficit_energy, p, state):
+
+    eff_fuel_cell = p[P_EFF_FUEL_CELL]
+    n = int(p[P_N_RESERVOIRS])
+    storage = state[S_STORAGE]
+
+    h2_needed_fuelCell = (deficit_energy) / (eff_fuel_cell * LHV_H2)
+
+    if n == 1: # A single reservoir holds the whole storage
+        eff_storage = p[N_PARAMETERS + R_STORAGE_EFFICIENCY]
+        h2_converted = min(storage, h2_needed_fuelCell / eff_storage)
+        energy_recovered = min((h2_converted * eff_storage * eff_fuel_cell * LHV_H2), deficit_energy)
+        state[S_STORAGE] = storage - h2_converted
+        state[S_LEVELS] = state[S_STORAGE]
+        return h2_converted, energy_recovered
+
+    # H2 that can reach the fuel cells from all the reservoirs
+    deliverable = 0.0
+    for i in range(n):
+        deliverable += state[S_LEVELS + i] * p[N_PARAMETERS + i * N_RESERVOIR_FIELDS + R_STORAGE_EFFICIENCY]
+    h2_to_convert = min(h2_needed_fuelCell, deliverable)
+
+    # Every reservoir contributes in proportion to its level
+    h2_converted = 0.0
+    for i in range(n):
+        eff_storage = p[N_PARAMETERS + i * N_RESERVOIR_FIELDS + R_STORAGE_EFFICIENCY]
+        level = state[S_LEVELS + i]
+        proportion = level / storage if storage > 0 else 0.0
+        h2_from_reservoir = min(h2_to_convert * proportion / eff_storage, level)
+        h2_converted += h2_from_reservoir * eff_storage
+        state[S_LEVELS + i] = level - h2_from_reservoir
+
+    energy_recovered = min((h2_converted * eff_fuel_cell * LHV_H2), deficit_energy)
+
+    storage = 0.0
+    for i in range(n):
+        storage += state[S_LEVELS + i]
+    state[S_STORAGE] = storage
+    return h2_converted, energy_recovered
+
+
+# Dispatches one hour: reads the row t of hourly, updates the state and writes the row t of out
+@njit(cache=True)
+def dispatch_hour(hourly, t, p, state, out):
+
+    balance_pt = hourly[t, H_BALANCE_PT] * 1000
+    balance_es = hourly[t, H_BALANCE_ES] * 1000
+    pt_electricityCost = hourly[t, H_PT_COST]
+    es_electricityCost = hourly[t, H_ES_COST]
+    threshold_buying = p[P_THRESHOLD_BUYING]
+
+    if pt_electricityCost > 0:
+        price_diff = abs(pt_electricityCost - es_electricityCost) / pt_electricityCost
+    elif es_electricityCost > 0:
+        price_diff = abs(es_electricityCost - pt_electricityCost) / es_electricityCost
+    else:
+        price_diff = 0.0
+    can_exchange = price_diff <= p[P_MAX_PRICE_DIFF]
+
+    for k in range(N_OUTPUTS):
+        out[t, k] = 0.0
+
+    ###########
+    # SURPLUS #
+    ###########
+    if balance_pt >= 1:
+        if pt_electricityCost <= threshold_buying:
+            if balance_es < -1 and can_exchange:
+                max_export = min(balance_pt, abs(balance_es))
+                balance_pt -= max_export
+                balance_es += max_export
+
+            if balance_pt >= 1:
+                electricity_available = min(balance_pt, p[P_CAP_ELECTROLYZER])
+                electricity_used = 0.0
+                electricity_toSellH2 = 0.0
+                h2_produced = 0.0
+                h2_toSell = 0.0
+
+                if state[S_STORAGE] < p[P_CAP_STORAGE]: # There is storage place available
+                    h2_produced, electricity_used = charge_storage(electricity_available, p, state)
+                    out[t, O_H2_PRODUCED_P2G2P] = h2_produced
+                    out[t, O_ELEC_USED] = electricity_used
+
+                if p[P_SELLING] == 1 and state[S_STORAGE] >= p[P_CAP_STORAGE] * 0.999 and electricity_used < electricity_available: # Storage is full, sell H2
+                    electricity_toSellH2 = electricity_available - electricity_used
+                    h2_toSell = electricity_toSellH2 / p[P_EFF_ELECTROLYZER]
+                    revenue = h2_toSell * p[P_H2_PRICE]
+                    state[S_H2_SOLD] += h2_toSell
+                    state[S_REVENUE] += revenue
+                    out[t, O_H2_SOLD] = h2_toSell
+                    out[t, O_ELEC_SOLD] = electricity_toSellH2
+                    out[t, O_REVENUE] = revenue
+
+                out[t, O_ELEC_TOTAL] = electricity_toSellH2 + electricity_used
+                out[t, O_H2_PRODUCED] = h2_produced + h2_toSell
+
+    ###########
+    # DEFICIT #
+    ###########
+    else:
+        deficit_energy = abs(balance_pt)
+        state[S_TOTAL_DEFICITS] += deficit_energy
+        energy_imported = 0.0
+        energy_recovered = 0.0
+
+        if es_electricityCost < threshold_buying and can_exchange and balance_es > 0:
+            energy_imported = min(balance_es, deficit_energy)
+            deficit_energy -= energy_imported
+
+        if deficit_energy > 0 and pt_electricityCost >= p[P_THRESHOLD_SELLING]:
+
+            if state[S_STORAGE] > 0: # If there is H2 stored to cover the deficit
+                h2_converted, energy_recovered = discharge_storage(min(deficit_energy, p[P_CAP_FUEL_CELL]), p, state)
+                state[S_H2_CONVERTED] += h2_converted
+                out[t, O_H2_CONVERTED] = h2_converted
+                out[t, O_ELEC_FROM_H2] = energy_recovered
+
+            if (deficit_energy - energy_recovered) > 0 and energy_imported == 0 and balance_es > 0 and can_exchange:
+                remaining_deficit = deficit_energy - energy_recovered
+                energy_imported += min(balance_es, remaining_deficit)
+
+            out[t, O_ELEC_RECOVERED] = energy_recovered + energy_imported
+
+    out[t, O_STORAGE] = state[S_STORAGE]
+
+
+# Dispatches the hours [start, stop) of the hourly array
+@njit(cache=True)
+def dispatch_range(hourly, p, state, out, start, stop):
+
+    for t in range(start, stop):
+        dispatch_hour(hourly, t, p, state, out)
+
+
+# Function that runs the dispatch over a full hourly array
+# Returns the hourly outputs and the final state (the given state is not modified)
+def run_dispatch(hourly, p, state=None):
+
+    state = initial_state(p) if state is None else state.copy()
+    out = np.zeros((hourly.shape[0], N_OUTPUTS))
+    dispatch_range(hourly, p, state, out, 0, hourly.shape[0])
+    return out, state
+
+
+# Function that computes the yearly indicators of sim7/sim8 from the hourly outputs
+def summarize(out, hourly, p, state, capex_total, opex_total):
+
+    # Column by column, so the sums are the same as the legacy dataframe sums
+    totals = np.array([out[:, k].sum() for k in range(N_OUTPUTS)])
+    total_cost_electricity_used = (out[:, O_ELEC_USED] * hourly[:, H_PT_COST] / 1000).sum()
+    return summarize_totals(totals, total_cost_electricity_used, p, state, capex_total, opex_total)
+
+
+# Function that computes the yearly indicators from the yearly totals of every output column
+def summarize_totals(totals, total_cost_electricity_used, p, state, capex_total, opex_total):
+
+    total_deficits = state[S_TOTAL_DEFICITS]
+    total_revenue = state[S_REVENUE]
+
+    total_recovered = totals[O_ELEC_RECOVERED]
+    h2_total_production = totals[O_H2_PRODUCED]
+    h2_total_production_P2G2P = totals[O_H2_PRODUCED_P2G2P]
+
+    flex_index = (total_recovered / total_deficits) * 100 if total_deficits > 0 else 0
+    flex_index_H2 = (totals[O_ELEC_FROM_H2] / total_deficits) * 100 if total_deficits > 0 else 0
+
+    profit = total_revenue - (capex_total + opex_total + total_cost_electricity_used)
+    lcoh_P2G2P = (capex_total + opex_total + total_cost_electricity_used) / h2_total_production_P2G2P if h2_total_production_P2G2P > 0 else 0
+    lcoh_standard = (capex_total + opex_total + total_cost_electricity_used) / h2_total_production if h2_total_production > 0 else 0
+    lcoh_net = (capex_total + opex_total + total_cost_electricity_used - total_revenue) / h2_total_production if h2_total_production > 0 else 0
+    if lcoh_net < 0: lcoh_net = 0
+
+    return {
+        "Buying Threshold": p[P_THRESHOLD_BUYING],
+        "Selling Threshold": p[P_THRESHOLD_SELLING],
+        "H2 Produced (kg)": h2_total_production,
+        "H2 Converted (kg)": state[S_H2_CONVERTED],
+        "H2 Sold (kg)": state[S_H2_SOLD],
+        "Energy Recovered (kWh)": total_recovered,
+        "Electricity Cost [€]": total_cost_electricity_used,
+        "Revenue H2 Sold [€]": total_revenue,
+        "Profit [€]": profit,
+        "Yearly CAPEX [€]": capex_total,
+        "Yearly OPEX [€]": opex_total,
+        "Flexibility Index (%)": flex_index,
+        "Flexibility Index H2(%)": flex_index_H2,
+        "LCOH (€/kg)": lcoh_standard,
+        "LCOH P2G2P (€/kg)": lcoh_P2G2P,
+        "LCOH Standard (€/kg)": lcoh_standard,
+        "LCOH Net (€/kg)": lcoh_net,
+    }
+
+
+# Fast version of results_simulation of sim8 (selling=True) or sim7 (selling=False)
+# Returns the same (df, summary) as the legacy simulations
+def results_simulation(scenario, year, storage_ratio, threshold_selling, selling=True):
+
+    from system_parameters import case_parameters
+
+    # Load (and check) hourly energy data for the selected scenario and year
+    df = hourly_data(scenario, year)
+    params = case_parameters(scenario, year, storage_ratio, threshold_selling, selling=selling)
+    return results_from_dataframe(df, params, selling=selling, validated=True)
+
+
+# Function that runs the kernel for a scenario dataframe and parameters dictionary
+# run is the function that dispatches the hours (run_dispatch, or segment_dispatch.run_segments)
+# validated=True for the dataframes of schema.hourly_data (see hourly_array)
+def results_from_dataframe(df, params, selling=True, run=None, validated=False):
+
+    hourly = hourly_array(df, validated=validated)
+    p = kernel_parameters(params, selling=selling, track_reservoirs=selling)
+    out, state = (run or run_dispatch)(hourly, p)
+
+    for k, column in enumerate(OUTPUT_COLUMNS):
+        df[column] = out[:, k]
+    df["Cost_H2_production [€]"] = df["Elec_used_for_H2 [kWh]"] * df["PT Marginal Cost [€]"] / 1000
+    df["Cost_H2_production_with_selling [€]"] = df["Elec_used_total [kWh]"] * df["PT Marginal Cost [€]"] / 1000
+
+    summary = {
+        "Scenario": params["scenario"],
+        "Year": params["year"],
+        "Storage in Salt Caverns (%)": params["storage_ratio"],
+        "Storage in Pressurized Tanks (%)": (100-params["storage_ratio"]),
+    }
+    summary.update(summarize(out, hourly, p, state, params["capex_total"], params["opex_total"]))
+    return df, summary
@@ -0,0 +1,269 @@
+# DISPATCH SERVICE
+#
+# This file runs the threshold rules of the simulations live: a message
+# with the balances and prices of a step (an hour or 15 minutes) comes in
+# and the setpoints of the electrolyzers, fuel cells and H2 sales go out.
+# The state of the rule (storage, reservoirs, selling flag, accumulators)
+# stays in memory and advances one step per message, with the same
+# compiled code as the yearly simulations, so a step takes microseconds.
+# Snapshots of the state are written every few steps (in the background)
+# and a stopped service restarts from the last one. Only the newest
+# snapshots are kept in the folder.
+#
+# Two rules are available:
+#   ThresholdPolicy   sim7/sim8 (dispatch_kernel), sells H2 when the storage is full
+#   SellingPolicy     sim10, sells H2 between a start and stop level of the cavern
+#
+# replay streams the scenario sheets as messages (faster than real time
+# if asked), so the service can be tried and load-tested without a feed.
+
+import asyncio
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+import dispatch_kernel as kernel
+import checkpoint
+from schema import hourly_data
+from calendar_index import calendar_features
+from system_parameters import case_parameters
+
+# Setpoints answered for every step
+SETPOINT_COLUMNS = ["Date/Hour", "Electrolyzers (kW)", "Fuel Cells (kW)", "H2 Sold (kg)", "Storage H2 [kg]", "Selling", "Latency (µs)"]
+
+
+# sim7/sim8 rule (dispatch_kernel) for one step at a time
+# step_hours is the length of a step: the power caps (kW) are turned into the energy of the step
+class ThresholdPolicy:
+
+    def __init__(self, params, selling=True, step_hours=1.0):
+        self.step_hours = step_hours
+        self.p = kernel.kernel_parameters(params, selling=selling, track_reservoirs=selling)
+        self.p[kernel.P_CAP_ELECTROLYZER] *= step_hours
+        self.p[kernel.P_CAP_FUEL_CELL] *= step_hours
+        self.state = kernel.initial_state(self.p)
+        self.hourly = np.zeros((1, len(kernel.HOURLY_COLUMNS)))
+        self.out = np.zeros((1, kernel.N_OUTPUTS))
+
+    def parameters(self):
+        return self.p
+
+    def state_vector(self):
+        return self.state
+
+    def load_state(self, values):
+        self.state[:] = values
+
+    # values are the HOURLY_COLUMNS of the step (balances already scaled to the length of the step)
+    # Returns the energy to the electrolyzers and from the fuel cells (kWh), the H2 sold (kg), the storage and the selling flag
+    def step(self, values, hour, sunday):
+        self.hourly[0] = values
+        kernel.dispatch_hour(self.hourly, 0, self.p, self.state, self.out)
+        out = self.out[0]
+        return out[kernel.O_ELEC_TOTAL], out[kernel.O_ELEC_FROM_H2], out[kernel.O_H2_SOLD], self.state[kernel.S_STORAGE], out[kernel.O_H2_SOLD] > 0
+
+
+# sim10 rule (sim10_sellingPolicies) for one step at a time, with its selling flag
+# step_hours is the length of a step: the H2 that can be exported per hour is turned into the H2 of the step
+class SellingPolicy:
+
+    def __init__(self, params, start_selling=0.8, stop_selling=0.2, selling_hours=(8, 17), sell_on_sunday=False, export_derate=0.7,
+                 step_hours=1.0):
+        import h2sim
+        self.step_hours = step_hours
+        self.policies = h2sim.load_module("case study", "sim10_sellingPolicies")
+
+        policy = pd.DataFrame([[start_selling, stop_selling, selling_hours[0], selling_hours[1], sell_on_sunday, export_derate]],
+                              columns=self.policies.POLICY_COLUMNS)
+        self.C = self.policies.case_constants(params)
+        self.Q = self.policies.policy_array(policy, params)
+        self.Q[:, self.policies.Q_MAX_SALE] *= step_hours
+        self.storage = np.zeros(1)
+        self.flags = np.zeros(1, dtype=np.bool_)
+        self.totals = np.zeros((1, self.policies.N_TOTALS))
+        self.hourly = np.zeros((1, len(kernel.HOURLY_COLUMNS)))
+        self.hours = np.zeros(1, dtype=np.int8)
+        self.sundays = np.zeros(1, dtype=np.bool_)
+
+    def parameters(self):
+        return np.concatenate((self.C, self.Q.ravel()))
+
+    def state_vector(self):
+        return np.concatenate((self.storage, self.flags.astype(float), self.totals.ravel()))
+
+    def load_state(self, values):
+        self.storage[0] = values[0]
+        self.flags[0] = values[1] > 0
+        self.totals[0] = values[2:]
+
+    def step(self, values, hour, sunday):
+        self.hourly[0] = values
+        self.hours[0] = hour
+        self.sundays[0] = sunday
+        before = self.totals[0].copy()
+        self.policies.dispatch_policies(self.hourly, self.hours, self.sundays, self.C, self.Q, self.storage, self.flags, self.totals)
+        delta = self.totals[0] - before
+        return delta[self.policies.T_ELEC_USED], delta[self.policies.T_FROM_H2], delta[self.policies.T_SOLD], self.storage[0], bool(self.flags[0])
+
+
+# Service that answers the messages of a source with the setpoints of a policy
+# step_hours is the length of a step (0.25 for 15 minutes); the balances (MW) are turned into the energy of the step
+# and the policy must be built with the same step_hours (its hourly limits are scaled the same way)
+# snapshot_keep is the number of snapshots kept in snapshot_dir (the older ones are removed)
+class DispatchService:
+
+    def __init__(self, policy, step_hours=1.0, snapshot_dir=None, snapshot_every=24, snapshot_keep=3):
+        if policy.step_hours != step_hours:
+            raise ValueError(f"The policy is built for steps of {policy.step_hours} h, the service runs steps of {step_hours} h")
+        self.policy = policy
+        self.step_hours = step_hours
+        self.snapshot_dir = snapshot_dir
+        self.snapshot_every = snapshot_every
+        self.snapshot_keep = snapshot_keep
+        if snapshot_keep < 1:
+            raise ValueError("snapshot_keep must be at least 1")
+        if snapshot_dir:
+            os.makedirs(snapshot_dir, exist_ok=True)
+        self.steps = 0
+        self.values = np.zeros(len(kernel.HOURLY_COLUMNS))
+        self.scale = np.array([step_hours if column.endswith("[MW]") else 1.0 for column in kernel.HOURLY_COLUMNS])
+        self.parameters = policy.parameters()
+        self.fingerprint = checkpoint.run_fingerprint(np.zeros((0, len(kernel.HOURLY_COLUMNS))), self.parameters)
+
+    # Continues from the last snapshot of the folder (of the same policy and parameters)
+    def restore(self):
+        hours = checkpoint.snapshot_hours(self.snapshot_dir) if self.snapshot_dir else []
+        if not hours:
+            return False
+        snapshot = checkpoint.read_snapshot(checkpoint._snapshot_path(self.snapshot_dir, hours[-1]))
+        if snapshot["fingerprint"] != self.fingerprint:
+            raise ValueError(f"The snapshots in {self.snapshot_dir} are from other parameters")
+        self.policy.load_state(snapshot["state"])
+        self.steps = snapshot["cursor"]
+        return True
+
+    def snapshot(self):
+        return self.write_snapshot(self.steps, self.policy.state_vector().copy())
+
+    # Writes the step count and state given (copied before, so a thread can write them while the steps go on)
+    # and removes the snapshots older than the newest snapshot_keep
+    def write_snapshot(self, steps, state):
+        path = checkpoint.write_snapshot(self.snapshot_dir, steps, 0, self.parameters, state, self.fingerprint)
+        for hour in checkpoint.snapshot_hours(self.snapshot_dir)[:-self.snapshot_keep]:
+            os.remove(checkpoint._snapshot_path(self.snapshot_dir, hour))
+        return path
+
+    # Answers one message: {"PT Balance [MW]": ..., "ES Balance [MW]": ..., "PT Marginal Cost [€]": ...,
+    # "ES Marginal Cost [€]": ..., "Hour": ..., "Sunday": ...} (Hour and Sunday are only used by SellingPolicy)
+    def step(self, message):
+        start = time.perf_counter()
+        for k, column in enumerate(kernel.HOURLY_COLUMNS):
+            self.values[k] = message[column] * self.scale[k]
+        elec_in, elec_out, h2_sold, storage, selling = self.policy.step(self.values, message.get("Hour", 0), message.get("Sunday", False))
+        self.steps += 1
+
+        return {
+            "Date/Hour": message.get("Date/Hour"),
+            "Electrolyzers (kW)": elec_in / self.step_hours,
+            "Fuel Cells (kW)": elec_out / self.step_hours,
+            "H2 Sold (kg)": h2_sold,
+            "Storage H2 [kg]": storage,
+            "Selling": bool(selling),
+            "Latency (µs)": (time.perf_counter() - start) * 1e6,
+        }
+
+    # Answers the messages of an async source; sink (optional) is a coroutine function that gets the setpoints
+    # The snapshots are written by a thread of the loop, the steps do not wait for the disk (the state is copied
+    # here, between two steps, and the thread only writes the copy)
+    async def run(self, source, sink=None):
+        loop = asyncio.get_running_loop()
+        pending = None
+        async for message in source:
+            setpoints = self.step(message)
+            if sink is not None:
+                await sink(setpoints)
+            if self.snapshot_dir and self.steps % self.snapshot_every == 0:
+                if pending is not None:
+                    await pending
+                pending = loop.run_in_executor(None, self.write_snapshot, self.steps, self.policy.state_vector().copy())
+        if pending is not None:
+            await pending
+        if self.snapshot_dir:
+            self.snapshot()
+
+
+# Streams the hourly sheet of a scenario and year as messages
+# speed is how many times faster than real time (None = as fast as possible); step_minutes 15 repeats every hour 4 times
+# The first start_step steps are skipped (a service restored from a snapshot continues after them)
+async def replay(scenario, year, speed=None, step_minutes=60, start_step=0):
+
+    df = hourly_data(scenario, year)
+    calendar = calendar_features(year, df["Date/Hour"], source=(f"{scenario}.xlsx", year))
+    records = df[kernel.HOURLY_COLUMNS].to_dict("records")
+    repeats = 60 // step_minutes
+    delay = step_minutes * 60 / speed if speed else 0
+
+    for t, record in enumerate(records):
+        for k in range(repeats):
+            if t * repeats + k < start_step:
+                continue
+            message = dict(record)
+            message["Date/Hour"] = pd.Timestamp(calendar["Date/Hour"][t]) + pd.Timedelta(minutes=k * step_minutes)
+            message["Hour"] = int(calendar["Hour"][t])
+            message["Sunday"] = bool(calendar["Sunday"][t])
+            yield message
+            await asyncio.sleep(delay)
+
+
+# Function that replays a scenario and year through the service and collects the setpoints
+# Returns the setpoints of every step and a summary with the latency of the steps
+def replay_service(service, scenario, year, speed=None, step_minutes=60):
+
+    setpoints = []
+
+    async def collect(answer):
+        setpoints.append(answer)
+
+    start = time.perf_counter()
+    asyncio.run(service.run(replay(scenario, year, speed, step_minutes, service.steps), collect))
+    elapsed = time.perf_counter() - start
+
+    df = pd.DataFrame(setpoints, columns=SETPOINT_COLUMNS)
+    latency = df["Latency (µs)"]
+    summary = {
+        "Scenario": scenario,
+        "Year": year,
+        "Steps": len(df),
+        "Steps per second": len(df) / elapsed if elapsed > 0 else float("inf"),
+        "Latency p50 (µs)": latency.quantile(0.5),
+        "Latency p99 (µs)": latency.quantile(0.99),
+        "Latency max (µs)": latency.max(),
+        "H2 Sold (kg)": df["H2 Sold (kg)"].sum(),
+        "Final Storage (kg)": df["Storage H2 [kg]"].iloc[-1] if len(df) else 0.0,
+    }
+    print(f"{summary['Steps']} steps, p50 {summary['Latency p50 (µs)']:.1f} µs, p99 {summary['Latency p99 (µs)']:.1f} µs, "
+          f"{summary['Steps per second']:.0f} steps/s")
+    return df, summary
+
+
+# Function that replays a scenario and year with the sim8 rule
+def results_replay(scenario, year, storage_ratio, threshold_selling, speed=None, step_minutes=60, snapshot_dir=None):
+
+    params = case_parameters(scenario, year, storage_ratio, threshold_selling, selling=True)
+    service = DispatchService(ThresholdPolicy(params, step_hours=step_minutes / 60), step_hours=step_minutes / 60, snapshot_dir=snapshot_dir)
+    service.restore()
+    return replay_service(service, scenario, year, speed, step_minutes)
+
+
+# Function that replays a scenario and year with the sim10 rule (default selling policy of sim10)
+def results_replay_sim10(scenario, year, storage_cap, threshold_selling, speed=None, step_minutes=60, snapshot_dir=None):
+
+    import h2sim
+    sim10 = h2sim.load_module("case study", "sim10_caseStudy")
+    _, params = sim10.case_study_parameters(scenario, year, storage_cap, threshold_selling)
+
+    service = DispatchService(SellingPolicy(params, step_hours=step_minutes / 60), step_hours=step_minutes / 60, snapshot_dir=snapshot_dir)
+    service.restore()
+    return replay_service(service, scenario, year, speed, step_minutes)
@@ -6,25 +6,33 @@ scenarios = ["NT", "GA", "DE"]
 years = [2030, 2035, 2040, 2050]
 storage_ratios = [100, 60, 50, 0]
 
-summaries = []
-
-for scenario in scenarios:
-    for year in years:
-        if scenario == "NT" and year == 2035:
-            continue  # Skip NT in 2035 if you don't have it this year
-        if scenario == "NT" and year == 2050:
-            continue  # Skip NT in 2050 if you don't have it this year
-        if scenario == "GA" and year == 2030:
-            continue  # Skip GA in 2030 if you don't have it this year
-        if scenario == "DE" and year == 2030:
-            continue  # Skip DE in 2030 if you don't have it this year
-        for ratio in storage_ratios:
-            print(f"Running: {scenario} {year} ({ratio}% Salt Caverns)")
-            df, summary = results_simulation(scenario, year, ratio)
-            summaries.append(summary)
-
-
-df_summary = pd.DataFrame(summaries)
-
-df_summary.to_excel("sim5_results.xlsx", sheet_name = "Results", index=False)
-print("\nResultados guardados em 'sim_results.xlsx'")
+
+def run_sweep(scenarios=scenarios, years=years, storage_ratios=storage_ratios, output_file="sim5_results.xlsx"):
+
+    summaries = []
+
+    for scenario in scenarios:
+        for year in years:
+            if scenario == "NT" and year == 2035:
+                continue  # Skip NT in 2035 if you don't have it this year
+            if scenario == "NT" and year == 2050:
+                continue  # Skip NT in 2050 if you don't have it this year
+            if scenario == "GA" and year == 2030:
+                continue  # Skip GA in 2030 if you don't have it this year
+            if scenario == "DE" and year == 2030:
+                continue  # Skip DE in 2030 if you don't have it this year
+            for ratio in storage_ratios:
+                print(f"Running: {scenario} {year} ({ratio}% Salt Caverns)")
+                df, summary = results_simulation(scenario, year, ratio)
+                summaries.append(summary)
+
+
+    df_summary = pd.DataFrame(summaries)
+
+    df_summary.to_excel(output_file, sheet_name = "Results", index=False)
+    print(f"\nResultados guardados em '{output_file}'")
+    return df_summary
+
+
+if __name__ == "__main__":
+    run_sweep()
@@ -1,5 +1,6 @@
 import pandas as pd
-from sim6_H2orImport import results_simulation  
+from sim6_H2orImport import results_simulation
+from thresholds import threshold_table, check_sizing
 
 scenarios = ["NT", "GA", "DE"]
 years = [2030, 2035, 2040, 2050]
@@ -7,43 +8,54 @@ storage_ratios = [100, 60, 50, 0]
 threshold_sheet_name = "Threshold"
 
 
-summaries = []
-
-
-for scenario in scenarios:
-    print(f"\n--- Processing scenario: {scenario} ---")
-
-
-    df_thresholds = pd.read_excel(f"{scenario}.xlsx", threshold_sheet_name)
-
-    for _, row in df_thresholds.iterrows():
-        year = int(row["Years"])
-
-        # Read the 3 thresholds
-        thresholds = [
-            row["Avg Electricity Cost [€/MWh]"],
-            row["Avg Electricity Cost During Deficits [€/MWh]"],
-            row["Manual Threshold [€/MWh]"]
-        ]
-        threshold_labels = ["Average Cost", "Deficit Cost", "Manual Threshold"]
-
-        for threshold, label in zip(thresholds, threshold_labels):
-            for ratio in storage_ratios:
-                print(f"Running: {scenario} {year} | Threshold: {label} ({threshold:.2f}) | Storage: {ratio}% Salt Caverns")
-
-                try:
-                    df, summary = results_simulation(scenario, year, ratio, threshold)
-                    summary["Scenario"] = scenario
-                    summary["Year"] = year
-                    summary["Storage in Salt Caverns (%)"] = ratio
-                    summary["Storage in Pressurized Tanks (%)"] = 100 - ratio
-                    summary["Threshold Type"] = label
-                    summary["Threshold Value"] = threshold
-                    summaries.append(summary)
-                except Exception as e:
-                    print(f"Erro em {scenario}-{year}-{threshold} ({ratio}%): {e}")
-
-
-df_summary = pd.DataFrame(summaries)
-df_summary.to_excel("sim6_results.xlsx", sheet_name="Results", index=False)
-print("\nResultados guardados em 'sim6_results.xlsx'")
+def run_sweep(scenarios=scenarios, storage_ratios=storage_ratios, threshold_sheet_name=threshold_sheet_name, output_file="sim6_results.xlsx", years=years, derived_thresholds=False):
+
+    summaries = []
+
+    for scenario in scenarios:
+        print(f"\n--- Processing scenario: {scenario} ---")
+
+        # Thresholds derived from the hourly data (threshold registry) or read from the sheet of the scenario
+        if derived_thresholds:
+            df_thresholds = threshold_table(scenario, years, threshold_sheet_name)
+            check_sizing(scenario, df_thresholds, "sim4_threshold_results.xlsx")
+        else:
+            df_thresholds = pd.read_excel(f"{scenario}.xlsx", threshold_sheet_name)
+
+        for _, row in df_thresholds.iterrows():
+            year = int(row["Years"])
+
+            # Read the 3 thresholds
+            thresholds = [
+                row["Avg Electricity Cost [€/MWh]"],
+                row["Avg Electricity Cost During Deficits [€/MWh]"],
+                row["Manual Threshold [€/MWh]"]
+            ]
+            threshold_labels = ["Average Cost", "Deficit Cost", "Manual Threshold"]
+
+            for threshold, label in zip(thresholds, threshold_labels):
+                if pd.isna(threshold):
+                    continue
+                for ratio in storage_ratios:
+                    print(f"Running: {scenario} {year} | Threshold: {label} ({threshold:.2f}) | Storage: {ratio}% Salt Caverns")
+
+                    try:
+                        df, summary = results_simulation(scenario, year, ratio, threshold)
+                        summary["Scenario"] = scenario
+                        summary["Year"] = year
+                        summary["Storage in Salt Caverns (%)"] = ratio
+                        summary["Storage in Pressurized Tanks (%)"] = 100 - ratio
+                        summary["Threshold Type"] = label
+                        summary["Threshold Value"] = threshold
+                        summaries.append(summary)
+                    except Exception as e:
+                        print(f"Erro em {scenario}-{year}-{threshold} ({ratio}%): {e}")
+
+    df_summary = pd.DataFrame(summaries)
+    df_summary.to_excel(output_file, sheet_name="Results", index=False)
+    print(f"\nResultados guardados em '{output_file}'")
+    return df_summary
+
+
+if __name__ == "__main__":
+    run_sweep()
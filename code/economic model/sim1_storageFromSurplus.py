@@ -9,6 +9,7 @@
 
 import pandas as pd
 from extract_data import get_data, df_electrolyzers, df_NT_installed_cap, df_fuel_cells, df_GA_installed_cap, df_DE_installed_cap
+from episodes import scenario_episodes
 
 def storage_simulation(scenario, year):
 
@@ -36,8 +37,6 @@ def storage_simulation(scenario, year):
     storage_list = []  # to track storage levels hour by hour
     h2_total_production = 0
     h2_total_conversion = 0
-    longest_positive_interval = 0
-    current_interval = 0
 
     # Create columns for outputs
     df["H2_produced [kg]"] = 0.0
@@ -54,7 +53,6 @@ def storage_simulation(scenario, year):
             storage += h2_produced # Updates the current stored H2 value
             h2_total_production += h2_produced # Updates the total H2 produced
             df.at[i, "H2_produced [kg]"] = h2_produced # Stores the value of H2 produced in the df
-            current_interval += 1 # Counts how many hours there have been surpluses
 
 
         else:
@@ -65,10 +63,6 @@ def storage_simulation(scenario, year):
             storage -= h2_converted # Updates the stored value
             h2_total_conversion += h2_converted # Updates the value of the total of H2 converted
             df.at[i, "H2_converted [kg]"] = h2_converted # Stores the value of H2 converted in the df
-
-            # Update longest interval without deficit
-            longest_positive_interval = max(longest_positive_interval, current_interval) 
-            current_interval = 0
             
 
         storage_list.append(storage)  
@@ -77,6 +71,11 @@ def storage_simulation(scenario, year):
     # Final results
     max_storage = max(storage_list)
 
+    # Longest interval without deficit: surplus sequences that end with a deficit hour
+    surplus_sequences = scenario_episodes(scenario, year, "Balance with Exchanges [MW]", ">=", 1)
+    surplus_sequences = surplus_sequences[surplus_sequences["End"] < len(df) - 1]
+    longest_positive_interval = surplus_sequences["Length"].max() if len(surplus_sequences) > 0 else 0
+
     print(f"\n--- Storage Simulation Results for {scenario} {year} ---")
     print(f"Maximum H2 stored: {max_storage:.2f} kg")
     print(f"Total H2 produced: {h2_total_production:.2f} kg")
@@ -85,4 +84,5 @@ def storage_simulation(scenario, year):
     return df
 
 
-storage_simulation("NT", 2030)
\ No newline at end of file
+if __name__ == "__main__":
+    storage_simulation("NT", 2030)
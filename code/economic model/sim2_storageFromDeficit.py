@@ -8,6 +8,7 @@
 
 import pandas as pd
 from extract_data import get_data, df_electrolyzers, df_NT_installed_cap, df_fuel_cells, df_GA_installed_cap, df_DE_installed_cap, df_storage_pressurisedTanks, df_storage_saltCaverns
+from episodes import scenario_episodes
 
 def storage_simulation(scenario, year):
 
@@ -35,22 +36,22 @@ def storage_simulation(scenario, year):
     # 2. If there is deficit (1) if not (0)
     df["IsDeficit"] = (df["Balance with Exchanges [MW]"] < -1).astype(int)
 
-    # 3. Create groups of continuous sequences of deficits
-    df["DeficitGroup"] = (df["IsDeficit"] != df["IsDeficit"].shift()).cumsum()
-    deficit_sequences = df[df["IsDeficit"] == 1].groupby("DeficitGroup")
-
     if df["IsDeficit"].sum() == 0:
         print(f"\n--- {scenario} {year} Deficit Analysis ---")
         print("No significant deficits found (below 0 MW).")
         return df
 
+    # 3. Groups of continuous sequences of deficits (episode index of the scenario and year)
+    df["DeficitGroup"] = (df["IsDeficit"] != df["IsDeficit"].shift()).cumsum()
+    deficit_sequences = scenario_episodes(scenario, year, "Balance with Exchanges [MW]", "<", -1)
+
     # 4. Calculate the cumulative total by sequence
-    sequence_summaries = deficit_sequences["Balance with Exchanges [MW]"].agg(
-        TotalDeficitMW=lambda x: -x.sum(),  
-        DurationHours="count",
-        StartHour=lambda x: x.index[0],
-        EndHour=lambda x: x.index[-1]
-    )
+    sequence_summaries = pd.DataFrame({
+        "TotalDeficitMW": -deficit_sequences["Energy"],
+        "DurationHours": deficit_sequences["Length"],
+        "StartHour": deficit_sequences["Start Hour"],
+        "EndHour": deficit_sequences["End Hour"],
+    })
 
     # 5. Find the sequence with the largest accumulated deficit
     worst_sequence = sequence_summaries.sort_values("TotalDeficitMW", ascending=False).iloc[0]
@@ -74,5 +75,5 @@ def storage_simulation(scenario, year):
     return df
     
 
-storage_simulation("DE", 2050)
-
+if __name__ == "__main__":
+    storage_simulation("DE", 2050)
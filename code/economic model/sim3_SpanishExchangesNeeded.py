@@ -97,5 +97,6 @@ def storage_simulation_exchanges(scenario, year):
     print(f"Longest period without deficit: {longest_positive_interval} hours")
     return df
 
-# Example run
-storage_simulation_exchanges("NT", 2030)
\ No newline at end of file
+if __name__ == "__main__":
+    # Example run
+    storage_simulation_exchanges("NT", 2030)
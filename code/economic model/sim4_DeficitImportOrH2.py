@@ -8,6 +8,7 @@
 
 import pandas as pd
 from extract_data import get_data, df_fuel_cells, df_storage_pressurisedTanks, df_storage_saltCaverns
+from episodes import episode_index
 
 def worst_H2_deficit_sequence(scenario, year, electricity_costThreshold):
     df = get_data(str(year), f"{scenario}.xlsx", "Index")
@@ -36,15 +37,15 @@ def worst_H2_deficit_sequence(scenario, year, electricity_costThreshold):
 
     # 3. Group continuous sequences of deficits to be covered with H2
     df["H2DeficitGroup"] = (df["Use_H2"] != df["Use_H2"].shift()).cumsum()
-    h2_deficit_sequences = df[df["Use_H2"] == 1].groupby("H2DeficitGroup")
+    h2_deficit_sequences = episode_index(df["Use_H2"] == 1, df["PT Balance [MW]"], df.index)
 
     # 4. Calculate sequence summary
-    sequence_summary = h2_deficit_sequences["PT Balance [MW]"].agg(
-        TotalDeficitMW=lambda x: -x.sum(),
-        DurationHours="count",
-        StartHour=lambda x: x.index[0],
-        EndHour=lambda x: x.index[-1]
-    )
+    sequence_summary = pd.DataFrame({
+        "TotalDeficitMW": -h2_deficit_sequences["Energy"],
+        "DurationHours": h2_deficit_sequences["Length"],
+        "StartHour": h2_deficit_sequences["Start Hour"],
+        "EndHour": h2_deficit_sequences["End Hour"],
+    })
 
     # 5. Choose the worst sequence (largest total deficit)
     worst_sequence = sequence_summary.sort_values("TotalDeficitMW", ascending=False).iloc[0]
@@ -93,4 +94,5 @@ def worst_H2_deficit_sequence(scenario, year, electricity_costThreshold):
 
     return df, summary
 
-worst_H2_deficit_sequence("NT", 2030, 26)
\ No newline at end of file
+if __name__ == "__main__":
+    worst_H2_deficit_sequence("NT", 2030, 26)
@@ -6,6 +6,7 @@
 
 import pandas as pd
 from extract_data import get_data, df_electrolyzers, df_fuel_cells, df_storage_saltCaverns, df_storage_pressurisedTanks, df_compressors_saltCaverns, df_compressors_pressurisedTanks, df_NT_installed_cap, df_GA_installed_cap, df_DE_installed_cap
+from episodes import scenario_episodes
 
 def results_simulation(scenario, year, storage_ratio):
 
@@ -59,7 +60,8 @@ def results_simulation(scenario, year, storage_ratio):
     # Storage
     df["IsDeficit"] = (df["Balance with Exchanges [MW]"] < 0).astype(int)
     df["DeficitGroup"] = (df["IsDeficit"] != df["IsDeficit"].shift()).cumsum() * df["IsDeficit"]
-    worst_deficit_duration = df[df["IsDeficit"] == 1].groupby("DeficitGroup").size().max()
+    deficit_sequences = scenario_episodes(scenario, year, "Balance with Exchanges [MW]", "<", 0)
+    worst_deficit_duration = deficit_sequences["Length"].max()
 
     cap_storage = installed_cap_df.loc[year, "Storage (MWH2)"]  * worst_deficit_duration
 
@@ -425,4 +425,5 @@ def results_simulation(scenario, year, storage_ratio, electricity_costThreshold)
 
     return df, summary
 
-results_simulation("NT", 2030, 100, 39.0769405906594)
\ No newline at end of file
+if __name__ == "__main__":
+    results_simulation("NT", 2030, 100, 39.0769405906594)
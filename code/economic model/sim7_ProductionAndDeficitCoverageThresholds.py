@@ -430,4 +430,5 @@ def results_simulation(scenario, year, storage_ratio, threshold_selling):
 
     return df, summary
 
-results_simulation("DE", 2035, 100, 94)
\ No newline at end of file
+if __name__ == "__main__":
+    results_simulation("DE", 2035, 100, 94)
@@ -0,0 +1,144 @@
+# ENSEMBLE OF WEATHER YEARS
+#
+# This file runs the hydrogen system over many historical weather years
+# (30 - 40 per scenario) instead of only the milestone years. The hourly
+# data of every weather year is written once to a store of memory-mapped
+# column files, and the runner streams the years from disk, dispatches
+# each one with the compiled kernel and aggregates the yearly indicators
+# incrementally, so memory stays at a few years of data whatever the
+# size of the ensemble.
+#
+# With independent years ("reset") the years are spread over all the
+# cores; with "carry-over" the storage level and reservoirs at the end of
+# a year are the starting point of the next one, so years run in order.
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import dispatch_kernel as kernel
+
+
+# Function that writes the hourly data of each weather year to the store
+# frames is a dictionary {weather_year: dataframe with the scenario columns}
+def build_weather_store(frames, store_dir):
+
+    os.makedirs(store_dir, exist_ok=True)
+    index = {"columns": kernel.HOURLY_COLUMNS, "years": {}}
+
+    for weather_year, df in frames.items():
+        year_dir = os.path.join(store_dir, str(weather_year))
+        os.makedirs(year_dir, exist_ok=True)
+        hourly = kernel.hourly_array(df, f"weather year {weather_year}")
+        for k in range(hourly.shape[1]):
+            np.save(os.path.join(year_dir, f"{k}.npy"), np.ascontiguousarray(hourly[:, k]))
+        index["years"][str(weather_year)] = len(df)
+
+    with open(os.path.join(store_dir, "index.json"), "w") as f:
+        json.dump(index, f, indent=1)
+    return index
+
+
+# Function that lists the weather years available in a store
+def weather_years(store_dir):
+
+    with open(os.path.join(store_dir, "index.json")) as f:
+        return sorted(int(year) for year in json.load(f)["years"])
+
+
+# Function that reads the hourly array of one weather year from the store
+# The columns are memory-mapped and only copied into the contiguous array used by the kernel
+def load_weather_year(store_dir, weather_year):
+
+    year_dir = os.path.join(store_dir, str(weather_year))
+    columns = [np.load(os.path.join(year_dir, f"{k}.npy"), mmap_mode="r") for k in range(len(kernel.HOURLY_COLUMNS))]
+    hourly = np.empty((len(columns[0]), len(columns)))
+    for k, column in enumerate(columns):
+        hourly[:, k] = column
+    return hourly
+
+
+# Running statistics (count, mean, variance, min, max) updated one value at a time (Welford)
+class RunningStatistics:
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+
+    def update(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def std(self):
+        return (self.m2 / (self.count - 1)) ** 0.5 if self.count > 1 else 0.0
+
+
+# Dispatches one weather year and returns its yearly indicators and final state
+def _run_year(store_dir, weather_year, p, state, capex_total, opex_total):
+
+    hourly = load_weather_year(store_dir, weather_year)
+    start_state = kernel.initial_state(p) if state is None else state.copy()
+    # The yearly accumulators restart every year, the storage is what carries over
+    start_state[kernel.S_TOTAL_DEFICITS:kernel.S_LEVELS] = 0.0
+    out, end_state = kernel.run_dispatch(hourly, p, start_state)
+    summary = kernel.summarize(out, hourly, p, end_state, capex_total, opex_total)
+    summary["Weather Year"] = weather_year
+    summary["Final Storage (kg)"] = end_state[kernel.S_STORAGE]
+    return summary, end_state
+
+
+# Function that runs the ensemble of weather years for one set of parameters (system_parameters dictionary)
+# mode is "reset" (every year starts with empty storage) or "carry-over"
+# Returns a dataframe with the statistics of every indicator and, if keep_years, the indicators of every year
+def run_ensemble(store_dir, params, mode="reset", selling=True, workers=None, keep_years=True, years=None):
+
+    if mode not in ("reset", "carry-over"):
+        raise ValueError(f"Unknown ensemble mode: {mode}")
+
+    years = weather_years(store_dir) if years is None else years
+    p = kernel.kernel_parameters(params, selling=selling, track_reservoirs=selling)
+    capex_total, opex_total = params["capex_total"], params["opex_total"]
+
+    statistics = {}
+    yearly = []
+
+    def collect(summary):
+        for key, value in summary.items():
+            if key != "Weather Year":
+                statistics.setdefault(key, RunningStatistics()).update(float(value))
+        if keep_years:
+            yearly.append(summary)
+
+    if mode == "carry-over" or workers == 1:
+        state = None
+        for weather_year in years:
+            summary, end_state = _run_year(store_dir, weather_year, p, state, capex_total, opex_total)
+            state = end_state if mode == "carry-over" else None
+            collect(summary)
+    else:
+        workers = workers or os.cpu_count()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # At most two years per worker are in flight, so memory does not grow with the ensemble
+            pending = []
+            for weather_year in years:
+                pending.append(executor.submit(_run_year, store_dir, weather_year, p, None, capex_total, opex_total))
+                if len(pending) >= 2 * workers:
+                    collect(pending.pop(0).result()[0])
+            for future in pending:
+                collect(future.result()[0])
+
+    df_statistics = pd.DataFrame(
+        [[s.mean, s.std(), s.min, s.max, s.count] for s in statistics.values()],
+        index=list(statistics), columns=["Mean", "Std", "Min", "Max", "Years"]
+    )
+    return df_statistics, yearly
@@ -0,0 +1,93 @@
+# EPISODES
+#
+# This file builds the index of the continuous runs (episodes) of an
+# hourly series: sequences of surplus or deficit hours under a given
+# condition (< 0, < -1, >= 1, ...). For every run it keeps the start,
+# end, length, energy, minimum and maximum, so the statistics of the
+# simulations (longest period without deficit, worst deficit sequence,
+# ...) are computed on a few hundred runs instead of 8760 hours.
+#
+# The index of a scenario-year is computed once per session and reused,
+# until the scenario file is modified.
+
+import os
+import numpy as np
+import pandas as pd
+
+# Comparison used to mark the hours of an episode
+CONDITIONS = {
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+}
+
+# Indexes already computed: {(scenario, year, column, condition, threshold, file mtime): df}
+_episodes = {}
+
+
+# Function that finds the runs of True in a boolean mask
+# Returns the positions of the first and last hour of every run
+def runs(mask):
+
+    mask = np.asarray(mask, dtype=bool)
+    edges = np.diff(np.concatenate(([False], mask, [False])).astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    return starts, ends
+
+
+# Function that sums the values of every run
+# Each run is summed on its own, so the energies are the same as the pandas sums of the simulations
+def run_sums(values, starts, lengths):
+
+    return np.array([values[start:start + length].sum() for start, length in zip(starts, lengths)])
+
+
+# Function that builds the episode index of the hours marked in mask
+# values are the hourly values (MW) summed in "Energy"; index gives the hour labels ("Start Hour", "End Hour")
+def episode_index(mask, values, index=None):
+
+    values = np.asarray(values, dtype=float)
+    starts, ends = runs(mask)
+    index = np.arange(len(values)) if index is None else np.asarray(index)
+
+    # reduceat over [start, end + 1) for every run; the segments between runs are dropped
+    bounds = np.ravel(np.column_stack((starts, ends + 1)))
+    padded = np.append(values, 0.0)
+    if len(starts) == 0:
+        bounds = np.zeros(0, dtype=np.int64)
+
+    return pd.DataFrame({
+        "Start": starts,
+        "End": ends,
+        "Start Hour": index[starts],
+        "End Hour": index[ends],
+        "Length": ends - starts + 1,
+        "Energy": run_sums(values, starts, ends - starts + 1),
+        "Min": np.minimum.reduceat(padded, bounds)[::2] if len(starts) else np.zeros(0),
+        "Max": np.maximum.reduceat(padded, bounds)[::2] if len(starts) else np.zeros(0),
+    })
+
+
+# Function that builds the episode index of an hourly series for a condition (e.g. "<", 0)
+def series_episodes(series, condition, threshold):
+
+    values = series.to_numpy(dtype=float)
+    return episode_index(CONDITIONS[condition](values, threshold), values, series.index)
+
+
+# Function that returns the episode index of a column of the hourly sheet of a scenario and year
+# The index is computed the first time and then reused (a copy is returned)
+# The modification time of the scenario file is part of the key, so an edited file is indexed again
+def scenario_episodes(scenario, year, column="Balance with Exchanges [MW]", condition="<", threshold=0):
+
+    from extract_data import BASE_DIR
+    file_path = os.path.join(BASE_DIR, f"{scenario}.xlsx")
+    mtime = os.path.getmtime(file_path) if os.path.exists(file_path) else None
+
+    key = (scenario, year, column, condition, threshold, mtime)
+    if key not in _episodes:
+        from schema import hourly_data
+        _episodes[key] = series_episodes(hourly_data(scenario, year)[column], condition, threshold)
+    return _episodes[key].copy()
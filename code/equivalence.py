@@ -0,0 +1,534 @@
+# EQUIVALENCE
+#
+# This file checks that the fast engines give the same results as the
+# legacy simulations. Every case is run with the legacy results_simulation
+# (or read from the dissertation results in the results folder) and with
+# every fast engine of the same simulation, and the summaries (and, if
+# asked, the hourly columns) are compared within a tolerance.
+#
+# Fast engines checked:
+#   sim7    kernel (dispatch_kernel, selling=False), segments (segment_dispatch),
+#           network (network_dispatch with the nodes PT and ES, storage in tanks)
+#   sim8    kernel (dispatch_kernel, selling=True), segments, sweep (ratio_sweep),
+#           segment sweep (ratio_sweep with segments)
+#   sim10   policies (sim10_sellingPolicies with the default policy of sim10)
+#   sim4    episodes (sim4 with the episode index of episodes.py)
+#   sim5    episodes (sim5 with the episode index of episodes.py)
+#   sim6    module (sim6 as it is, only against the dissertation results)
+#   sim9    arrays (sim9 with the balances computed as arrays)
+#
+# sim4, sim5 and sim9 were rewritten in place, so their legacy reference
+# is the same module with the rewritten part put back as it was: the
+# deficit sequences grouped with pandas (sim4, sim5) and the balances
+# computed hour by hour (sim9). sim6 has no fast engine and is checked
+# against the dissertation results; sim9 only takes its cases from them
+# (the columns of sim9_results are not the ones sim9 gives).
+#
+# The divergences are listed by field and, for the hourly columns, by
+# hour and by branch of the dispatch (surplus / deficit, above or below
+# the thresholds), so a difference points to the rule that causes it.
+# A field of the reference that an engine does not give is a divergence,
+# unless it is in the list of fields that engine does not produce.
+#
+# The cases are the rows of the dissertation results (the full grid of
+# scenarios, years, storage and thresholds); the legacy runs can be spread
+# over several processes.
+
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Pathway to the results folder (next to the code folder)
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "results")
+
+# Dissertation results of every simulation: (file, sheet)
+REFERENCE_FILES = {
+    "sim7": ("sim7_results.xlsx", "Results"),
+    "sim8": ("sim8_results.xlsx", "Results"),
+    "sim10": ("sim10_CaseStudy_results.xlsx", "Case Study Results"),
+    "sim4": ("sim4_results.xlsx", "Results"),
+    "sim5": ("sim5_results.xlsx", "Results"),
+    "sim6": ("sim6_results.xlsx", "Results"),
+    "sim9": ("sim9_results.xlsx", "Results"),
+}
+
+# Simulations whose results file only gives the cases (scenarios and years), not summaries to compare
+CASES_ONLY = ["sim9"]
+
+# Simulations without a legacy reference of their own (the fast engine is the legacy simulation)
+RESULTS_ONLY = ["sim6"]
+
+# Columns of the results with the arguments of the cases
+CASE_COLUMNS = {
+    "scenario": "Scenario",
+    "year": "Year",
+    "storage_ratio": "Storage in Salt Caverns (%)",
+    "storage_cap": "Cave Capacity (ton)",
+    "threshold": "Selling Threshold",
+}
+
+# Columns of the arguments that have another name in the results of a simulation
+CASE_COLUMNS_RESULTS = {
+    "sim4": {"threshold": "Threshold ES"},
+    "sim6": {"threshold": "Threshold Value"},
+}
+
+# Columns of the results named differently in the summary of the simulation: {simulation: {results column: summary field}}
+RESULTS_FIELDS = {
+    "sim4": {"Worst H2 continous deficit (MW)": "Worst H2 continous deficit (MWh)"},
+}
+
+# Branches of the dispatch an hour can go through (from the balance, the cost and the thresholds)
+BRANCHES = ["surplus, production", "surplus, above buying threshold", "deficit, reconversion", "deficit, no reconversion"]
+
+
+def _kernel_sim7(case):
+    import dispatch_kernel as kernel
+    return kernel.results_simulation(case["scenario"], case["year"], case["storage_ratio"], case["threshold"], selling=False)
+
+
+def _kernel_sim8(case):
+    import dispatch_kernel as kernel
+    return kernel.results_simulation(case["scenario"], case["year"], case["storage_ratio"], case["threshold"], selling=True)
+
+
+def _segments_sim7(case):
+    import segment_dispatch
+    return segment_dispatch.results_simulation(case["scenario"], case["year"], case["storage_ratio"], case["threshold"], selling=False)
+
+
+# The network engine has one reservoir per node and charges the caverns with the compressor yield on every
+# hour (sim7 with 100% in caverns only applies it when the storage fills): only the cases in tanks are compared
+# sim7's "Energy Recovered (kWh)" is the deficit covered by the H2 and the imports it records
+def _network_sim7(case):
+    if case["storage_ratio"] != 0:
+        return None, None
+    from network_dispatch import results_iberia
+    _, df_nodes = results_iberia(case["scenario"], case["year"], case["storage_ratio"], case["threshold"])
+    pt = df_nodes.set_index("Node").loc["PT"]
+    return None, {
+        "H2 Produced (kg)": pt["H2 Produced (kg)"],
+        "H2 Converted (kg)": pt["H2 Converted (kg)"],
+        "Energy Recovered (kWh)": pt["Deficit Covered (kWh)"],
+        "Flexibility Index (%)": pt["Flexibility Index (%)"],
+        "Flexibility Index H2(%)": pt["Flexibility Index H2(%)"],
+    }
+
+
+def _segments_sim8(case):
+    import segment_dispatch
+    return segment_dispatch.results_simulation(case["scenario"], case["year"], case["storage_ratio"], case["threshold"], selling=True)
+
+
+def _sweep_sim8(case, segments=False):
+    from ratio_sweep import results_sweep
+    df = results_sweep(case["scenario"], case["year"], case["threshold"], storage_ratios=[case["storage_ratio"]], segments=segments)
+    return None, df.iloc[0].to_dict()
+
+
+def _segment_sweep_sim8(case):
+    return _sweep_sim8(case, segments=True)
+
+
+def _policies_sim10(case):
+    import h2sim
+    sim10 = h2sim.load_module("case study", "sim10_caseStudy")
+    policies = h2sim.load_module("case study", "sim10_sellingPolicies")
+    policy = pd.DataFrame([[sim10.START_SELLING, sim10.STOP_SELLING, sim10.SELLING_HOURS[0], sim10.SELLING_HOURS[1],
+                            sim10.SELL_ON_SUNDAY, sim10.EXPORT_DERATE]], columns=policies.POLICY_COLUMNS)
+    df = policies.results_policies(case["scenario"], case["year"], case["storage_cap"], case["threshold"], policy)
+    return None, df.iloc[0].to_dict()
+
+
+def _module_sim4(case):
+    return _run_module("sim4", case)
+
+
+def _module_sim5(case):
+    return _run_module("sim5", case)
+
+
+def _module_sim6(case):
+    return _run_module("sim6", case)
+
+
+def _arrays_sim9(case):
+    df = _run_module("sim9", case)
+    return df, _sim9_summary(df)
+
+
+# Fast engines of every simulation: {simulation: {engine: function(case) -> (hourly df or None, summary)}}
+FAST_ENGINES = {
+    "sim7": {"kernel": _kernel_sim7, "segments": _segments_sim7, "network": _network_sim7},
+    "sim8": {"kernel": _kernel_sim8, "segments": _segments_sim8, "sweep": _sweep_sim8, "segment sweep": _segment_sweep_sim8},
+    "sim10": {"policies": _policies_sim10},
+    "sim4": {"episodes": _module_sim4},
+    "sim5": {"episodes": _module_sim5},
+    "sim6": {"module": _module_sim6},
+    "sim9": {"arrays": _arrays_sim9},
+}
+
+# Fields of the reference that a fast engine does not produce: {simulation: {engine: fields}}
+# "results" are the columns of the dissertation results that no engine gives (labels of the threshold grid)
+UNPRODUCED_FIELDS = {
+    "sim7": {
+        "results": ["Threshold Type"],
+        # Flows and H2 of the node PT only: no costs, no case labels
+        "network": ["Scenario", "Year", "Storage in Salt Caverns (%)", "Storage in Pressurized Tanks (%)", "Buying Threshold",
+                    "Selling Threshold", "Electricity Cost [€]", "Yearly CAPEX [€]", "Yearly OPEX [€]", "LCOH (€/kg)"],
+    },
+    "sim8": {
+        "results": ["Threshold Type", "Threshold Value", "LCOH Adjusted (€/kg)"],
+    },
+    "sim10": {
+        "results": ["Threshold Type", "Threshold Value [€/MWh]"],
+        # Indicators of the policy grid: the parameters of the case are the same for every policy and are not repeated
+        "policies": ["Cave Capacity (ton)", "Cave Cost [€]", "H2 Selling Price [€/kg]", "Buying Threshold", "Selling Threshold"],
+    },
+    "sim4": {
+        "results": ["Threshold Type", "Threshold Value"],
+    },
+    "sim5": {},
+    "sim6": {
+        "results": ["Threshold Type", "Threshold Value"],
+    },
+    "sim9": {},
+}
+
+
+# Function that returns the fields a fast engine may leave out of its summary for a reference
+def unproduced_fields(simulation, engine, reference="legacy"):
+
+    fields = set(UNPRODUCED_FIELDS[simulation].get(engine, []))
+    if reference == "results":
+        fields.update(UNPRODUCED_FIELDS[simulation].get("results", []))
+    return fields
+
+
+# Function that lists the cases of a simulation from its dissertation results
+# Returns a list of dictionaries with the arguments of the simulation (as in h2sim)
+def reference_cases(simulation, scenarios=None, years=None):
+
+    import h2sim
+
+    file_name, sheet_name = REFERENCE_FILES[simulation]
+    df = pd.read_excel(os.path.join(RESULTS_DIR, file_name), sheet_name=sheet_name)
+    arguments = h2sim.SIMULATIONS[simulation][3]
+
+    cases = []
+    for _, row in df.iterrows():
+        case = {name: row[case_column(simulation, name)] for name in arguments}
+        case["year"] = int(case["year"])
+        if "storage_ratio" in case:
+            case["storage_ratio"] = int(case["storage_ratio"])
+        if (scenarios is None or case["scenario"] in scenarios) and (years is None or case["year"] in years):
+            if case not in cases:
+                cases.append(case)
+    return cases
+
+
+# Function that returns the column of the results with an argument of the cases of a simulation
+def case_column(simulation, name):
+
+    return CASE_COLUMNS_RESULTS.get(simulation, {}).get(name, CASE_COLUMNS[name])
+
+
+# Function that reads the dissertation summary of a case (the row of the results with the same arguments)
+def reference_summary(simulation, case):
+
+    if simulation in CASES_ONLY:
+        raise ValueError(f"The results of {simulation} have no summaries to compare, use the legacy reference")
+    file_name, sheet_name = REFERENCE_FILES[simulation]
+    df = pd.read_excel(os.path.join(RESULTS_DIR, file_name), sheet_name=sheet_name)
+    match = np.ones(len(df), dtype=bool)
+    for name, value in case.items():
+        column = df[case_column(simulation, name)]
+        match &= np.isclose(column, value) if isinstance(value, (int, float)) else (column == value)
+    if match.sum() != 1:
+        raise ValueError(f"{int(match.sum())} rows of {file_name} match the case {case}")
+    return df[match].rename(columns=RESULTS_FIELDS.get(simulation, {})).iloc[0].to_dict()
+
+
+# Function that runs the simulation of a case as it is registered in h2sim
+def _run_module(simulation, case):
+
+    import h2sim
+
+    folder, module_name, function_name, arguments = h2sim.SIMULATIONS[simulation]
+    function = getattr(h2sim.load_module(folder, module_name), function_name)
+    return function(*[case[name] for name in arguments])
+
+
+# Function that runs the simulation of a case with a function of its module replaced (put back afterwards)
+def _run_replaced(simulation, case, name, replacement):
+
+    import h2sim
+
+    module = h2sim.load_module(*h2sim.SIMULATIONS[simulation][:2])
+    original = getattr(module, name)
+    setattr(module, name, replacement)
+    try:
+        return _run_module(simulation, case)
+    finally:
+        setattr(module, name, original)
+
+
+# Function that groups the continuous sequences of the hours marked in mask with pandas, as sim2 / sim4 / sim5 did
+# before the episode index (same columns as episodes.episode_index)
+def _groupby_episodes(mask, values, index=None):
+
+    values = pd.Series(np.asarray(values, dtype=float), index=index)
+    flags = pd.Series(np.asarray(mask, dtype=bool).astype(int), index=values.index)
+    positions = pd.Series(np.arange(len(values)), index=values.index)
+    groups = (flags != flags.shift()).cumsum()[flags == 1]
+    sequences = values[flags == 1].groupby(groups)
+    sequence_positions = positions[flags == 1].groupby(groups)
+    return pd.DataFrame({
+        "Start": sequence_positions.first().to_numpy(),
+        "End": sequence_positions.last().to_numpy(),
+        "Start Hour": sequences.apply(lambda x: x.index[0]).to_numpy(),
+        "End Hour": sequences.apply(lambda x: x.index[-1]).to_numpy(),
+        "Length": sequences.count().to_numpy(),
+        "Energy": sequences.sum().to_numpy(),
+        "Min": sequences.min().to_numpy(),
+        "Max": sequences.max().to_numpy(),
+    })
+
+
+def _groupby_scenario_episodes(scenario, year, column="Balance with Exchanges [MW]", condition="<", threshold=0):
+    from episodes import CONDITIONS
+    from schema import hourly_data
+    series = hourly_data(scenario, year)[column]
+    return _groupby_episodes(CONDITIONS[condition](series.to_numpy(dtype=float), threshold), series, series.index)
+
+
+# Function that computes the balance left after exports and the deficits hour by hour, as sim9 did before the arrays
+def _hourly_balances(balance_pt, balance_es, pt_cost, es_cost):
+
+    final_balance = np.zeros(len(balance_pt))
+    deficit = np.zeros(len(balance_pt))
+    for i in range(len(balance_pt)):
+        if pt_cost[i] > 0:
+            price_diff = abs(pt_cost[i] - es_cost[i]) / pt_cost[i]
+        elif es_cost[i] > 0:
+            price_diff = abs(es_cost[i] - pt_cost[i]) / es_cost[i]
+        else:
+            price_diff = 0
+        if balance_pt[i] >= 1:
+            if balance_es[i] < -1 and price_diff <= 0.2:
+                final_balance[i] = balance_pt[i] - min(balance_pt[i], abs(balance_es[i]))
+            else:
+                final_balance[i] = balance_pt[i]
+        if balance_pt[i] < 0:
+            deficit[i] = balance_pt[i]
+    final_balance[final_balance < 1] = 0
+    return final_balance, deficit
+
+
+# Function that summarises the sizing of sim9 (the values it prints)
+def _sim9_summary(df):
+
+    positive = df.loc[df["Final Balance [MW]"] > 0, "Final Balance [MW]"]
+    return {
+        "Maximum Balance (MW)": df["Final Balance [MW]"].max(),
+        "Mean positive balances (MW)": positive.mean(),
+        "Minimum Deficit (MW)": abs(df["Deficits [MW]"].min()),
+        "Mean deficit (MW)": abs(df["Deficits [MW]"].mean()),
+    }
+
+
+def _groupby_sim4(case):
+    return _run_replaced("sim4", case, "episode_index", _groupby_episodes)
+
+
+def _groupby_sim5(case):
+    return _run_replaced("sim5", case, "scenario_episodes", _groupby_scenario_episodes)
+
+
+def _hourly_sim9(case):
+    df = _run_replaced("sim9", case, "final_balances", _hourly_balances)
+    return df, _sim9_summary(df)
+
+
+# Legacy references of the simulations rewritten in place: {simulation: function(case) -> (hourly df, summary)}
+LEGACY_REFERENCES = {
+    "sim4": _groupby_sim4,
+    "sim5": _groupby_sim5,
+    "sim9": _hourly_sim9,
+}
+
+
+# Function that runs the legacy simulation of a case (the results_simulation registered in h2sim, or the
+# reference in LEGACY_REFERENCES of a simulation rewritten in place)
+def legacy_results(simulation, case):
+
+    if simulation in LEGACY_REFERENCES:
+        return LEGACY_REFERENCES[simulation](case)
+    return _run_module(simulation, case)
+
+
+def _close(reference, fast, rtol, atol):
+
+    if isinstance(reference, (int, float, np.number)) and isinstance(fast, (int, float, np.number)):
+        if math.isnan(reference) or math.isnan(fast):
+            return math.isnan(reference) and math.isnan(fast)
+        if math.isinf(reference) or math.isinf(fast):
+            return reference == fast
+        return abs(fast - reference) <= atol + rtol * abs(reference)
+    return reference == fast
+
+
+# Function that compares two summaries field by field
+# A field of the reference missing from the fast summary is a divergence (Fast None) unless it is in unproduced
+# Returns the fields that differ: [{"Field", "Reference", "Fast", "Difference"}]
+def compare_summaries(reference, fast, rtol=1e-9, atol=1e-6, unproduced=()):
+
+    divergences = []
+    for field, value in reference.items():
+        if field not in fast:
+            if field not in unproduced:
+                divergences.append({"Field": field, "Reference": value, "Fast": None, "Difference": None})
+            continue
+        if _close(value, fast[field], rtol, atol):
+            continue
+        numeric = isinstance(value, (int, float, np.number)) and isinstance(fast[field], (int, float, np.number))
+        divergences.append({
+            "Field": field,
+            "Reference": value,
+            "Fast": fast[field],
+            "Difference": fast[field] - value if numeric else None,
+        })
+    return divergences
+
+
+# Function that labels every hour with the branch of the dispatch it goes through (BRANCHES)
+def branch_labels(df, threshold_buying, threshold_selling):
+
+    balance = df["PT Balance [MW]"].to_numpy() * 1000
+    cost = df["PT Marginal Cost [€]"].to_numpy()
+    conditions = [(balance >= 1) & (cost <= threshold_buying), balance >= 1, cost >= threshold_selling]
+    return np.select(conditions, BRANCHES[:3], BRANCHES[3])
+
+
+# Function that compares the hourly columns both dataframes have
+# Returns one row per divergent hour and column, with its branch
+def compare_hourly(df_reference, df_fast, threshold_buying, threshold_selling, rtol=1e-9, atol=1e-6):
+
+    branches = branch_labels(df_reference, threshold_buying, threshold_selling)
+    labels = df_reference["Date/Hour"].to_numpy() if "Date/Hour" in df_reference else np.arange(len(df_reference))
+
+    frames = []
+    for column in df_reference.columns:
+        if column not in df_fast or df_reference[column].dtype.kind != "f":
+            continue
+        reference = df_reference[column].to_numpy()
+        fast = df_fast[column].to_numpy(dtype=float)
+        different = ~np.isclose(fast, reference, rtol=rtol, atol=atol, equal_nan=True)
+        if different.any():
+            hours = np.flatnonzero(different)
+            frames.append(pd.DataFrame({
+                "Field": column,
+                "Hour": hours,
+                "Date/Hour": labels[hours],
+                "Branch": branches[hours],
+                "Reference": reference[hours],
+                "Fast": fast[hours],
+                "Difference": fast[hours] - reference[hours],
+            }))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(
+        columns=["Field", "Hour", "Date/Hour", "Branch", "Reference", "Fast", "Difference"])
+
+
+# Function that checks one case of a simulation against every fast engine
+# reference is "legacy" (run the legacy simulation) or "results" (dissertation results, summaries only)
+# Returns the divergences of the case (one row per engine and field, or hour and column)
+def check_case(simulation, case, reference="legacy", hourly=False, rtol=1e-9, atol=1e-6, engines=None):
+
+    if reference == "legacy":
+        df_reference, summary_reference = legacy_results(simulation, case)
+    elif reference == "results":
+        df_reference, summary_reference = None, reference_summary(simulation, case)
+    else:
+        raise ValueError(f"Unknown reference '{reference}' (legacy or results)")
+
+    rows = []
+    for engine, function in FAST_ENGINES[simulation].items():
+        if engines is not None and engine not in engines:
+            continue
+        df_fast, summary_fast = function(case)
+        if summary_fast is None:
+            continue
+        unproduced = unproduced_fields(simulation, engine, reference)
+        for divergence in compare_summaries(summary_reference, summary_fast, rtol, atol, unproduced):
+            rows.append(dict(case, Engine=engine, **divergence))
+        if hourly and df_reference is not None and df_fast is not None:
+            # Simulations without thresholds label every surplus hour as production and every deficit without reconversion
+            df_hourly = compare_hourly(df_reference, df_fast, summary_reference.get("Buying Threshold", np.inf),
+                                       summary_reference.get("Selling Threshold", np.inf), rtol, atol)
+            rows.extend(dict(case, Engine=engine, **row) for row in df_hourly.to_dict("records"))
+
+    return rows
+
+
+def _check_cases(simulation, cases, reference, hourly, rtol, atol, engines):
+    return [check_case(simulation, case, reference, hourly, rtol, atol, engines) for case in cases]
+
+
+# Function that checks the fast engines over the cases of the dissertation results (all by default)
+# workers > 1 splits the cases over processes (the legacy runs take most of the time)
+# Returns the divergences and a summary by simulation and engine
+def results_equivalence(simulations=("sim4", "sim5", "sim6", "sim7", "sim8", "sim9", "sim10"), reference="legacy", hourly=False, rtol=1e-9, atol=1e-6,
+                        scenarios=None, years=None, engines=None, workers=1, cases=None):
+
+    divergences = []
+    summaries = []
+    for simulation in simulations:
+        if (reference == "legacy" and simulation in RESULTS_ONLY) or (reference == "results" and simulation in CASES_ONLY):
+            print(f"{simulation:6} skipped: no {reference} reference")
+            continue
+        simulation_cases = reference_cases(simulation, scenarios, years) if cases is None else cases
+        if workers > 1 and len(simulation_cases) > workers:
+            chunks = [simulation_cases[k::workers] for k in range(workers)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = [rows for chunk in executor.map(_check_cases, [simulation] * workers, chunks, [reference] * workers,
+                                                          [hourly] * workers, [rtol] * workers, [atol] * workers,
+                                                          [engines] * workers)
+                           for rows in chunk]
+        else:
+            results = _check_cases(simulation, simulation_cases, reference, hourly, rtol, atol, engines)
+
+        for engine in FAST_ENGINES[simulation]:
+            if engines is not None and engine not in engines:
+                continue
+            rows = [[row for row in case_rows if row["Engine"] == engine] for case_rows in results]
+            summaries.append({
+                "Simulation": simulation,
+                "Engine": engine,
+                "Cases": len(simulation_cases),
+                "Divergent Cases": sum(1 for case_rows in rows if case_rows),
+                "Divergent Fields": len({row["Field"] for case_rows in rows for row in case_rows}),
+                "Divergent Hours": sum(1 for case_rows in rows for row in case_rows if "Hour" in row),
+            })
+            divergences.extend(dict(row, Simulation=simulation) for case_rows in rows for row in case_rows)
+
+    df_divergences = pd.DataFrame(divergences)
+    df_summary = pd.DataFrame(summaries)
+
+    for summary in summaries:
+        status = "OK" if summary["Divergent Cases"] == 0 else f"{summary['Divergent Cases']} divergent cases"
+        print(f"{summary['Simulation']:6} {summary['Engine']:13} {summary['Cases']:4} cases: {status}")
+    if len(df_divergences):
+        by_branch = df_divergences[df_divergences["Branch"].notna()] if "Branch" in df_divergences else df_divergences.iloc[:0]
+        if len(by_branch):
+            print(by_branch.groupby(["Simulation", "Engine", "Field", "Branch"]).size().to_string())
+
+    return df_divergences, df_summary
+
+
+if __name__ == "__main__":
+    df_divergences, df_summary = results_equivalence(hourly=True, workers=os.cpu_count() or 1)
+    if len(df_divergences):
+        print(df_divergences.head(20).to_string())
@@ -3,27 +3,47 @@
 # This file extracts the values from the excels and 
 # stores them in dataframes according to the different 
 # scenarios and equipements
+#
+# The equipment and installed capacity dataframes are only read
+# the first time they are used, so importing this file is cheap
+#
+# Every sheet is read only once per session: load_tables opens each
+# excel a single time for all the sheets asked from it (several excels
+# at the same time), and get_data returns copies of the sheets already read
 
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
+import importlib.util
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from schema import validate_table
 
 # Pathway to the folder where the file is (extract_data.py)
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Faster excel reader when python-calamine is installed (pandas >= 2.2), openpyxl otherwise
+ENGINE = "calamine" if importlib.util.find_spec("python_calamine") else None
+
+# Sheets already read: {(file_path, sheet_name, index): df}
+_loaded = {}
+
 
 # Function that gets the data from the excels and stores them in the respective dataframes
 # It receives the sheet_name where the table is found, the file_path that is the name of the excel and the index
 # that can be the years or the actual index of the table
 def get_data(sheet_name, file_path, index):
 
+    if (file_path, sheet_name, index) in _loaded:
+        return _loaded[(file_path, sheet_name, index)].copy()
+
     try:
         # Read Excel
-        df = pd.read_excel(os.path.join(BASE_DIR, file_path), sheet_name=sheet_name)
+        df = pd.read_excel(os.path.join(BASE_DIR, file_path), sheet_name=sheet_name, engine=ENGINE)
         #df = pd.read_excel(file_path, sheet_name=sheet_name)
         df.set_index(index, inplace=True)
-        return df
+        _loaded[(file_path, sheet_name, index)] = df
+        return df.copy()
     
     except FileNotFoundError:
         print(f" File '{file_path}' not found.")
@@ -34,18 +54,74 @@ def get_data(sheet_name, file_path, index):
         return None
 
 
-# This dfs store data of every equipement in study 
+# Function that reads all the sheets asked from one excel, opening it only once
+# sheets is a list of (sheet_name, index); the missing sheets are left out
+def read_workbook(file_path, sheets):
+
+    try:
+        excel = pd.ExcelFile(os.path.join(BASE_DIR, file_path), engine=ENGINE)
+    except FileNotFoundError:
+        print(f" File '{file_path}' not found.")
+        return {}
+
+    frames = {}
+    with excel:
+        for sheet_name, index in sheets:
+            if sheet_name not in excel.sheet_names:
+                print(f" The sheet '{sheet_name}' does not exist in '{file_path}'.")
+                continue
+            frames[(file_path, sheet_name, index)] = excel.parse(sheet_name).set_index(index)
+    return frames
+
+
+# Function that reads several tables at once
+# tables is a dictionary {name: (sheet_name, file_path, index)}, like TABLES; every excel is opened once
+# and the different excels are read at the same time. Returns {name: df} (None if the sheet is missing)
+def load_tables(tables, workers=4):
+
+    workbooks = {}
+    for sheet_name, file_path, index in tables.values():
+        if (file_path, sheet_name, index) not in _loaded:
+            workbooks.setdefault(file_path, []).append((sheet_name, index))
+
+    if workbooks:
+        with ThreadPoolExecutor(max_workers=min(workers, len(workbooks))) as executor:
+            for frames in executor.map(read_workbook, workbooks.keys(), workbooks.values()):
+                _loaded.update(frames)
+
+    return {
+        name: _loaded[(file_path, sheet_name, index)].copy() if (file_path, sheet_name, index) in _loaded else None
+        for name, (sheet_name, file_path, index) in tables.items()
+    }
+
+
+# Dataframes available in this module: (sheet_name, file_path, index)
+TABLES = {
+    # This dfs store data of every equipement in study 
+    "df_electrolyzers": ("Electrolyzer", "data.xlsx", "Years"),
+    "df_fuel_cells": ("Fuel Cells", "data.xlsx", "Years"),
+    "df_storage_saltCaverns": ("Storage Salt Caverns", "data.xlsx", "Years"),
+    "df_compressors_saltCaverns": ("Compressors Reciprocating", "data.xlsx", "Years"),
+    "df_storage_pressurisedTanks": ("Storage Pressurised Tanks", "data.xlsx", "Years"),
+    "df_compressors_pressurisedTanks": ("Compressor Reciprocating Piston", "data.xlsx", "Years"),
+
+    # This dfs store the installed capacity predicted of every equipement for the diferent scenairos according to the years in study 
+    "df_NT_installed_cap": ("NT Installed Capacity", "data.xlsx", "Years"),
+    "df_GA_installed_cap": ("GA Installed Capacity", "data.xlsx", "Years"),
+    "df_DE_installed_cap": ("DE Installed Capacity", "data.xlsx", "Years"),
+}
 
-df_electrolyzers = get_data("Electrolyzer","data.xlsx","Years")
-df_fuel_cells = get_data("Fuel Cells","data.xlsx","Years")
-df_storage_saltCaverns = get_data("Storage Salt Caverns","data.xlsx","Years")
-df_compressors_saltCaverns = get_data("Compressors Reciprocating","data.xlsx","Years")
-df_storage_pressurisedTanks = get_data("Storage Pressurised Tanks","data.xlsx","Years")
-df_compressors_pressurisedTanks = get_data("Compressor Reciprocating Piston","data.xlsx","Years")
 
-# This dfs store the installed capacity predicted of every equipement for the diferent scenairos according to the years in study 
+# Called for names not defined yet (e.g. "from extract_data import df_electrolyzers"):
+# reads all the TABLES in one pass, checks them and keeps them in the module
+def __getattr__(name):
 
-df_NT_installed_cap = get_data("NT Installed Capacity","data.xlsx","Years")
-df_GA_installed_cap = get_data("GA Installed Capacity","data.xlsx","Years")
-df_DE_installed_cap = get_data("DE Installed Capacity","data.xlsx","Years")
+    if name not in TABLES:
+        raise AttributeError(f"module 'extract_data' has no attribute '{name}'")
 
+    tables = load_tables(TABLES)
+    for table_name, df in tables.items():
+        sheet_name, file_path, index = TABLES[table_name]
+        validate_table(table_name, df, f"{file_path}, sheet {sheet_name}")
+    globals().update(tables)
+    return globals()[name]
@@ -0,0 +1,291 @@
+# H2SIM
+#
+# Command-line entry point for all the simulations:
+#
+#   python h2sim.py list
+#   python h2sim.py run sim8 --scenario NT --year 2040 --storage-ratio 100 --threshold 17.58
+#   python h2sim.py sweep sim10 --scenarios NT GA
+#
+# Sweeps over several machines (work_queue):
+#
+#   python h2sim.py publish sim8 --queue sqlite:sweep.db --scenarios NT GA --years 2030 2040 --storage-ratios 0 100 --thresholds 20 40
+#   python h2sim.py worker --queue sqlite:sweep.db --cache-dir /tmp/h2data
+#   python h2sim.py progress --queue sqlite:sweep.db
+#   python h2sim.py collect --queue sqlite:sweep.db --output sim8_results.xlsx
+#
+# Warm daemon (sim_daemon), the data stays in memory between runs:
+#
+#   python h2sim.py serve --preload
+#   python h2sim.py submit sim8 --scenario NT --year 2040 --storage-ratio 100 --threshold 17.58
+#
+# Only the module of the requested simulation is imported, so starting
+# the command (or asking for --help) does not load pandas or any excel.
+
+import argparse
+import importlib
+import os
+import sys
+
+# Pathway to the folder where the file is (h2sim.py)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Simulation name: (folder, module, function, arguments of the function)
+SIMULATIONS = {
+    "sim1": ("economic model", "sim1_storageFromSurplus", "storage_simulation", ["scenario", "year"]),
+    "sim2": ("economic model", "sim2_storageFromDeficit", "storage_simulation", ["scenario", "year"]),
+    "sim3": ("economic model", "sim3_SpanishExchangesNeeded", "storage_simulation_exchanges", ["scenario", "year"]),
+    "sim4": ("economic model", "sim4_DeficitImportOrH2", "worst_H2_deficit_sequence", ["scenario", "year", "threshold"]),
+    "sim5": ("economic model", "sim5_ENTSOEValues", "results_simulation", ["scenario", "year", "storage_ratio"]),
+    "sim6": ("economic model", "sim6_H2orImport", "results_simulation", ["scenario", "year", "storage_ratio", "threshold"]),
+    "sim7": ("economic model", "sim7_ProductionAndDeficitCoverageThresholds", "results_simulation", ["scenario", "year", "storage_ratio", "threshold"]),
+    "sim8": ("economic model", "sim8_SellingH2", "results_simulation", ["scenario", "year", "storage_ratio", "threshold"]),
+    "sim9": ("case study", "sim9_electrolyzerCap", "storage_simulation", ["scenario", "year"]),
+    "sim10": ("case study", "sim10_caseStudy", "results_simulation", ["scenario", "year", "storage_cap", "threshold"]),
+    "sim10-policies": ("case study", "sim10_sellingPolicies", "results_policies", ["scenario", "year", "storage_cap", "threshold"]),
+    "sim8-kernel": ("", "dispatch_kernel", "results_simulation", ["scenario", "year", "storage_ratio", "threshold"]),
+    "rolling": ("", "rolling_horizon", "results_simulation", ["scenario", "year", "storage_ratio", "threshold"]),
+    "network": ("", "network_dispatch", "results_iberia", ["scenario", "year", "storage_ratio", "threshold"]),
+    "ratios": ("", "ratio_sweep", "results_sweep", ["scenario", "year", "threshold"]),
+    "ratios-shared": ("", "shared_data", "results_sweep", ["scenario", "year", "threshold"]),
+    "archive": ("", "trace_archive", "results_archive", ["scenario", "year", "threshold"]),
+    "price-maker": ("", "price_feedback", "results_simulation", ["scenario", "year", "storage_ratio", "threshold"]),
+    "thresholds": ("", "thresholds", "results_thresholds", []),
+    "cyclic": ("", "cyclic_storage", "results_simulation", ["scenario", "year", "storage_ratio", "threshold"]),
+    "screening": ("", "representative_periods", "results_screening", ["scenario", "year", "threshold"]),
+    "pareto": ("", "pareto", "results_pareto", ["scenario", "year"]),
+    "replay": ("", "dispatch_service", "results_replay", ["scenario", "year", "storage_ratio", "threshold"]),
+    "equivalence": ("", "equivalence", "results_equivalence", []),
+    "replay-sim10": ("", "dispatch_service", "results_replay_sim10", ["scenario", "year", "storage_cap", "threshold"]),
+}
+
+# Sweep name: (folder, module with run_sweep)
+SWEEPS = {
+    "sim4": ("economic model", "save_sim4_results"),
+    "sim5": ("economic model", "save_sim5_results"),
+    "sim6": ("economic model", "save_sim6_results"),
+    "sim7": ("economic model", "save_sim7_results"),
+    "sim8": ("economic model", "save_sim8_results"),
+    "sim10": ("case study", "save_sim10"),
+}
+
+# Sweeps whose run_sweep can derive the thresholds from the hourly data (--derived-thresholds)
+DERIVED_THRESHOLD_SWEEPS = ["sim4", "sim6", "sim7", "sim8"]
+
+# Sweeps whose run_sweep takes the years (--years)
+YEARS_SWEEPS = ["sim4", "sim5", "sim6", "sim7", "sim8"]
+
+
+# Function that imports a module of one of the simulation folders
+def load_module(folder, module_name):
+
+    for path in (BASE_DIR, os.path.join(BASE_DIR, folder)):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    return importlib.import_module(module_name)
+
+
+def run(args):
+
+    folder, module_name, function_name, arguments = SIMULATIONS[args.simulation]
+    missing = [name for name in arguments if getattr(args, name) is None]
+    if missing:
+        raise SystemExit(f"{args.simulation} needs: " + ", ".join("--" + name.replace("_", "-") for name in missing))
+
+    function = getattr(load_module(folder, module_name), function_name)
+    result = function(*[getattr(args, name) for name in arguments])
+
+    if args.output:
+        df = result[0] if isinstance(result, tuple) else result
+        df.to_excel(args.output)
+        print(f"\nResultados guardados em '{args.output}'")
+    return result
+
+
+def sweep(args):
+
+    if args.derived_thresholds and args.simulation not in DERIVED_THRESHOLD_SWEEPS:
+        raise SystemExit("--derived-thresholds is only available for: " + ", ".join(DERIVED_THRESHOLD_SWEEPS))
+    if args.years and args.simulation not in YEARS_SWEEPS:
+        raise SystemExit("--years is only available for: " + ", ".join(YEARS_SWEEPS))
+
+    folder, module_name = SWEEPS[args.simulation]
+    module = load_module(folder, module_name)
+
+    options = {}
+    if args.scenarios:
+        options["scenarios"] = args.scenarios
+    if args.output:
+        options["output_file"] = args.output
+    if args.years:
+        options["years"] = args.years
+    if args.derived_thresholds:
+        options["derived_thresholds"] = True
+    return module.run_sweep(**options)
+
+
+# Arguments of the simulations and the options of publish with their values
+GRID_OPTIONS = {"scenario": "scenarios", "year": "years", "storage_ratio": "storage_ratios", "storage_cap": "storage_caps", "threshold": "thresholds"}
+
+
+def publish(args):
+
+    import work_queue
+
+    arguments = SIMULATIONS[args.simulation][3]
+    missing = [GRID_OPTIONS[name] for name in arguments if getattr(args, GRID_OPTIONS[name]) is None]
+    if missing:
+        raise SystemExit(f"{args.simulation} needs: " + ", ".join("--" + name.replace("_", "-") for name in missing))
+
+    cases = work_queue.grid_cases(**{name: getattr(args, GRID_OPTIONS[name]) for name in arguments})
+    units = work_queue.sweep_units(args.simulation, cases, args.cases_per_unit)
+    queue = work_queue.open_queue(args.queue, args.max_attempts)
+    print(f"{len(cases)} cases in {len(units)} units, {queue.publish(units)} new")
+
+
+def worker(args):
+
+    import work_queue
+
+    queue = work_queue.open_queue(args.queue, args.max_attempts)
+    return work_queue.run_worker(queue, args.name, args.lease, args.cache_dir, wait=not args.no_wait)
+
+
+def progress(args):
+
+    import work_queue
+
+    counts = work_queue.open_queue(args.queue).progress()
+    total = sum(counts.values())
+    print(", ".join(f"{status}: {count}" for status, count in counts.items()) + f" ({counts['done'] / total * 100 if total else 0:.1f}% done)")
+
+
+def collect(args):
+
+    import work_queue
+
+    df_summary = work_queue.collect_results(work_queue.open_queue(args.queue))
+    if args.output:
+        df_summary.to_excel(args.output, sheet_name="Results", index=False)
+        print(f"\nResultados guardados em '{args.output}'")
+    return df_summary
+
+
+def serve(args):
+
+    import sim_daemon
+
+    preload = (args.scenarios or ["NT", "GA", "DE"], args.years or [2030, 2040, 2050]) if args.preload else None
+    return sim_daemon.serve(args.address, preload)
+
+
+def submit(args):
+
+    import sim_daemon
+
+    arguments = SIMULATIONS[args.simulation][3]
+    missing = [name for name in arguments if getattr(args, name) is None]
+    if missing:
+        raise SystemExit(f"{args.simulation} needs: " + ", ".join("--" + name.replace("_", "-") for name in missing))
+
+    answer = sim_daemon.submit({"simulation": args.simulation, "case": {name: getattr(args, name) for name in arguments}}, args.address)
+    if not answer["ok"]:
+        raise SystemExit(answer["error"])
+    for summary in answer["results"]:
+        for name, value in summary.items():
+            print(f"{name}: {value}")
+    print(f"({answer['seconds'] * 1000:.1f} ms)")
+    return answer
+
+
+def list_simulations(args):
+
+    for name, (folder, module_name, function_name, arguments) in SIMULATIONS.items():
+        sweep_flag = " (sweep)" if name in SWEEPS else ""
+        print(f"{name:8} {module_name}.{function_name}({', '.join(arguments)}){sweep_flag}")
+
+
+def build_parser():
+
+    parser = argparse.ArgumentParser(prog="h2sim", description="Green hydrogen dissertation simulations")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_list = subparsers.add_parser("list", help="list the available simulations")
+    parser_list.set_defaults(handler=list_simulations)
+
+    parser_run = subparsers.add_parser("run", help="run one simulation case")
+    parser_run.add_argument("simulation", choices=sorted(SIMULATIONS))
+    parser_run.add_argument("--scenario", choices=["NT", "GA", "DE"])
+    parser_run.add_argument("--year", type=int)
+    parser_run.add_argument("--storage-ratio", dest="storage_ratio", type=int, help="% of storage in salt caverns")
+    parser_run.add_argument("--threshold", type=float, help="electricity cost threshold [€/MWh]")
+    parser_run.add_argument("--storage-cap", dest="storage_cap", type=float, help="cavern capacity [ton]")
+    parser_run.add_argument("--output", help="excel file for the hourly results")
+    parser_run.set_defaults(handler=run)
+
+    parser_sweep = subparsers.add_parser("sweep", help="run the full sweep of a simulation")
+    parser_sweep.add_argument("simulation", choices=sorted(SWEEPS))
+    parser_sweep.add_argument("--scenarios", nargs="+", choices=["NT", "GA", "DE"])
+    parser_sweep.add_argument("--years", nargs="+", type=int, help="years of the sweep (" + ", ".join(YEARS_SWEEPS) + ")")
+    parser_sweep.add_argument("--output", help="excel file for the summaries")
+    parser_sweep.add_argument("--derived-thresholds", dest="derived_thresholds", action="store_true",
+                              help="thresholds derived from the hourly data (" + ", ".join(DERIVED_THRESHOLD_SWEEPS) + ")")
+    parser_sweep.set_defaults(handler=sweep)
+
+    parser_publish = subparsers.add_parser("publish", help="publish the cases of a sweep to a work queue")
+    parser_publish.add_argument("simulation", choices=sorted(SIMULATIONS))
+    parser_publish.add_argument("--queue", required=True, help="spool:DIR, sqlite:FILE or redis://HOST:PORT")
+    parser_publish.add_argument("--scenarios", nargs="+", choices=["NT", "GA", "DE"])
+    parser_publish.add_argument("--years", nargs="+", type=int)
+    parser_publish.add_argument("--storage-ratios", dest="storage_ratios", nargs="+", type=int)
+    parser_publish.add_argument("--storage-caps", dest="storage_caps", nargs="+", type=float)
+    parser_publish.add_argument("--thresholds", nargs="+", type=float)
+    parser_publish.add_argument("--cases-per-unit", dest="cases_per_unit", type=int, default=4)
+    parser_publish.add_argument("--max-attempts", dest="max_attempts", type=int, default=3)
+    parser_publish.set_defaults(handler=publish)
+
+    parser_worker = subparsers.add_parser("worker", help="run the units of a work queue")
+    parser_worker.add_argument("--queue", required=True)
+    parser_worker.add_argument("--name", help="name of the worker (host-pid by default)")
+    parser_worker.add_argument("--lease", type=float, default=3600, help="seconds a unit is held before it is retried")
+    parser_worker.add_argument("--cache-dir", dest="cache_dir", help="local folder for a copy of the excels")
+    parser_worker.add_argument("--max-attempts", dest="max_attempts", type=int, default=3)
+    parser_worker.add_argument("--no-wait", dest="no_wait", action="store_true", help="stop when no unit is pending")
+    parser_worker.set_defaults(handler=worker)
+
+    parser_progress = subparsers.add_parser("progress", help="show the progress of a work queue")
+    parser_progress.add_argument("--queue", required=True)
+    parser_progress.set_defaults(handler=progress)
+
+    parser_collect = subparsers.add_parser("collect", help="join the results of a work queue")
+    parser_collect.add_argument("--queue", required=True)
+    parser_collect.add_argument("--output", help="excel file for the summaries")
+    parser_collect.set_defaults(handler=collect)
+
+    parser_serve = subparsers.add_parser("serve", help="run the warm simulation daemon")
+    parser_serve.add_argument("--address", default="http://127.0.0.1:8765", help="http://127.0.0.1:PORT or unix:PATH")
+    parser_serve.add_argument("--preload", action="store_true", help="read the sheets before the first job")
+    parser_serve.add_argument("--scenarios", nargs="+", choices=["NT", "GA", "DE"])
+    parser_serve.add_argument("--years", nargs="+", type=int)
+    parser_serve.set_defaults(handler=serve)
+
+    parser_submit = subparsers.add_parser("submit", help="run one simulation case on the daemon")
+    parser_submit.add_argument("simulation", choices=sorted(SIMULATIONS))
+    parser_submit.add_argument("--address", default="http://127.0.0.1:8765")
+    parser_submit.add_argument("--scenario", choices=["NT", "GA", "DE"])
+    parser_submit.add_argument("--year", type=int)
+    parser_submit.add_argument("--storage-ratio", dest="storage_ratio", type=int)
+    parser_submit.add_argument("--threshold", type=float)
+    parser_submit.add_argument("--storage-cap", dest="storage_cap", type=float)
+    parser_submit.set_defaults(handler=submit)
+
+    return parser
+
+
+def main(argv=None):
+
+    args = build_parser().parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+# NETWORK DISPATCH
+#
+# This file generalises the single PT <-> ES exchange heuristic of the
+# simulations to a network of N nodes (PT, ES, FR, ...) linked by lines
+# with hourly capacity arrays. Electricity exchanges are solved line by
+# line over all hours at once, and the hydrogen assets of every node
+# (electrolyzers, storage, fuel cells) are then dispatched simultaneously,
+# hour by hour, as vectors over the nodes.
+#
+# The cost grows with (number of lines x hours) for the exchanges and
+# with the number of hours for the hydrogen dispatch, so a dozen zones
+# cost about the same as two.
+#
+# As in sim7, a node with fuel cells only imports before using its own H2
+# when the electricity is cheaper than its buying threshold; otherwise it
+# imports only at prices above its selling threshold, to cover what the H2
+# leaves of the deficit. The deficit it covers is counted as in sim7: only
+# in the hours it can reconvert and still has a deficit after the cheap
+# imports. With two nodes (PT and ES, results_iberia) the PT results are
+# the ones of sim7 with the storage in tanks, which the equivalence harness
+# checks (the caverns charge with the compressor yield on every hour, which
+# sim7 with 100% in caverns only applies when the storage fills).
+
+import numpy as np
+import pandas as pd
+from extract_data import get_data
+from schema import hourly_data
+from system_parameters import LHV_H2, case_parameters
+
+
+# Function that reads the hourly balances and prices of the nodes from a scenario dataframe
+# Each node needs the columns "<node> Balance [MW]" and "<node> Marginal Cost [€]"
+def node_inputs(df, nodes):
+
+    missing = [
+        column for node in nodes
+        for column in (f"{node} Balance [MW]", f"{node} Marginal Cost [€]")
+        if column not in df.columns
+    ]
+    if missing:
+        raise ValueError(f"Missing network columns: {missing}")
+
+    balances = np.vstack([df[f"{node} Balance [MW]"].to_numpy(dtype=float) * 1000 for node in nodes])  # kW
+    prices = np.vstack([df[f"{node} Marginal Cost [€]"].to_numpy(dtype=float) for node in nodes])
+    return balances, prices
+
+
+# Function that builds an hourly capacity array (kW) from a yearly capacity in MW
+# derate is the share of the capacity available for exchanges (sim10 uses 0.7)
+def hourly_capacity(cap_MW, n_hours, derate=1.0):
+
+    return np.full(n_hours, cap_MW * 1000 * derate)
+
+
+# Function that builds the PT <-> ES line from the Exchange_Capacity workbook
+# Without the workbook (exchange_cap_df=None) the line has no limit, as in sim7
+def iberian_lines(exchange_cap_df, year, n_hours, derate=0.7):
+
+    if exchange_cap_df is None:
+        capacity = np.full(n_hours, np.inf)
+    else:
+        cap_exchange = exchange_cap_df.loc[year, "Capacity (MWH2)"]
+        capacity = hourly_capacity(cap_exchange, n_hours, derate)
+    return [("PT", "ES", capacity), ("ES", "PT", capacity)]
+
+
+# Function that builds the node parameters (see dispatch_nodes) of PT, with the H2 system of a
+# system_parameters dictionary, and of ES, without H2 assets
+# The storage of PT is one reservoir with the average efficiencies of the shares of caverns and tanks (the
+# compressor yield only applies to the caverns, as in the simulations); without
+# power_limits the electrolyzers and fuel cells take any power, as in sim7/sim8
+def iberian_node_params(params, power_limits=False):
+
+    caverns, tanks = params["storage_saltCaverns_percentage"], params["storage_pressurisedTanks_percentage"]
+    pt = {
+        "Electrolyzers (MW)": params["cap_electrolyzer"] if power_limits else np.inf,
+        "Fuel Cells (MW)": params["cap_fuel_cell"] if power_limits else np.inf,
+        "Storage (kg)": params["cap_storage_kg"],
+        "Efficiency (kWh/kgH2)": params["eff_electrolyzer"],
+        "Compression (kWh/kgH2)": params["comsumption_compressors_saltCaverns"] * caverns,
+        "Compressor Efficiency (%)": params["eff_compressors_saltCaverns"] * caverns + tanks,
+        "Storage Efficiency (%)": params["eff_storage_saltCaverns"] * caverns + params["eff_storage_pressurisedTanks"] * tanks,
+        "Fuel Cell Efficiency (%)": params["eff_fuel_cell"],
+        "Buying Threshold [€/MWh]": params["threshold_buying"],
+        "Selling Threshold [€/MWh]": params["threshold_selling"],
+    }
+    es = dict.fromkeys(pt, 0.0)
+    es.update({"Efficiency (kWh/kgH2)": 1.0, "Compressor Efficiency (%)": 1.0, "Storage Efficiency (%)": 1.0, "Fuel Cell Efficiency (%)": 1.0,
+               "Buying Threshold [€/MWh]": np.nan, "Selling Threshold [€/MWh]": np.nan})
+    return pd.DataFrame([pt, es], index=pd.Index(["PT", "ES"], name="Node"))
+
+
+# Function that tells, for every hour, if two nodes can exchange (20% price difference rule of the simulations)
+def exchange_allowed(price_from, price_to, max_price_diff=0.2):
+
+    reference = np.where(price_from > 0, price_from, price_to)
+    price_diff = np.divide(np.abs(price_from - price_to), reference, out=np.zeros_like(reference), where=reference > 0)
+    return price_diff <= max_price_diff
+
+
+# Function that solves the electricity exchanges of the network
+# lines is a list of (from_node, to_node, hourly capacity in kW); a line is used in one direction only,
+# so a bidirectional interconnection is given as two lines. Lines are served in decreasing order of
+# their mean price spread, moving surplus of the exporting node to cover deficit of the importing node.
+# The 20% rule is measured against the price of the exporting node, or of reference_node on its lines (the
+# simulations measure it against PT); hours (one boolean array per line) restricts the hours of every line
+def solve_exchanges(balances, prices, nodes, lines, max_price_diff=0.2, reference_node=None, hours=None):
+
+    surplus = np.where(balances >= 1, balances, 0.0)
+    deficit = np.where(balances < 0, -balances, 0.0)
+    return exchange_flows(surplus, deficit, prices, nodes, lines, max_price_diff, reference_node, hours)
+
+
+# Function that moves surplus to deficit over the lines (see solve_exchanges); surplus and deficit are not modified
+# Returns the flows of every line and the surplus and deficit left
+def exchange_flows(surplus, deficit, prices, nodes, lines, max_price_diff=0.2, reference_node=None, hours=None):
+
+    node_index = {node: k for k, node in enumerate(nodes)}
+    surplus = surplus.copy()
+    deficit = deficit.copy()
+    flows = np.zeros((len(lines), surplus.shape[1]))
+
+    spreads = []
+    for from_node, to_node, capacity in lines:
+        i, j = node_index[from_node], node_index[to_node]
+        spreads.append(np.mean(prices[j] - prices[i]))
+    order = np.argsort(spreads)[::-1]
+
+    for l in order:
+        from_node, to_node, capacity = lines[l]
+        i, j = node_index[from_node], node_index[to_node]
+        if to_node == reference_node:
+            allowed = exchange_allowed(prices[j], prices[i], max_price_diff)
+        else:
+            allowed = exchange_allowed(prices[i], prices[j], max_price_diff)
+        if hours is not None:
+            allowed &= hours[l]
+        flow = np.where(allowed, np.minimum(np.minimum(surplus[i], deficit[j]), capacity), 0.0)
+        surplus[i] -= flow
+        deficit[j] -= flow
+        flows[l] = flow
+
+    return flows, surplus, deficit
+
+
+# Function that dispatches the hydrogen assets of all the nodes together
+# node_params is a dataframe indexed by node with the columns:
+#   "Electrolyzers (MW)", "Fuel Cells (MW)", "Storage (kg)", "Efficiency (kWh/kgH2)",
+#   "Compression (kWh/kgH2)", "Compressor Efficiency (%)", "Storage Efficiency (%)", "Fuel Cell Efficiency (%)",
+#   "Buying Threshold [€/MWh]", "Selling Threshold [€/MWh]"
+# The H2 stored is the H2 produced times the compressor yield
+def dispatch_nodes(surplus, deficit, prices, node_params):
+
+    cap_electrolyzer = node_params["Electrolyzers (MW)"].to_numpy(dtype=float) * 1000
+    cap_fuel_cell = node_params["Fuel Cells (MW)"].to_numpy(dtype=float) * 1000
+    cap_storage_kg = node_params["Storage (kg)"].to_numpy(dtype=float)
+    elec_per_kg = (node_params["Efficiency (kWh/kgH2)"] + node_params["Compression (kWh/kgH2)"]).to_numpy(dtype=float)
+    kg_per_kwh_in = node_params["Compressor Efficiency (%)"].to_numpy(dtype=float) / elec_per_kg
+    kg_per_kwh_out = 1 / (node_params["Fuel Cell Efficiency (%)"] * node_params["Storage Efficiency (%)"] * LHV_H2).to_numpy(dtype=float)
+    threshold_buying = node_params["Buying Threshold [€/MWh]"].to_numpy(dtype=float)
+    threshold_selling = node_params["Selling Threshold [€/MWh]"].to_numpy(dtype=float)
+
+    n_nodes, n_hours = surplus.shape
+    storage = np.zeros(n_nodes)
+    elec_used = np.zeros((n_nodes, n_hours))
+    elec_recovered = np.zeros((n_nodes, n_hours))
+    storage_levels = np.zeros((n_nodes, n_hours))
+
+    # Price conditions are known for the whole year, only the storage level is sequential
+    can_produce = prices <= threshold_buying[:, None]
+    can_recover = prices >= threshold_selling[:, None]
+    max_elec_in = np.where(can_produce, np.minimum(surplus, cap_electrolyzer[:, None]), 0.0)
+    max_elec_out = np.where(can_recover, np.minimum(deficit, cap_fuel_cell[:, None]), 0.0)
+
+    for t in range(n_hours):
+        used = np.minimum(max_elec_in[:, t], (cap_storage_kg - storage) / kg_per_kwh_in)
+        storage += used * kg_per_kwh_in
+        recovered = np.minimum(max_elec_out[:, t], storage / kg_per_kwh_out)
+        storage -= recovered * kg_per_kwh_out
+
+        elec_used[:, t] = used
+        elec_recovered[:, t] = recovered
+        storage_levels[:, t] = storage
+
+    return elec_used, elec_recovered, storage_levels, kg_per_kwh_in, kg_per_kwh_out
+
+
+# Function that runs the network dispatch for a scenario dataframe and returns
+# the hourly line flows and a summary per node
+# The imports of a node with fuel cells that are not cheaper than its buying threshold are made after its H2
+# dispatch, with the surplus and deficit the H2 leaves, and only when its price is above its selling threshold
+# (the rules of sim7); its "Deficit Covered (kWh)" counts the imports only in the hours it can reconvert and
+# still has a deficit after the cheap imports, as sim7 records them
+def results_network(df, nodes, lines, node_params, max_price_diff=0.2, reference_node=None):
+
+    node_params = node_params.loc[nodes]
+    node_index = {node: k for k, node in enumerate(nodes)}
+    balances, prices = node_inputs(df, nodes)
+    has_fuel_cells = node_params["Fuel Cells (MW)"].to_numpy(dtype=float) > 0
+    threshold_buying = node_params["Buying Threshold [€/MWh]"].to_numpy(dtype=float)
+    threshold_selling = node_params["Selling Threshold [€/MWh]"].to_numpy(dtype=float)
+
+    before_h2 = np.zeros((len(lines), balances.shape[1]), dtype=bool)
+    after_h2 = np.zeros((len(lines), balances.shape[1]), dtype=bool)
+    for l, (from_node, to_node, _) in enumerate(lines):
+        i, j = node_index[from_node], node_index[to_node]
+        cheap = prices[i] < threshold_buying[j]
+        before_h2[l] = cheap | ~has_fuel_cells[j]
+        after_h2[l] = ~before_h2[l] & (prices[j] >= threshold_selling[j])
+    flows, surplus, deficit = solve_exchanges(balances, prices, nodes, lines, max_price_diff, reference_node, before_h2)
+    elec_used, elec_recovered, storage_levels, kg_per_kwh_in, kg_per_kwh_out = dispatch_nodes(surplus, deficit, prices, node_params)
+    flows_after, _, _ = exchange_flows(surplus - elec_used, deficit - elec_recovered, prices, nodes, lines,
+                                       max_price_diff, reference_node, after_h2)
+    flows += flows_after
+
+    df_flows = pd.DataFrame(
+        flows.T, index=df.index,
+        columns=[f"Flow {from_node}->{to_node} [kWh]" for from_node, to_node, _ in lines]
+    )
+
+    total_deficits = np.where(balances < 1, np.abs(balances), 0.0).sum(axis=1)
+    imported = np.array([sum((flows[l] for l, line in enumerate(lines) if line[1] == node), np.zeros(flows.shape[1]))
+                         for node in nodes])
+    counted = np.ones(imported.shape, dtype=bool)
+    counted[has_fuel_cells] = ((prices >= threshold_selling[:, None]) & (deficit > 0))[has_fuel_cells]
+    recovered = elec_recovered.sum(axis=1)
+    covered = (imported * counted).sum(axis=1) + recovered
+
+    summary = pd.DataFrame({
+        "Node": nodes,
+        "H2 Produced (kg)": (elec_used * kg_per_kwh_in[:, None]).sum(axis=1),
+        "H2 Converted (kg)": (elec_recovered * kg_per_kwh_out[:, None]).sum(axis=1),
+        "Maximum H2 Stored (kg)": storage_levels.max(axis=1),
+        "Electricity Exported (kWh)": [df_flows[[c for c in df_flows.columns if c.startswith(f"Flow {node}->")]].to_numpy().sum() for node in nodes],
+        "Electricity Imported (kWh)": imported.sum(axis=1),
+        "Energy Recovered (kWh)": recovered,
+        "Deficit Covered (kWh)": covered,
+        "Electricity Cost [€]": (elec_used * prices / 1000).sum(axis=1),
+        "Flexibility Index (%)": np.divide(covered * 100, total_deficits, out=np.zeros(len(nodes)), where=total_deficits > 0),
+        "Flexibility Index H2(%)": np.divide(recovered * 100, total_deficits, out=np.zeros(len(nodes)), where=total_deficits > 0),
+    })
+
+    return df_flows, summary
+
+
+# Function that runs the network dispatch of PT and ES for a scenario, year, storage ratio and threshold
+# (the H2 system of sim7 in PT); with derate the line has the capacity of the Exchange_Capacity workbook
+# (sim10 uses 0.7), without it the exchanges have no limit, as in sim7
+def results_iberia(scenario, year, storage_ratio, threshold_selling, derate=None, power_limits=False):
+
+    df = hourly_data(scenario, year)
+    params = case_parameters(scenario, year, storage_ratio, threshold_selling, selling=False)
+    exchange_cap_df = None if derate is None else get_data(scenario, "Exchange_Capacity.xlsx", "Years")
+    lines = iberian_lines(exchange_cap_df, year, len(df), derate)
+    return results_network(df, ["PT", "ES"], lines, iberian_node_params(params, power_limits), reference_node="PT")
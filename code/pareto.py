@@ -0,0 +1,272 @@
+# PARETO FRONTIER
+#
+# This file searches the trade-off between the cost of the hydrogen
+# ("LCOH (€/kg)", lower is better) and the grid flexibility it gives
+# ("Flexibility Index (%)", higher is better) over the electrolyzer and
+# fuel cell capacities, the storage size, the share of salt caverns and
+# the selling threshold of one scenario and year.
+#
+# Instead of a full grid, a genetic algorithm (NSGA-II) keeps a
+# population of designs, ranks them by non-domination and spread along
+# the frontier and breeds new designs from the best ones, so most of the
+# evaluations end up near the frontier. Each generation is dispatched in
+# one pass of the kernel (split over several processes if asked), the
+# electrolyzers and fuel cells are limited to their capacities, and every
+# design evaluated is kept in a cache (optionally a csv file), so a design
+# is never dispatched twice, also between runs. The csv keeps the case of
+# every design (scenario, year, selling and H2 price), so one file can hold
+# several cases.
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import dispatch_kernel as kernel
+from schema import hourly_data
+from system_parameters import system_parameters, installed_capacity
+from ratio_sweep import sweep_from_hourly
+from extract_data import get_data
+
+# Decision variables and the step they are rounded to
+VARIABLES = {
+    "Electrolyzers (MW)": 1,
+    "Fuel Cells (MW)": 1,
+    "Storage (MWh)": 10,
+    "Storage in Salt Caverns (%)": 1,
+    "Selling Threshold (€/MWh)": 0.01,
+}
+
+# Indicators kept for every design (from kernel.summarize_totals)
+INDICATORS = ["LCOH (€/kg)", "Flexibility Index (%)", "Flexibility Index H2(%)", "H2 Produced (kg)", "Profit [€]"]
+
+# Columns of the cache file with the case the designs were evaluated for
+CASE_COLUMNS = ["Scenario", "Year", "Selling", "H2 Selling Price (€/kg)"]
+
+
+# Function that gives the default range of every variable: up to 2x the installed capacities of the year
+# (the largest of the three scenarios, NT has no storage or fuel cells) and the selling threshold between
+# the 5th and 95th percentile of the PT electricity cost
+def default_bounds(scenario, year, hourly):
+
+    installed_cap = pd.DataFrame([installed_capacity(name).loc[year] for name in ("NT", "GA", "DE")]).max()
+    costs = hourly[:, kernel.H_PT_COST]
+    return {
+        "Electrolyzers (MW)": (0.1 * installed_cap["Electrolyzers (MW)"], 2 * installed_cap["Electrolyzers (MW)"]),
+        "Fuel Cells (MW)": (0, 2 * installed_cap["Fuel Cells (MW)"]),
+        "Storage (MWh)": (0, 2 * installed_cap["Storage (MWH2)"]),
+        "Storage in Salt Caverns (%)": (0, 100),
+        "Selling Threshold (€/MWh)": (np.percentile(costs, 5), np.percentile(costs, 95)),
+    }
+
+
+# Function that rounds the designs (rows of x, in the order of VARIABLES) to the steps of the variables
+def round_designs(x, bounds):
+
+    steps = np.array(list(VARIABLES.values()))
+    low = np.array([bounds[name][0] for name in VARIABLES])
+    high = np.array([bounds[name][1] for name in VARIABLES])
+    # The last rounding gives the same floats as the csv of the cache
+    return np.round(np.clip(np.round(x / steps) * steps, low, high), 6)
+
+
+# Function that builds the system parameters of one design
+def design_parameters(scenario, year, design, h2_sellingPrice):
+
+    cap_electrolyzer, cap_fuel_cell, cap_storage, storage_ratio, threshold_selling = design
+    return system_parameters(scenario, year, int(storage_ratio), threshold_selling, cap_fuel_cell, cap_storage,
+                             h2_sellingPrice=h2_sellingPrice, cap_electrolyzer=cap_electrolyzer)
+
+
+# Dispatches a batch of designs in one pass and returns their indicators (one row per design)
+def _evaluate_batch(hourly, scenario, year, designs, h2_sellingPrice, selling):
+
+    params_list = [design_parameters(scenario, year, design, h2_sellingPrice) for design in designs]
+    return sweep_from_hourly(hourly, params_list, selling=selling, power_limits=True)[INDICATORS]
+
+
+# Function that evaluates the designs that are not in the cache yet and adds them to it
+# cache is a dictionary {design (tuple): indicators (dictionary)}; workers > 1 splits the batch over processes
+def evaluate_designs(hourly, scenario, year, designs, cache, h2_sellingPrice=0.0, selling=True, workers=1):
+
+    new = list(dict.fromkeys(tuple(design) for design in designs if tuple(design) not in cache))
+    if new:
+        if workers > 1 and len(new) > workers:
+            chunks = [new[k::workers] for k in range(workers)]
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                frames = list(executor.map(_evaluate_batch, [hourly] * workers, [scenario] * workers, [year] * workers,
+                                           chunks, [h2_sellingPrice] * workers, [selling] * workers))
+            new = [design for chunk in chunks for design in chunk]
+            df_new = pd.concat(frames, ignore_index=True)
+        else:
+            df_new = _evaluate_batch(hourly, scenario, year, new, h2_sellingPrice, selling)
+        for design, indicators in zip(new, df_new.to_dict("records")):
+            cache[design] = indicators
+
+    return np.array([objectives(cache[tuple(design)]) for design in designs]), len(new)
+
+
+# Objectives to minimise: LCOH (designs that produce no H2 are left out) and minus the flexibility index
+def objectives(indicators):
+
+    if indicators["H2 Produced (kg)"] <= 0:
+        return [np.inf, np.inf]
+    return [indicators["LCOH (€/kg)"], -indicators["Flexibility Index (%)"]]
+
+
+# Function that sorts the designs in fronts of non-domination (0 = Pareto front)
+def non_dominated_ranks(F):
+
+    n = len(F)
+    dominates = np.all(F[:, None, :] <= F[None, :, :], axis=2) & np.any(F[:, None, :] < F[None, :, :], axis=2)
+    dominated_by = dominates.sum(axis=0)
+    ranks = np.full(n, -1)
+    front = np.flatnonzero(dominated_by == 0)
+    rank = 0
+    while len(front):
+        ranks[front] = rank
+        dominated_by = dominated_by - dominates[front].sum(axis=0)
+        dominated_by[ranks >= 0] = -1
+        front = np.flatnonzero(dominated_by == 0)
+        rank += 1
+    return ranks
+
+
+# Function that measures how isolated every design is inside its front (the extremes are always kept)
+def crowding_distance(F, ranks):
+
+    distance = np.zeros(len(F))
+    for rank in np.unique(ranks):
+        members = np.flatnonzero(ranks == rank)
+        for k in range(F.shape[1]):
+            values = F[members, k]
+            order = members[np.argsort(values)]
+            distance[order[0]] = distance[order[-1]] = np.inf
+            span = values.max() - values.min()
+            if len(members) > 2 and np.isfinite(span) and span > 0:
+                distance[order[1:-1]] += (F[order[2:], k] - F[order[:-2], k]) / span
+    return distance
+
+
+# Function that breeds the children of a population: binary tournaments, simulated binary crossover and
+# polynomial mutation (the usual operators of NSGA-II), within the bounds
+def breed(x, ranks, distance, low, high, rng, eta_crossover=15, eta_mutation=20):
+
+    n, d = x.shape
+
+    # Tournaments: lower rank wins, then the larger crowding distance
+    a, b = rng.integers(n, size=(2, n))
+    a_wins = (ranks[a] < ranks[b]) | ((ranks[a] == ranks[b]) & (distance[a] >= distance[b]))
+    parents = x[np.where(a_wins, a, b)]
+
+    children = parents.copy()
+    for k in range(0, n - 1, 2):
+        if rng.random() < 0.9:
+            u = rng.random(d)
+            beta = np.where(u <= 0.5, (2 * u) ** (1 / (eta_crossover + 1)), (1 / (2 * (1 - u))) ** (1 / (eta_crossover + 1)))
+            children[k] = 0.5 * ((1 + beta) * parents[k] + (1 - beta) * parents[k + 1])
+            children[k + 1] = 0.5 * ((1 - beta) * parents[k] + (1 + beta) * parents[k + 1])
+
+    mutate = rng.random((n, d)) < 1 / d
+    u = rng.random((n, d))
+    delta = np.where(u < 0.5, (2 * u) ** (1 / (eta_mutation + 1)) - 1, 1 - (2 * (1 - u)) ** (1 / (eta_mutation + 1)))
+    children = np.where(mutate, children + delta * (high - low), children)
+    return np.clip(children, low, high)
+
+
+# Function that reads the cache file (rows of every case); a file without the case columns is not used
+def read_cache_file(cache_file):
+
+    if cache_file is None or not os.path.exists(cache_file):
+        return pd.DataFrame(columns=CASE_COLUMNS + list(VARIABLES) + INDICATORS)
+    df = pd.read_csv(cache_file, dtype={"Scenario": str}, float_precision="round_trip")
+    missing = [column for column in CASE_COLUMNS if column not in df.columns]
+    if missing:
+        print(f"{cache_file} has no {', '.join(missing)}: the designs of the file are not used")
+        return pd.DataFrame(columns=CASE_COLUMNS + list(VARIABLES) + INDICATORS)
+    return df
+
+
+# Function that tells which rows of the cache file are of a case (dictionary with the CASE_COLUMNS)
+def case_rows(df, case):
+
+    return ((df["Scenario"] == case["Scenario"]) & (df["Year"] == case["Year"]) & (df["Selling"] == case["Selling"])
+            & np.isclose(df["H2 Selling Price (€/kg)"].astype(float), case["H2 Selling Price (€/kg)"]))
+
+
+# Function that reads the designs of a case evaluated in previous runs (csv written by save_cache)
+def load_cache(cache_file, case):
+
+    df = read_cache_file(cache_file)
+    df = df[case_rows(df, case)]
+    return {tuple(row[list(VARIABLES)]): row[INDICATORS].to_dict() for _, row in df.iterrows()}
+
+
+# Function that writes the designs of a case to the cache file (the rows of the other cases are kept)
+def save_cache(cache, cache_file, case):
+
+    df = pd.DataFrame([list(design) + [indicators[name] for name in INDICATORS] for design, indicators in cache.items()],
+                      columns=list(VARIABLES) + INDICATORS)
+    for k, column in enumerate(CASE_COLUMNS):
+        df.insert(k, column, case[column])
+    df_file = read_cache_file(cache_file)
+    df_file = df_file[~case_rows(df_file, case)]
+    pd.concat([df_file, df], ignore_index=True).to_csv(cache_file, index=False)
+
+
+# Function that searches the LCOH / flexibility frontier of a scenario and year with NSGA-II
+# bounds is {variable: (min, max)} (default_bounds by default); the cache file keeps the designs between runs
+# Returns the designs of the frontier and all the designs evaluated (with a "Pareto" column)
+def results_pareto(scenario, year, population=40, generations=25, bounds=None, selling=True, workers=1, seed=0, cache_file=None):
+
+    hourly = kernel.hourly_array(hourly_data(scenario, year), validated=True)
+    bounds = default_bounds(scenario, year, hourly) if bounds is None else bounds
+    h2_sellingPrice = get_data("Prices", "H2_prices.xlsx", "Year").loc[year, "H2 Cost [€/kg]"] if selling else 0.0
+
+    rng = np.random.default_rng(seed)
+    low = np.array([bounds[name][0] for name in VARIABLES], dtype=float)
+    high = np.array([bounds[name][1] for name in VARIABLES], dtype=float)
+    case = {"Scenario": scenario, "Year": year, "Selling": selling, "H2 Selling Price (€/kg)": h2_sellingPrice}
+    cache = load_cache(cache_file, case)
+
+    # First population: one design per stratum of every variable (latin hypercube)
+    strata = (np.array([rng.permutation(population) for _ in VARIABLES]).T + rng.random((population, len(VARIABLES)))) / population
+    x = round_designs(low + strata * (high - low), bounds)
+    F, evaluations = evaluate_designs(hourly, scenario, year, x, cache, h2_sellingPrice, selling, workers)
+
+    for generation in range(generations):
+        ranks = non_dominated_ranks(F)
+        distance = crowding_distance(F, ranks)
+        children = round_designs(breed(x, ranks, distance, low, high, rng), bounds)
+        F_children, new = evaluate_designs(hourly, scenario, year, children, cache, h2_sellingPrice, selling, workers)
+        evaluations += new
+
+        # The next population: best fronts first, the most isolated designs of the last front that fits
+        x_all = np.vstack((x, children))
+        F_all = np.vstack((F, F_children))
+        _, unique = np.unique(x_all, axis=0, return_index=True)
+        x_all, F_all = x_all[np.sort(unique)], F_all[np.sort(unique)]
+        ranks = non_dominated_ranks(F_all)
+        distance = crowding_distance(F_all, ranks)
+        keep = np.lexsort((-distance, ranks))[:population]
+        x, F = x_all[keep], F_all[keep]
+
+        print(f"Generation {generation + 1}: {evaluations} designs evaluated, {int((ranks == 0).sum())} on the frontier")
+
+    print(f"{evaluations} designs evaluated (a grid of 10 values per variable would need {10 ** len(VARIABLES)})")
+    if cache_file is not None:
+        save_cache(cache, cache_file, case)
+
+    df_designs = pd.DataFrame([list(design) + [indicators[name] for name in INDICATORS] for design, indicators in cache.items()],
+                              columns=list(VARIABLES) + INDICATORS)
+    df_designs.insert(0, "Scenario", scenario)
+    df_designs.insert(1, "Year", year)
+    df_designs["Pareto"] = non_dominated_ranks(np.array([objectives(row) for row in df_designs[INDICATORS].to_dict("records")])) == 0
+    df_front = df_designs[df_designs["Pareto"] & (df_designs["H2 Produced (kg)"] > 0)].sort_values("LCOH (€/kg)").reset_index(drop=True)
+    return df_front, df_designs
+
+
+if __name__ == "__main__":
+    df_front, df_designs = results_pareto("NT", 2030)
+    print(df_front)
@@ -0,0 +1,198 @@
+# PRICE FEEDBACK
+#
+# This file adds a price-maker mode to the sim7/sim8 dispatch. The
+# simulations take "PT Marginal Cost [€]" as given, but with GW-scale
+# electrolyzers (the 2050 DE/GA capacities) the H2 load raises the price
+# of the hours it buys in and the fuel cells lower the price of the hours
+# they deliver in. Here the PT price of every hour is moved along a
+# linear supply curve through the price of the sheet:
+#
+#   price = sheet price + slope * (electrolyzers - fuel cells)
+#
+# with the electrolyzer load and the fuel cell output in MW and the slope
+# of the curve in €/MWh per MW. The curve is additive, so the hours with a
+# zero or negative sheet price move as much as the others. The year is then
+# dispatched again with the new prices until the prices stop moving (fixed
+# point), mixing the old and new prices (damping, halved when the mean
+# change of the prices grows).
+# An hour the H2 plant pushes across a switch of the rules has no fixed
+# point: the electrolyzers stop above the buying threshold and lose the
+# surplus exported to ES when the prices of PT and ES get within the
+# allowed difference; the fuel cells stop below the selling threshold and
+# cover less of the deficit when the cheap imports from ES are allowed.
+# Such an hour is held at the switch, on the side the plant runs, with the
+# partial load that puts the curve there (a power cap of that hour): the
+# plant sets the price. The run is "Converged" when no hour is more than
+# the tolerance off the curve.
+# A year of the kernel takes a few ms, so a fixed point takes well under a
+# second; a sweep starts every case from the prices of the previous one.
+
+import numpy as np
+import pandas as pd
+
+import dispatch_kernel as kernel
+from schema import hourly_data
+from system_parameters import case_parameters
+
+# Slope of the supply curve of the PT market (€/MWh per MW of net H2 load): 1 GW moves the price by 20 €/MWh
+SLOPE = 0.02
+
+# Relative margin that keeps a price held at the edge of the allowed price difference on the side of the edge the plant runs
+EDGE_MARGIN = 1e-9
+
+
+# Function that moves the sheet prices along the supply curve for the hourly outputs of a dispatch (€/MWh)
+def supply_curve_prices(base_prices, out, slope=SLOPE):
+
+    net_load = (out[:, kernel.O_ELEC_TOTAL] - out[:, kernel.O_ELEC_FROM_H2]) / 1000
+    return base_prices + slope * net_load
+
+
+# Dispatches a year with a power cap of the electrolyzers and fuel cells for every hour (kWh, inf = the cap of p)
+@kernel.njit(cache=True)
+def dispatch_capped(hourly, p, cap_electrolyzer, cap_fuel_cell, state, out):
+
+    q = p.copy()
+    for t in range(hourly.shape[0]):
+        q[kernel.P_CAP_ELECTROLYZER] = min(p[kernel.P_CAP_ELECTROLYZER], cap_electrolyzer[t])
+        q[kernel.P_CAP_FUEL_CELL] = min(p[kernel.P_CAP_FUEL_CELL], cap_fuel_cell[t])
+        kernel.dispatch_hour(hourly, t, q, state, out)
+
+
+# Function that returns, for every hour, the price above which the electrolyzers lose load (the buying threshold or, if
+# the surplus can be exported to ES, the edge where the exchange is allowed) and the price below which the fuel cells
+# lose output (the selling threshold or, if the cheap imports from ES can cover the deficit, the edge where they are allowed)
+# With a zero or negative ES price the exchange is allowed only while the PT price is not positive (rule of the kernel):
+# the export edge does not exist and the import edge is 0
+def rule_switches(prices, hourly, p):
+
+    es_prices = hourly[:, kernel.H_ES_COST]
+    max_diff = p[kernel.P_MAX_PRICE_DIFF]
+    low_edge = es_prices / (1 + max_diff) * (1 - EDGE_MARGIN)
+    high_edge = es_prices / (1 - max_diff) * (1 + EDGE_MARGIN) if max_diff < 1 else np.full(len(prices), np.inf)
+    high_edge = np.where(es_prices > 0, high_edge, EDGE_MARGIN)
+
+    exports = (hourly[:, kernel.H_BALANCE_ES] * 1000 < -1) & (es_prices > 0) & (prices <= low_edge)
+    imports = (hourly[:, kernel.H_BALANCE_ES] * 1000 > 0) & (es_prices < p[kernel.P_THRESHOLD_BUYING]) & (prices >= high_edge)
+    switch_buying = np.where(exports, np.minimum(low_edge, p[kernel.P_THRESHOLD_BUYING]), p[kernel.P_THRESHOLD_BUYING])
+    switch_selling = np.where(imports, np.maximum(high_edge, p[kernel.P_THRESHOLD_SELLING]), p[kernel.P_THRESHOLD_SELLING])
+    return switch_buying, switch_selling
+
+
+# Function that dispatches a year with prices that respond to the dispatch (fixed point of prices and dispatch)
+# hourly is the array of kernel.hourly_array and p the kernel parameters; prices (optional) are the PT prices to
+# start from (warm start), by default the prices of the sheet
+# Hours the plant pushes across a switch of the rules (see the top of the file) are held at the switch with a partial load
+# Returns the hourly outputs, final state and prices of the last dispatch, and the history of the iterations
+def price_feedback(hourly, p, slope=SLOPE, damping=0.5, tolerance=0.01, max_iterations=100, prices=None):
+
+    if slope <= 0:
+        raise ValueError("The slope of the supply curve must be positive")
+
+    base_prices = hourly[:, kernel.H_PT_COST].copy()
+    adjusted = hourly.copy()
+    adjusted[:, kernel.H_PT_COST] = base_prices if prices is None else prices
+    cap_electrolyzer = np.full(len(hourly), np.inf)
+    cap_fuel_cell = np.full(len(hourly), np.inf)
+
+    history = []
+    previous_change = np.inf
+    for iteration in range(1, max_iterations + 1):
+        state = kernel.initial_state(p)
+        out = np.zeros((len(hourly), kernel.N_OUTPUTS))
+        dispatch_capped(adjusted, p, cap_electrolyzer, cap_fuel_cell, state, out)
+        target = supply_curve_prices(base_prices, out, slope)
+
+        # Gap between the prices used and the prices that dispatch would set (€/MWh)
+        step = target - adjusted[:, kernel.H_PT_COST]
+        gap = np.abs(step)
+        history.append({
+            "Iteration": iteration,
+            "Damping": damping,
+            "Max Price Change (€/MWh)": gap.max(),
+            "Mean Price Change (€/MWh)": gap.mean(),
+            "Hours Off the Curve": int((gap > tolerance).sum()),
+            "Hours Held at a Switch": int(np.isfinite(cap_electrolyzer).sum() + np.isfinite(cap_fuel_cell).sum()),
+            "Mean Price (€/MWh)": adjusted[:, kernel.H_PT_COST].mean(),
+            "H2 Produced (kg)": out[:, kernel.O_H2_PRODUCED].sum(),
+            "Energy from H2 (kWh)": out[:, kernel.O_ELEC_FROM_H2].sum(),
+        })
+        # Stops at the fixed point (every hour on the curve)
+        if gap.max() < tolerance:
+            break
+
+        # Hours the plant pushes across a switch: the load (kWh) that moves the sheet price to the switch
+        price = adjusted[:, kernel.H_PT_COST]
+        switch_buying, switch_selling = rule_switches(price, hourly, p)
+        load_to_switch = (switch_buying - base_prices) / slope * 1000
+        output_to_switch = (base_prices - switch_selling) / slope * 1000
+        at_buying = (price <= switch_buying) & (target > switch_buying) & (load_to_switch >= 0)
+        at_selling = (price >= switch_selling) & (target < switch_selling) & (output_to_switch >= 0)
+
+        if gap.mean() > previous_change:
+            damping /= 2
+        previous_change = gap.mean()
+        adjusted[:, kernel.H_PT_COST] += damping * step
+
+        cap_electrolyzer[at_buying] = load_to_switch[at_buying]
+        cap_fuel_cell[at_selling] = output_to_switch[at_selling]
+        adjusted[at_buying, kernel.H_PT_COST] = switch_buying[at_buying]
+        adjusted[at_selling, kernel.H_PT_COST] = switch_selling[at_selling]
+
+    return out, state, adjusted[:, kernel.H_PT_COST].copy(), pd.DataFrame(history)
+
+
+# Function that runs sim8 (selling=True) or sim7 (selling=False) as a price maker
+# Returns the hourly results with the sheet prices ("PT Marginal Cost [€]") and the feedback prices, and the summary of
+# kernel.results_simulation computed with the feedback prices, plus the iterations of the fixed point
+def results_simulation(scenario, year, storage_ratio, threshold_selling, selling=True, slope=SLOPE,
+                       power_limits=False, tolerance=0.01, prices=None):
+
+    df = hourly_data(scenario, year)
+    params = case_parameters(scenario, year, storage_ratio, threshold_selling, selling=selling)
+    hourly = kernel.hourly_array(df, validated=True)
+    p = kernel.kernel_parameters(params, selling=selling, track_reservoirs=selling, power_limits=power_limits)
+
+    out, state, feedback_prices, df_history = price_feedback(hourly, p, slope, tolerance=tolerance, prices=prices)
+    adjusted = hourly.copy()
+    adjusted[:, kernel.H_PT_COST] = feedback_prices
+
+    for k, column in enumerate(kernel.OUTPUT_COLUMNS):
+        df[column] = out[:, k]
+    df["PT Price with H2 [€]"] = feedback_prices
+    df["Cost_H2_production [€]"] = df["Elec_used_for_H2 [kWh]"] * df["PT Price with H2 [€]"] / 1000
+    df["Cost_H2_production_with_selling [€]"] = df["Elec_used_total [kWh]"] * df["PT Price with H2 [€]"] / 1000
+
+    last = df_history.iloc[-1]
+    summary = {
+        "Scenario": params["scenario"],
+        "Year": params["year"],
+        "Storage in Salt Caverns (%)": params["storage_ratio"],
+        "Storage in Pressurized Tanks (%)": (100-params["storage_ratio"]),
+    }
+    summary.update(kernel.summarize(out, adjusted, p, state, params["capex_total"], params["opex_total"]))
+    summary.update({
+        "Iterations": len(df_history),
+        "Converged": bool(last["Max Price Change (€/MWh)"] < tolerance),
+        "Max Price Change (€/MWh)": last["Max Price Change (€/MWh)"],
+        "Hours Off the Curve": last["Hours Off the Curve"],
+        "Hours Held at a Switch": last["Hours Held at a Switch"],
+        "Mean Price Sheet (€/MWh)": hourly[:, kernel.H_PT_COST].mean(),
+        "Mean Price with H2 (€/MWh)": feedback_prices.mean(),
+    })
+    return df, summary
+
+
+# Function that runs the price-maker mode for several storage ratios, every ratio starting from the
+# prices of the one before (warm start); returns a dataframe with the summaries
+def results_sweep(scenario, year, threshold_selling, storage_ratios=range(0, 101, 10), selling=True, slope=SLOPE):
+
+    summaries = []
+    prices = None
+    for ratio in storage_ratios:
+        df, summary = results_simulation(scenario, year, ratio, threshold_selling, selling, slope, prices=prices)
+        prices = df["PT Price with H2 [€]"].to_numpy()
+        summaries.append(summary)
+        print(f"{scenario} {year} {ratio}%: {summary['Iterations']} iterações, preço médio "
+              f"{summary['Mean Price Sheet (€/MWh)']:.2f} -> {summary['Mean Price with H2 (€/MWh)']:.2f} €/MWh")
+    return pd.DataFrame(summaries)
@@ -0,0 +1,91 @@
+# QUANTILE SKETCH
+#
+# This file contains a small KLL quantile sketch: a summary of a stream
+# of values that answers percentiles (P90, P95, P99, ...) with a rank
+# error of about 1 / k, whatever the number of values, using only a few
+# thousand stored values. Values are added in chunks (e.g. one year of
+# hours at a time) and sketches built in different processes can be
+# merged, so percentiles of hundreds of weather years never need all the
+# hours in memory.
+
+import numpy as np
+
+
+class QuantileSketch:
+
+    def __init__(self, k=1000, seed=0):
+        self.k = k
+        self.count = 0
+        self.min = float("inf")
+        self.max = float("-inf")
+        # levels[h] holds values with weight 2**h
+        self.levels = [np.zeros(0)]
+        self.rng = np.random.default_rng(seed)
+
+    # Capacity of a level: the top level keeps k values, lower levels keep fewer (factor 2/3 per level)
+    def capacity(self, h):
+        depth = len(self.levels) - 1 - h
+        return max(8, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    # Adds a chunk of values
+    def update(self, values):
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        self.count += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate((self.levels[0], values))
+        self.compress()
+        return self
+
+    # Halves the levels above their capacity, promoting one value of each pair to the next level
+    def compress(self):
+        h = 0
+        while h < len(self.levels):
+            if len(self.levels[h]) > self.capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.zeros(0))
+                items = np.sort(self.levels[h])
+                # An odd number of values leaves the largest one at this level
+                keep = items[-1:] if len(items) % 2 else items[:0]
+                pairs = items[:len(items) - len(keep)]
+                promoted = pairs[self.rng.integers(2)::2]
+                self.levels[h] = keep
+                self.levels[h + 1] = np.concatenate((self.levels[h + 1], promoted))
+            h += 1
+
+    # Adds the values summarised by another sketch (e.g. built by another worker)
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.zeros(0))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate((self.levels[h], items))
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+        return self
+
+    # Returns the values of the given quantiles (0 - 1)
+    def quantiles(self, qs):
+        qs = np.atleast_1d(np.asarray(qs, dtype=float))
+        if self.count == 0:
+            return np.full(len(qs), np.nan)
+
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2.0 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        items = items[order]
+        cumulative = np.cumsum(weights[order])
+
+        position = np.searchsorted(cumulative, qs * cumulative[-1], side="left")
+        values = items[np.minimum(position, len(items) - 1)]
+        # The extremes are kept exactly
+        values = np.where(qs <= 0, self.min, values)
+        values = np.where(qs >= 1, self.max, values)
+        return values
+
+    def quantile(self, q):
+        return float(self.quantiles([q])[0])
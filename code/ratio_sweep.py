@@ -0,0 +1,113 @@
+# STORAGE RATIO SWEEP
+#
+# This file evaluates every share of storage in salt caverns (0 - 100%,
+# in 1% steps by default) for one scenario, year and threshold in a
+# single pass. The hourly data is loaded once and the storage of all the
+# ratios advances together through the hours inside the compiled loop of
+# the dispatch kernel, keeping only the yearly totals of every ratio, so
+# the LCOH / flexibility curve costs about as much as one legacy run.
+
+import numpy as np
+import pandas as pd
+
+import dispatch_kernel as kernel
+from system_parameters import system_parameters, sized_capacities
+from schema import hourly_data
+
+# Extra column of the totals with the cost of the electricity used for H2 [€]
+T_COST = kernel.N_OUTPUTS
+
+
+# Function that builds the parameters of every ratio for one scenario, year and threshold
+def ratio_parameters(scenario, year, threshold_selling, storage_ratios, selling=True):
+
+    cap_fuel_cell, cap_storage = sized_capacities(scenario, year, threshold_selling)
+
+    # The H2 price only depends on the year, read it once
+    first = system_parameters(scenario, year, storage_ratios[0], threshold_selling, cap_fuel_cell, cap_storage,
+                              h2_sellingPrice=None if selling else 0.0)
+    return [first] + [
+        system_parameters(scenario, year, ratio, threshold_selling, cap_fuel_cell, cap_storage,
+                          h2_sellingPrice=first["h2_sellingPrice"])
+        for ratio in storage_ratios[1:]
+    ]
+
+
+# Dispatches all the ratios hour by hour and accumulates their yearly totals
+# P and states have one row per ratio (padded to the largest number of reservoirs)
+@kernel.njit(cache=True)
+def dispatch_ratios(hourly, P, states, totals):
+
+    n_hours = hourly.shape[0]
+    out = np.zeros((n_hours, kernel.N_OUTPUTS))
+
+    for t in range(n_hours):
+        pt_electricityCost = hourly[t, kernel.H_PT_COST]
+        for k in range(P.shape[0]):
+            kernel.dispatch_hour(hourly, t, P[k], states[k], out)
+            for j in range(kernel.N_OUTPUTS):
+                totals[k, j] += out[t, j]
+            totals[k, T_COST] += out[t, kernel.O_ELEC_USED] * pt_electricityCost / 1000
+
+
+# Function that stacks the kernel parameters of a list of parameter dictionaries (padded to the largest
+# number of reservoirs). Returns P, the initial states and the empty totals (one row per dictionary)
+def parameter_matrix(params_list, selling=True, power_limits=False):
+
+    p_list = [kernel.kernel_parameters(params, selling=selling, track_reservoirs=selling, power_limits=power_limits)
+              for params in params_list]
+    n_parameters = max(len(p) for p in p_list)
+
+    P = np.zeros((len(p_list), n_parameters))
+    states = np.zeros((len(p_list), kernel.N_STATE + (n_parameters - kernel.N_PARAMETERS) // kernel.N_RESERVOIR_FIELDS))
+    for k, p in enumerate(p_list):
+        P[k, :len(p)] = p
+    totals = np.zeros((len(p_list), kernel.N_OUTPUTS + 1))
+    return P, states, totals
+
+
+# Function that builds the yearly indicators of every parameter dictionary from the totals of the sweep
+def sweep_summaries(params_list, P, states, totals):
+
+    summaries = []
+    for k, params in enumerate(params_list):
+        summary = {
+            "Scenario": params["scenario"],
+            "Year": params["year"],
+            "Storage in Salt Caverns (%)": params["storage_ratio"],
+            "Storage in Pressurized Tanks (%)": (100-params["storage_ratio"]),
+        }
+        summary.update(kernel.summarize_totals(totals[k], totals[k, T_COST], P[k], states[k],
+                                               params["capex_total"], params["opex_total"]))
+        summaries.append(summary)
+    return pd.DataFrame(summaries)
+
+
+# Function that runs the sweep over an hourly array for a list of parameter dictionaries
+# Returns a dataframe with one row of yearly indicators per ratio
+# With segments the hours are dispatched by runs (segment_dispatch), classified once for all the ratios
+def sweep_from_hourly(hourly, params_list, selling=True, power_limits=False, segments=False):
+
+    P, states, totals = parameter_matrix(params_list, selling, power_limits)
+
+    if segments:
+        from segment_dispatch import dispatch_batch
+        dispatch_batch(hourly, P, states, totals)
+    else:
+        dispatch_ratios(hourly, P, states, totals)
+
+    return sweep_summaries(params_list, P, states, totals)
+
+
+# Function that runs the sweep of storage ratios of sim8 (selling=True) or sim7 (selling=False)
+def results_sweep(scenario, year, threshold_selling, storage_ratios=range(0, 101), selling=True, segments=False):
+
+    # Load (and check) hourly energy data for the selected scenario and year
+    df = hourly_data(scenario, year)
+    params_list = ratio_parameters(scenario, year, threshold_selling, list(storage_ratios), selling=selling)
+    return sweep_from_hourly(kernel.hourly_array(df, validated=True), params_list, selling=selling, segments=segments)
+
+
+if __name__ == "__main__":
+    df_sweep = results_sweep("NT", 2040, 17.58)
+    print(df_sweep[["Storage in Salt Caverns (%)", "LCOH (€/kg)", "Flexibility Index (%)", "Flexibility Index H2(%)"]])
@@ -0,0 +1,248 @@
+# REPRESENTATIVE PERIODS
+#
+# This file gives a screening mode for large sweeps: instead of the 8760
+# hours, only a few representative weeks (or days) of the year are
+# dispatched, to rank the candidates and run only the best ones at full
+# resolution.
+#
+# The weeks of a scenario-year are grouped by k-medoids on their profiles
+# of PT / ES balance and prices (every column scaled to the year), and
+# every group is represented by its medoid, a real week of the sheet. The
+# chronology is kept for the storage: the weeks of the year, in order,
+# pass the storage from one to the next with the change of their medoid,
+# the medoid dispatched by the kernel from the average level its weeks
+# start at. The levels are updated along the year within a pass (a week
+# sees the levels its earlier weeks just got), and a medoid is dispatched
+# again only when that average moved; the passes stop when the levels of
+# the year stop moving, and a candidate that hits the limit of passes is
+# reported as not converged.
+# The totals of a medoid count once for every week it represents.
+#
+# The grouping of a scenario-year is kept for the session. screen_cases
+# ranks the candidates with the representative weeks, runs the best ones
+# over the full year and reports the error of the approximation. With 12
+# weeks a candidate is dispatched over 2016 hours instead of 8760. The
+# indicators of the screening only rank the candidates (the hours past a
+# threshold that no medoid has are missed, mostly in the H2 produced):
+# the indicators to report are the ones of the full runs.
+
+import numpy as np
+import pandas as pd
+
+import dispatch_kernel as kernel
+from schema import hourly_data
+from ratio_sweep import T_COST, parameter_matrix, ratio_parameters, sweep_summaries
+
+# Groupings already built: {(scenario, year, period_hours, n_periods): aggregation}
+_aggregations = {}
+
+
+# Function that groups the rows of x (one period per row) around k medoids (alternating k-medoids)
+# The first medoids are spread with the k-means++ rule (fixed seed, so the grouping is always the same)
+# Returns the index of the medoids and the group of every row
+def k_medoids(x, k, max_iterations=100, seed=0):
+
+    distances = np.sqrt(((x[:, None, :] - x[None, :, :]) ** 2).sum(axis=2))
+    rng = np.random.default_rng(seed)
+
+    medoids = [int(np.argmin(distances.sum(axis=1)))]
+    for _ in range(1, k):
+        nearest = distances[:, medoids].min(axis=1) ** 2
+        medoids.append(int(rng.choice(len(x), p=nearest / nearest.sum())) if nearest.sum() > 0 else len(medoids))
+    medoids = np.array(medoids)
+
+    for _ in range(max_iterations):
+        labels = np.argmin(distances[:, medoids], axis=1)
+        updated = medoids.copy()
+        for j in range(k):
+            members = np.flatnonzero(labels == j)
+            if len(members):
+                updated[j] = members[np.argmin(distances[np.ix_(members, members)].sum(axis=1))]
+        if np.array_equal(updated, medoids):
+            break
+        medoids = updated
+
+    return medoids, np.argmin(distances[:, medoids], axis=1)
+
+
+# Function that groups the periods of an hourly array (kernel.HOURLY_COLUMNS) in n_periods representative periods
+# The hours left after the last full period (the last day of a year of weeks) are kept as a period of their own
+# Returns a dictionary with the hour ranges of the periods, the medoid of every group, the group of every
+# period (in order) and the weight (number of periods) of every group
+def aggregate_hours(hourly, period_hours=168, n_periods=12):
+
+    n_full = len(hourly) // period_hours
+    if not 0 < n_periods <= n_full:
+        raise ValueError(f"{n_periods} representative periods asked, the data has {n_full} periods of {period_hours} hours")
+
+    scaled = (hourly - hourly.mean(axis=0)) / np.where(hourly.std(axis=0) > 0, hourly.std(axis=0), 1)
+    profiles = scaled[:n_full * period_hours].reshape(n_full, period_hours * hourly.shape[1])
+    medoids, labels = k_medoids(profiles, n_periods)
+
+    starts = np.arange(n_full) * period_hours
+    stops = starts + period_hours
+    if n_full * period_hours < len(hourly):
+        starts = np.append(starts, n_full * period_hours)
+        stops = np.append(stops, len(hourly))
+        medoids = np.append(medoids, n_full)
+        labels = np.append(labels, n_periods)
+
+    return {
+        "starts": starts,
+        "stops": stops,
+        "medoids": medoids,
+        "labels": labels,
+        "weights": np.bincount(labels, minlength=len(medoids)),
+    }
+
+
+# Function that returns the grouping of a scenario-year (built once per session)
+def scenario_aggregation(scenario, year, period_hours=168, n_periods=12):
+
+    key = (scenario, year, period_hours, n_periods)
+    if key not in _aggregations:
+        hourly = kernel.hourly_array(hourly_data(scenario, year), validated=True)
+        _aggregations[key] = (hourly, aggregate_hours(hourly, period_hours, n_periods))
+    return _aggregations[key]
+
+
+# Dispatches the medoid of a group from a storage level (the reservoirs filled in proportion to their capacity)
+# Returns the change of the storage over the period; period_state is left with the state at its end
+@kernel.njit(cache=True)
+def dispatch_medoid(hourly, p, start, stop, level, shares, period_state, out):
+
+    period_state[:] = 0.0
+    period_state[kernel.S_STORAGE] = level
+    period_state[kernel.S_LEVELS:] = level * shares
+    kernel.dispatch_range(hourly, p, period_state, out, start, stop)
+    return period_state[kernel.S_STORAGE] - level
+
+
+# Dispatches the representative periods of a grouping for one kernel parameter array (see aggregate_hours)
+# The storage is passed along the periods in the order of the year with the change of their medoid, every medoid
+# starting at the average level of its periods. Within a pass the level of a period is updated as soon as it is
+# reached, and the medoid is dispatched again when the average level of its group moved more than tolerance (kg);
+# the passes stop when no level moves more than tolerance, or after max_passes
+# Fills totals (as ratio_sweep: the outputs and the electricity cost, every medoid counted weight times) and
+# state (the accumulators of the year and the storage at its end); out is a work array of kernel outputs
+# Returns the number of passes and whether the levels converged
+@kernel.njit(cache=True)
+def dispatch_periods(hourly, p, starts, stops, medoids, labels, weights, totals, state, out, tolerance, max_passes):
+
+    n_reservoirs = state.shape[0] - kernel.N_STATE
+    capacities = np.zeros(n_reservoirs)
+    for r in range(n_reservoirs):
+        capacities[r] = p[kernel.N_PARAMETERS + r * kernel.N_RESERVOIR_FIELDS + kernel.R_CAPACITY]
+    shares = capacities / capacities.sum() if capacities.sum() > 0 else capacities
+
+    period_levels = np.zeros(labels.shape[0])
+    level_sums = np.zeros(medoids.shape[0])
+    dispatched_levels = np.full(medoids.shape[0], np.nan)
+    changes = np.zeros(medoids.shape[0])
+    period_state = np.zeros(state.shape[0])
+
+    passes = 0
+    moved = np.inf
+    level = 0.0
+    while passes < max_passes and moved >= tolerance:
+        passes += 1
+        moved = 0.0
+        level = 0.0
+        for k in range(labels.shape[0]):
+            j = labels[k]
+            moved = max(moved, abs(level - period_levels[k]))
+            level_sums[j] += level - period_levels[k]
+            period_levels[k] = level
+
+            average = level_sums[j] / weights[j]
+            if not abs(average - dispatched_levels[j]) < tolerance:
+                changes[j] = dispatch_medoid(hourly, p, starts[medoids[j]], stops[medoids[j]], average, shares, period_state, out)
+                dispatched_levels[j] = average
+            level = min(max(level + changes[j], 0.0), p[kernel.P_CAP_STORAGE])
+
+    # Totals of the medoids from the final average levels of their groups
+    totals[:] = 0.0
+    state[:] = 0.0
+    for j in range(medoids.shape[0]):
+        start, stop = starts[medoids[j]], stops[medoids[j]]
+        dispatch_medoid(hourly, p, start, stop, level_sums[j] / weights[j], shares, period_state, out)
+        for t in range(start, stop):
+            for k in range(kernel.N_OUTPUTS):
+                totals[k] += weights[j] * out[t, k]
+            totals[T_COST] += weights[j] * out[t, kernel.O_ELEC_USED] * hourly[t, kernel.H_PT_COST] / 1000
+        for k in range(kernel.N_STATE):
+            state[k] += weights[j] * period_state[k]
+
+    state[kernel.S_STORAGE] = level
+    state[kernel.S_LEVELS:] = level * shares
+    return passes, moved < tolerance
+
+
+# Function that evaluates candidates (system_parameters dictionaries of one scenario and year) with the
+# representative periods; returns a dataframe with the indicators of kernel.summarize_totals for every candidate,
+# the passes of the storage levels and whether they converged
+def screen_summaries(params_list, aggregation, hourly, selling=True, tolerance=1.0, max_passes=50):
+
+    P, states, totals = parameter_matrix(params_list, selling)
+    out = np.zeros((len(hourly), kernel.N_OUTPUTS))
+    passes = np.zeros(len(params_list), dtype=int)
+    converged = np.zeros(len(params_list), dtype=bool)
+    for k in range(len(params_list)):
+        passes[k], converged[k] = dispatch_periods(hourly, P[k], aggregation["starts"], aggregation["stops"],
+                                                   aggregation["medoids"], aggregation["labels"], aggregation["weights"],
+                                                   totals[k], states[k], out, tolerance, max_passes)
+
+    df = sweep_summaries(params_list, P, states, totals)
+    df["Screening Passes"] = passes
+    df["Screening Converged"] = converged
+    if not converged.all():
+        print(f"Aviso: os níveis de {int((~converged).sum())} candidatos não convergiram em {max_passes} passagens")
+    return df
+
+
+# Function that ranks the rows of a dataframe by an indicator (1 is the best)
+# The LCOH of a case without H2 production is 0 (kernel.summarize_totals): these cases are ranked last
+def ranking(df, metric, ascending=True):
+
+    values = df[metric]
+    if metric.startswith("LCOH") and "H2 Produced (kg)" in df:
+        values = values.where(df["H2 Produced (kg)"] > 0)
+    return values.rank(ascending=ascending, method="first", na_option="bottom").astype(int)
+
+
+# Function that screens candidates with the representative periods and runs the best `top` at full resolution
+# metric is the indicator the candidates are ranked by (lowest first unless ascending=False)
+# Returns the screening of every candidate (with its rank) and, for the best ones, the full-year indicators
+# with the error of the screening ("<indicator> Error (%)")
+def screen_cases(scenario, year, params_list, metric="LCOH (€/kg)", ascending=True, top=5, period_hours=168,
+                 n_periods=12, selling=True, indicators=("LCOH (€/kg)", "Flexibility Index (%)", "H2 Produced (kg)")):
+
+    hourly, aggregation = scenario_aggregation(scenario, year, period_hours, n_periods)
+    df_screen = screen_summaries(params_list, aggregation, hourly, selling)
+    df_screen["Screening Rank"] = ranking(df_screen, metric, ascending)
+
+    rows = []
+    for case in df_screen.nsmallest(top, "Screening Rank").index:
+        p = kernel.kernel_parameters(params_list[case], selling=selling, track_reservoirs=selling)
+        out, state = kernel.run_dispatch(hourly, p)
+        full = kernel.summarize(out, hourly, p, state, params_list[case]["capex_total"], params_list[case]["opex_total"])
+        row = {"Case": case, "Screening Rank": df_screen.loc[case, "Screening Rank"],
+               "Storage in Salt Caverns (%)": params_list[case]["storage_ratio"]}
+        for name in indicators:
+            row[name] = full[name]
+            row[f"{name} Screening"] = df_screen.loc[case, name]
+            row[f"{name} Error (%)"] = (df_screen.loc[case, name] - full[name]) / abs(full[name]) * 100 if full[name] else np.nan
+        rows.append(row)
+
+    df_full = pd.DataFrame(rows)
+    df_full["Full Rank"] = ranking(df_full, metric, ascending)
+    print(f"{len(params_list)} candidatos com {n_periods} períodos de {period_hours} h, {len(df_full)} corridos no ano completo "
+          f"(erro médio de {metric}: {df_full[f'{metric} Error (%)'].abs().mean():.2f} %)")
+    return df_screen, df_full
+
+
+# Function that screens every storage ratio (0 - 100%) of a scenario, year and threshold with representative weeks
+def results_screening(scenario, year, threshold_selling):
+
+    params_list = ratio_parameters(scenario, year, threshold_selling, list(range(0, 101)), selling=True)
+    return screen_cases(scenario, year, params_list)
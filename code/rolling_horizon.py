@@ -0,0 +1,316 @@
+# ROLLING HORIZON DISPATCH
+#
+# This file implements a rolling-horizon (model predictive control) mode
+# that sits between the myopic threshold rules of sim7/sim8 and a full-year
+# optimisation. Every day a window of 48 - 168 hours is optimised with a
+# linear program using forecasted PT/ES prices and balances, the first
+# 24 hours are committed and the window moves forward.
+#
+# The LP of a window has a fixed sparse structure (storage balance rows),
+# so it is built once and only costs and bounds are updated between
+# windows. With highspy installed the same HiGHS instance is reused and
+# every solve is warm-started from the previous basis; otherwise the
+# prebuilt matrix is passed to scipy's HiGHS interface.
+
+import numpy as np
+from schema import hourly_data
+from system_parameters import LHV_H2, case_parameters
+from network_dispatch import exchange_allowed
+
+try:
+    import highspy
+except ImportError:
+    highspy = None
+
+
+# Function that extracts the hourly inputs of the dispatch from the scenario dataframe (balances in kW)
+def hourly_inputs(df):
+
+    return {
+        "balance_pt": df["PT Balance [MW]"].to_numpy(dtype=float) * 1000,
+        "balance_es": df["ES Balance [MW]"].to_numpy(dtype=float) * 1000,
+        "pt_cost": df["PT Marginal Cost [€]"].to_numpy(dtype=float),
+        "es_cost": df["ES Marginal Cost [€]"].to_numpy(dtype=float),
+    }
+
+
+# Forecast with perfect foresight: the window sees the actual hourly data
+def perfect_forecast(inputs, start, horizon):
+
+    return {key: values[start:start + horizon] for key, values in inputs.items()}
+
+
+# Persistence forecast: the first day is known (day-ahead market), the following days repeat it
+def persistence_forecast(inputs, start, horizon, known_hours=24):
+
+    forecast = {}
+    for key, values in inputs.items():
+        known = values[start:start + known_hours]
+        repeats = int(np.ceil(horizon / max(len(known), 1)))
+        forecast[key] = np.tile(known, repeats)[:min(horizon, len(values) - start)]
+    return forecast
+
+
+# Function that turns (forecasted) hourly inputs into the bounds and prices seen by the LP
+# The surplus left after exporting to Spain can feed the electrolyzers and the deficit left after
+# cheap imports from Spain can be covered with H2 (the same pre-dispatch rules as sim7/sim8)
+def dispatch_bounds(inputs, params):
+
+    balance_pt = inputs["balance_pt"]
+    balance_es = inputs["balance_es"]
+    can_exchange = exchange_allowed(inputs["pt_cost"], inputs["es_cost"])
+
+    surplus = balance_pt >= 1
+    export = np.where(surplus & (balance_es < -1) & can_exchange, np.minimum(balance_pt, np.abs(balance_es)), 0.0)
+    available = np.where(surplus, balance_pt - export, 0.0)
+    available = np.where(available >= 1, available, 0.0)
+
+    deficit = np.where(surplus, 0.0, np.abs(balance_pt))
+    cheap_import = (inputs["es_cost"] < params["threshold_buying"]) & can_exchange & (balance_es > 0)
+    imported = np.where(~surplus & cheap_import, np.minimum(np.maximum(balance_es, 0.0), deficit), 0.0)
+
+    return {
+        "max_elec_in": np.minimum(available, params["cap_electrolyzer"] * 1000),
+        "max_elec_out": np.minimum(deficit - imported, params["cap_fuel_cell"] * 1000),
+        "deficit": deficit,
+        "imported": imported,
+    }
+
+
+# Aggregated storage coefficients: kg stored per kWh used and kg withdrawn per kWh recovered
+# The H2 sent to the caverns loses the compressor yield, as in the simulations
+def storage_coefficients(params):
+
+    share_caverns = params["storage_saltCaverns_percentage"]
+    share_tanks = params["storage_pressurisedTanks_percentage"]
+
+    elec_per_kg = (
+        share_caverns * (params["eff_electrolyzer"] + params["comsumption_compressors_saltCaverns"]) +
+        share_tanks * params["eff_electrolyzer"]
+    )
+    eff_compression = share_caverns * params["eff_compressors_saltCaverns"] + share_tanks
+    eff_storage = (
+        share_caverns * params["eff_storage_saltCaverns"] +
+        share_tanks * params["eff_storage_pressurisedTanks"]
+    )
+
+    kg_per_kwh_in = eff_compression / elec_per_kg
+    kg_per_kwh_out = 1 / (params["eff_fuel_cell"] * eff_storage * LHV_H2)
+    return kg_per_kwh_in, kg_per_kwh_out
+
+
+# Window LP with a fixed sparse structure
+#
+# Columns: [elec_in (H) | elec_out (H) | storage (H)]
+# Rows:    storage[t] - storage[t-1] - a * elec_in[t] + b * elec_out[t] = 0 (storage[-1] is the initial level)
+class WindowModel:
+
+    def __init__(self, horizon, kg_per_kwh_in, kg_per_kwh_out, cap_storage_kg):
+
+        self.horizon = horizon
+        self.cap_storage_kg = cap_storage_kg
+        self.num_col = 3 * horizon
+
+        # Column-wise sparse matrix built once
+        rows = np.arange(horizon)
+        start = [0]
+        index = []
+        value = []
+        for t in rows:  # elec_in
+            index.append(t)
+            value.append(-kg_per_kwh_in)
+            start.append(len(index))
+        for t in rows:  # elec_out
+            index.append(t)
+            value.append(kg_per_kwh_out)
+            start.append(len(index))
+        for t in rows:  # storage level appears in its own row and in the next one
+            index.append(t)
+            value.append(1.0)
+            if t + 1 < horizon:
+                index.append(t + 1)
+                value.append(-1.0)
+            start.append(len(index))
+
+        self.start = np.array(start, dtype=np.int32)
+        self.index = np.array(index, dtype=np.int32)
+        self.value = np.array(value, dtype=float)
+
+        self.col_cost = np.zeros(self.num_col)
+        self.col_lower = np.zeros(self.num_col)
+        self.col_upper = np.zeros(self.num_col)
+        self.col_upper[2 * horizon:] = cap_storage_kg
+        self.row_bounds = np.zeros(horizon)
+
+        self.highs = None
+        if highspy is not None:
+            self.highs = highspy.Highs()
+            self.highs.setOptionValue("output_flag", False)
+            lp = highspy.HighsLp()
+            lp.num_col_ = self.num_col
+            lp.num_row_ = horizon
+            lp.col_cost_ = self.col_cost
+            lp.col_lower_ = self.col_lower
+            lp.col_upper_ = self.col_upper
+            lp.row_lower_ = self.row_bounds
+            lp.row_upper_ = self.row_bounds
+            lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+            lp.a_matrix_.start_ = self.start
+            lp.a_matrix_.index_ = self.index
+            lp.a_matrix_.value_ = self.value
+            self.highs.passModel(lp)
+            self._all_cols = np.arange(self.num_col, dtype=np.int32)
+        else:
+            from scipy.sparse import csc_matrix
+            self.a_eq = csc_matrix((self.value, self.index, self.start), shape=(horizon, self.num_col))
+
+    # Updates costs and bounds of the window (arrays may be shorter than the horizon at the end of the year)
+    def update(self, price_in, value_out, max_elec_in, max_elec_out, initial_storage, terminal_value):
+
+        H = self.horizon
+        n = len(price_in)
+
+        self.col_cost[:] = 0.0
+        self.col_cost[:n] = price_in / 1000
+        self.col_cost[H:H + n] = -value_out / 1000
+        self.col_cost[2 * H + n - 1] = -terminal_value
+
+        # Hours beyond the end of the data are padded with zero bounds so the structure never changes
+        self.col_upper[:H] = 0.0
+        self.col_upper[H:2 * H] = 0.0
+        self.col_upper[:n] = max_elec_in
+        self.col_upper[H:H + n] = max_elec_out
+
+        self.row_bounds[:] = 0.0
+        self.row_bounds[0] = initial_storage
+
+        if self.highs is not None:
+            self.highs.changeColsCost(self.num_col, self._all_cols, self.col_cost)
+            self.highs.changeColsBounds(self.num_col, self._all_cols, self.col_lower, self.col_upper)
+            self.highs.changeRowBounds(0, initial_storage, initial_storage)
+
+    # Solves the window and returns (elec_in, elec_out)
+    def solve(self):
+
+        H = self.horizon
+        if self.highs is not None:
+            self.highs.run()
+            status = self.highs.getModelStatus()
+            if status != highspy.HighsModelStatus.kOptimal:
+                raise RuntimeError(f"Rolling horizon window could not be solved: {self.highs.modelStatusToString(status)}")
+            x = np.asarray(self.highs.getSolution().col_value)
+        else:
+            from scipy.optimize import linprog
+            result = linprog(self.col_cost, A_eq=self.a_eq, b_eq=self.row_bounds,
+                             bounds=np.column_stack((self.col_lower, self.col_upper)), method="highs")
+            if result.status != 0:
+                raise RuntimeError(f"Rolling horizon window could not be solved: {result.message}")
+            x = result.x
+        return x[:H], x[H:2 * H]
+
+
+# Function that runs the rolling-horizon dispatch over the hourly arrays
+# Returns the committed hourly electricity used, electricity recovered and storage level
+def rolling_dispatch(inputs, params, horizon=168, step=24, forecast=perfect_forecast, initial_storage=0.0):
+
+    if not 48 <= horizon <= 168 or step > horizon:
+        raise ValueError(f"Invalid rolling horizon: window {horizon} h, step {step} h")
+
+    kg_per_kwh_in, kg_per_kwh_out = storage_coefficients(params)
+    cap_storage_kg = params["cap_storage_kg"]
+    model = WindowModel(horizon, kg_per_kwh_in, kg_per_kwh_out, cap_storage_kg)
+
+    actual = dispatch_bounds(inputs, params)
+    n_hours = len(inputs["balance_pt"])
+
+    elec_in = np.zeros(n_hours)
+    elec_out = np.zeros(n_hours)
+    storage_levels = np.zeros(n_hours)
+    storage = initial_storage
+
+    for start in range(0, n_hours, step):
+
+        seen = forecast(inputs, start, horizon)
+        bounds = dispatch_bounds(seen, params)
+
+        # H2 left at the end of the window is valued at the average price it could displace
+        terminal_value = seen["pt_cost"].mean() / 1000 / kg_per_kwh_out
+
+        model.update(seen["pt_cost"], seen["pt_cost"], bounds["max_elec_in"], bounds["max_elec_out"], storage, terminal_value)
+        planned_in, planned_out = model.solve()
+
+        # Commit the first hours, corrected with the actual data when the forecast was wrong
+        for t in range(start, min(start + step, n_hours)):
+            k = t - start
+            used = min(max(planned_in[k], 0.0), actual["max_elec_in"][t], (cap_storage_kg - storage) / kg_per_kwh_in)
+            recovered = min(max(planned_out[k], 0.0), actual["max_elec_out"][t], storage / kg_per_kwh_out)
+            storage = min(max(storage + used * kg_per_kwh_in - recovered * kg_per_kwh_out, 0.0), cap_storage_kg)
+
+            elec_in[t] = used
+            elec_out[t] = recovered
+            storage_levels[t] = storage
+
+    return elec_in, elec_out, storage_levels, actual, kg_per_kwh_in, kg_per_kwh_out
+
+
+# Rolling-horizon version of the economic model, with the same arguments and outputs as results_simulation of sim7
+def results_simulation(scenario, year, storage_ratio, threshold_selling, horizon=168, step=24, forecast=perfect_forecast):
+
+    # Load (and check) hourly energy data for the selected scenario and year
+    df = hourly_data(scenario, year)
+    params = case_parameters(scenario, year, storage_ratio, threshold_selling)
+
+    inputs = hourly_inputs(df)
+    elec_in, elec_out, storage_levels, actual, kg_per_kwh_in, kg_per_kwh_out = rolling_dispatch(
+        inputs, params, horizon=horizon, step=step, forecast=forecast)
+
+    # Create columns for outputs
+    df["H2_produced [kg]"] = elec_in * kg_per_kwh_in
+    df["H2_converted [kg]"] = elec_out * kg_per_kwh_out
+    df["Storage H2 [kg]"] = storage_levels
+    df["Elec_used_for_H2 [kWh]"] = elec_in
+    df["Elec_from_H2 [kWh]"] = elec_out
+    df["Elec_recovered [kWh]"] = elec_out + actual["imported"]
+    df["Cost_H2_production [€]"] = df["Elec_used_for_H2 [kWh]"] * df["PT Marginal Cost [€]"] / 1000
+
+    # Final results
+    capex_total = params["capex_total"]
+    opex_total = params["opex_total"]
+    total_deficits = actual["deficit"].sum()
+    total_recovered = df["Elec_recovered [kWh]"].sum()
+    total_cost_electricity_used = df["Cost_H2_production [€]"].sum()
+    h2_total_production = df["H2_produced [kg]"].sum()
+    h2_total_conversion = df["H2_converted [kg]"].sum()
+
+    flex_index = (total_recovered / total_deficits) * 100 if total_deficits > 0 else 0
+    flex_index_H2 = (df["Elec_from_H2 [kWh]"].sum() / total_deficits) * 100 if total_deficits > 0 else 0
+    lcoh = (capex_total + opex_total + total_cost_electricity_used) / h2_total_production if h2_total_production > 0 else 0
+
+    print(f"\n--- Rolling Horizon Results for {scenario} {year} ({horizon} h window, {step} h step) ---")
+    print(f"Total H2 produced: {h2_total_production:.2f} kg")
+    print(f"Total H2 converted: {h2_total_conversion:.2f} kg")
+    print(f"Grid Flexibility Index with imports and H2: {flex_index:.2f} %")
+    print(f"Grid Flexibility Index with H2: {flex_index_H2:.2f} %")
+    print(f"LCOH: {lcoh:.2f} €/kg")
+
+    summary = {
+        "Scenario": scenario,
+        "Year": year,
+        "Storage in Salt Caverns (%)": storage_ratio,
+        "Storage in Pressurized Tanks (%)": (100-storage_ratio),
+        "Buying Threshold": params["threshold_buying"],
+        "Selling Threshold": threshold_selling,
+        "Horizon (hours)": horizon,
+        "Step (hours)": step,
+        "H2 Produced (kg)": h2_total_production,
+        "H2 Converted (kg)": h2_total_conversion,
+        "Energy Recovered (kWh)": total_recovered,
+        "Electricity Cost [€]": total_cost_electricity_used,
+        "Yearly CAPEX [€]": capex_total,
+        "Yearly OPEX [€]": opex_total,
+        "Flexibility Index (%)": flex_index,
+        "Flexibility Index H2(%)": flex_index_H2,
+        "LCOH (€/kg)": lcoh
+    }
+
+    return df, summary
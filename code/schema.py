@@ -0,0 +1,135 @@
+# SCHEMA
+#
+# This file describes the columns expected in the excels (hourly scenario
+# sheets and equipment / installed capacity tables) and checks them once,
+# when the data is loaded: missing columns, types, number of hours, empty
+# cells and values outside the expected range (which usually means the
+# column is in other units, e.g. kW instead of MW or % instead of 0 - 1).
+#
+# After the check the kernels get the columns as contiguous float arrays
+# and address them by position, so a bad sheet fails right away instead
+# of in the middle of a sweep.
+
+import numpy as np
+import pandas as pd
+
+# Column: (type, minimum, maximum); None means no limit
+HOURLY_SCHEMA = {
+    "Date/Hour": ("text", None, None),
+    "PT Balance [MW]": ("number", -100000, 100000),
+    "ES Balance [MW]": ("number", -500000, 500000),
+    "Balance with Exchanges [MW]": ("number", -100000, 100000),
+    "PT Marginal Cost [€]": ("number", -1000, 10000),
+    "ES Marginal Cost [€]": ("number", -1000, 10000),
+}
+
+# Hours of a normal and of a leap year
+HOURS_PER_YEAR = (8760, 8784)
+
+EFFICIENCY = ("number", 0, 1)
+LIFETIME = ("number", 1000, None)  # hours, not years
+COSTS = {
+    "OPEX yearly (€/kW/year)": ("number", 0, None),
+    "Lifetime (hours)": LIFETIME,
+}
+
+ELECTROLYZER_SCHEMA = {"CAPEX (€/kW)": ("number", 0, None), **COSTS, "Efficiency (kWh/kgH2)": ("number", 33.33, 100)}
+FUEL_CELL_SCHEMA = {"CAPEX (€/kW)": ("number", 0, None), **COSTS, "Efficiency (%)": EFFICIENCY}
+STORAGE_SCHEMA = {"CAPEX (€/kgH2)": ("number", 0, None), **COSTS, "Efficiency (%)": EFFICIENCY}
+COMPRESSOR_SCHEMA = {
+    "CAPEX (€/kW)": ("number", 0, None), **COSTS,
+    "Consumption (kWh/kgH2)": ("number", 0, 50), "Efficiency (%)": EFFICIENCY,
+}
+INSTALLED_CAPACITY_SCHEMA = {
+    "Electrolyzers (MW)": ("number", 0, None),
+    "Storage (MWH2)": ("number", 0, None),
+    "Fuel Cells (MW)": ("number", 0, None),
+}
+
+# Schemas of the tables of extract_data.TABLES
+TABLE_SCHEMAS = {
+    "df_electrolyzers": ELECTROLYZER_SCHEMA,
+    "df_fuel_cells": FUEL_CELL_SCHEMA,
+    "df_storage_saltCaverns": STORAGE_SCHEMA,
+    "df_compressors_saltCaverns": COMPRESSOR_SCHEMA,
+    "df_storage_pressurisedTanks": STORAGE_SCHEMA,
+    "df_compressors_pressurisedTanks": COMPRESSOR_SCHEMA,
+    "df_NT_installed_cap": INSTALLED_CAPACITY_SCHEMA,
+    "df_GA_installed_cap": INSTALLED_CAPACITY_SCHEMA,
+    "df_DE_installed_cap": INSTALLED_CAPACITY_SCHEMA,
+}
+
+
+# Function that lists the problems of a dataframe against a schema (empty list if it is valid)
+def check(df, schema):
+
+    problems = []
+    for column, (kind, minimum, maximum) in schema.items():
+        if column not in df.columns:
+            problems.append(f"missing column '{column}'")
+            continue
+
+        values = df[column]
+        if values.isna().any():
+            problems.append(f"'{column}' has {int(values.isna().sum())} empty cells (first at {values[values.isna()].index[0]})")
+            continue
+
+        if kind == "text":
+            if not (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)):
+                problems.append(f"'{column}' should be text, found {values.dtype}")
+            continue
+
+        if not pd.api.types.is_numeric_dtype(values) or pd.api.types.is_bool_dtype(values):
+            problems.append(f"'{column}' should be numeric, found {values.dtype}")
+            continue
+
+        if minimum is not None and values.min() < minimum:
+            problems.append(f"'{column}' has values below {minimum} (minimum {values.min():.4g}), check the units")
+        if maximum is not None and values.max() > maximum:
+            problems.append(f"'{column}' has values above {maximum} (maximum {values.max():.4g}), check the units")
+
+    return problems
+
+
+# Function that raises an error with all the problems of a dataframe
+# source names the sheet in the message (e.g. "NT.xlsx, sheet 2030")
+def validate(df, schema, source, n_rows=None):
+
+    if df is None:
+        raise ValueError(f"{source}: no data (file or sheet not found)")
+
+    problems = check(df, schema)
+    if n_rows is not None and len(df) not in n_rows:
+        problems.insert(0, f"{len(df)} rows, expected {' or '.join(str(n) for n in n_rows)}")
+
+    if problems:
+        raise ValueError(f"{source}: " + "; ".join(problems))
+    return df
+
+
+# Function that checks an hourly scenario sheet (one year of hours)
+def validate_hourly(df, source="hourly data"):
+
+    return validate(df, HOURLY_SCHEMA, source, n_rows=HOURS_PER_YEAR)
+
+
+# Function that checks one of the tables of extract_data.TABLES
+def validate_table(name, df, source=None):
+
+    return validate(df, TABLE_SCHEMAS[name], source or name)
+
+
+# Function that reads and checks the hourly sheet of a scenario and year
+def hourly_data(scenario, year):
+
+    from extract_data import get_data
+
+    df = get_data(str(year), f"{scenario}.xlsx", "Index")
+    return validate_hourly(df, f"{scenario}.xlsx, sheet {year}")
+
+
+# Function that returns the columns of a dataframe as one contiguous float array (hours x columns)
+# so the kernels read them by position
+def column_array(df, columns):
+
+    return np.ascontiguousarray(df[columns].to_numpy(dtype=np.float64))
@@ -0,0 +1,257 @@
+# SEGMENT DISPATCH
+#
+# This file runs the dispatch of the kernel by runs of hours instead of
+# hour by hour. Most hours of a year do not change the storage: deficits
+# with the storage empty or the electricity too cheap to reconvert,
+# surpluses too expensive to produce, or surpluses with the storage full
+# (where sim8 sells all the electricity available as H2). The hours are
+# classified in one pass and split in runs of the same kind (as the
+# episodes of episodes.py):
+#
+#   charge      surplus below the buying threshold, after the exports
+#   discharge   deficit above the selling threshold, after the imports
+#   passive     every other hour (never changes the storage)
+#
+# and the dispatch jumps from event to event: a charge run is stepped
+# with the kernel only until the storage is full, a discharge run only
+# until it is empty, and the rest of the run (and every passive run) is
+# filled in closed form, with the accumulators (deficits, H2 sold,
+# revenue) updated from prefix sums. The outputs are the same as
+# dispatch_kernel.run_dispatch (the accumulators within rounding).
+
+import numpy as np
+
+import dispatch_kernel as kernel
+from dispatch_kernel import njit
+
+# Kinds of runs
+PASSIVE = 0
+CHARGE = 1
+DISCHARGE = 2
+
+# Columns of the prefix sums
+C_DEFICIT = 0
+C_H2_SOLD = 1
+C_REVENUE = 2
+C_AVAILABLE = 3
+C_RECOVERED = 4
+N_CUMULATIVE = 5
+
+# Parameters the kinds of the hours depend on (the storage and reservoirs do not change them)
+CLASSIFY_PARAMETERS = [
+    kernel.P_EFF_ELECTROLYZER, kernel.P_THRESHOLD_BUYING, kernel.P_THRESHOLD_SELLING, kernel.P_H2_PRICE,
+    kernel.P_SELLING, kernel.P_MAX_PRICE_DIFF, kernel.P_CAP_ELECTROLYZER,
+]
+
+
+# Classifies the hours and computes what they give when the storage does not change, in one pass
+# The operations are the same as in dispatch_hour, so the values are the same. Fills kinds, available
+# (kWh for H2), recovered (kWh imported when the storage is empty), h2_sold (kg) and revenue (€) of a full
+# storage, and their prefix sums (cumulative, one more row than the hours, columns C_*)
+@njit(cache=True)
+def classify_hours(hourly, p, kinds, available, recovered, h2_sold, revenue, cumulative):
+
+    for t in range(hourly.shape[0]):
+        balance_pt = hourly[t, kernel.H_BALANCE_PT] * 1000
+        balance_es = hourly[t, kernel.H_BALANCE_ES] * 1000
+        pt_electricityCost = hourly[t, kernel.H_PT_COST]
+        es_electricityCost = hourly[t, kernel.H_ES_COST]
+
+        if pt_electricityCost > 0:
+            price_diff = abs(pt_electricityCost - es_electricityCost) / pt_electricityCost
+        elif es_electricityCost > 0:
+            price_diff = abs(es_electricityCost - pt_electricityCost) / es_electricityCost
+        else:
+            price_diff = 0.0
+        can_exchange = price_diff <= p[kernel.P_MAX_PRICE_DIFF]
+
+        kinds[t] = PASSIVE
+        available[t] = 0.0
+        recovered[t] = 0.0
+        h2_sold[t] = 0.0
+        revenue[t] = 0.0
+        deficit_energy = 0.0
+
+        # Surplus: exports to Spain first, then the electricity left for the electrolyzers
+        if balance_pt >= 1:
+            if pt_electricityCost <= p[kernel.P_THRESHOLD_BUYING]:
+                if balance_es < -1 and can_exchange:
+                    balance_pt -= min(balance_pt, abs(balance_es))
+                if balance_pt >= 1:
+                    kinds[t] = CHARGE
+                    available[t] = min(balance_pt, p[kernel.P_CAP_ELECTROLYZER])
+                    if p[kernel.P_SELLING] == 1:
+                        h2_sold[t] = available[t] / p[kernel.P_EFF_ELECTROLYZER]
+                        revenue[t] = h2_sold[t] * p[kernel.P_H2_PRICE]
+
+        # Deficit: imports below the buying threshold, then the deficit left for the fuel cells
+        else:
+            deficit_energy = abs(balance_pt)
+            deficit_left = deficit_energy
+            energy_imported = 0.0
+            if es_electricityCost < p[kernel.P_THRESHOLD_BUYING] and can_exchange and balance_es > 0:
+                energy_imported = min(balance_es, deficit_left)
+                deficit_left -= energy_imported
+            if deficit_left > 0 and pt_electricityCost >= p[kernel.P_THRESHOLD_SELLING]:
+                kinds[t] = DISCHARGE
+                if energy_imported == 0 and balance_es > 0 and can_exchange:
+                    energy_imported += min(balance_es, deficit_left)
+                recovered[t] = 0.0 + energy_imported
+
+        cumulative[t + 1, C_DEFICIT] = cumulative[t, C_DEFICIT] + deficit_energy
+        cumulative[t + 1, C_H2_SOLD] = cumulative[t, C_H2_SOLD] + h2_sold[t]
+        cumulative[t + 1, C_REVENUE] = cumulative[t, C_REVENUE] + revenue[t]
+        cumulative[t + 1, C_AVAILABLE] = cumulative[t, C_AVAILABLE] + available[t]
+        cumulative[t + 1, C_RECOVERED] = cumulative[t, C_RECOVERED] + recovered[t]
+
+
+# Function that splits the hours in runs of the same kind (as the episodes of episodes.py)
+# Returns the start, stop (exclusive) and kind of every run, in order
+def kind_runs(kinds):
+
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(kinds)) + 1))
+    stops = np.append(starts[1:], len(kinds))
+    return starts, stops, kinds[starts]
+
+
+# Dispatches the runs: steps the hours that change the storage with the kernel and fills the others
+# cumulative are the prefix sums of classify_hours
+# Returns the number of hours stepped with the kernel
+@njit(cache=True)
+def dispatch_runs(hourly, p, state, out, starts, stops, run_kinds, available, recovered, h2_sold, revenue, cumulative):
+
+    stepped = 0
+    for r in range(len(starts)):
+        t = starts[r]
+        stop = stops[r]
+        kind = run_kinds[r]
+
+        # Events: the storage becomes full (charge) or empty (discharge)
+        if kind == CHARGE:
+            while t < stop and state[kernel.S_STORAGE] < p[kernel.P_CAP_STORAGE]:
+                kernel.dispatch_hour(hourly, t, p, state, out)
+                t += 1
+                stepped += 1
+        elif kind == DISCHARGE:
+            while t < stop and state[kernel.S_STORAGE] > 0:
+                kernel.dispatch_hour(hourly, t, p, state, out)
+                t += 1
+                stepped += 1
+        if t == stop:
+            continue
+
+        # Rest of the run in closed form: the storage stays where it is
+        for k in range(t, stop):
+            out[k, kernel.O_STORAGE] = state[kernel.S_STORAGE]
+        if kind == CHARGE:
+            if p[kernel.P_SELLING] == 1:
+                for k in range(t, stop):
+                    out[k, kernel.O_H2_SOLD] = h2_sold[k]
+                    out[k, kernel.O_ELEC_SOLD] = available[k]
+                    out[k, kernel.O_REVENUE] = revenue[k]
+                    out[k, kernel.O_ELEC_TOTAL] = available[k]
+                    out[k, kernel.O_H2_PRODUCED] = h2_sold[k]
+                state[kernel.S_H2_SOLD] += cumulative[stop, C_H2_SOLD] - cumulative[t, C_H2_SOLD]
+                state[kernel.S_REVENUE] += cumulative[stop, C_REVENUE] - cumulative[t, C_REVENUE]
+        else:
+            if kind == DISCHARGE:
+                for k in range(t, stop):
+                    out[k, kernel.O_ELEC_RECOVERED] = recovered[k]
+            state[kernel.S_TOTAL_DEFICITS] += cumulative[stop, C_DEFICIT] - cumulative[t, C_DEFICIT]
+
+    return stepped
+
+
+# Same as dispatch_runs keeping only the yearly totals (columns of the outputs and the cost of the
+# electricity used for H2, as ratio_sweep.dispatch_ratios): the skipped runs cost one step each
+@njit(cache=True)
+def dispatch_runs_totals(hourly, p, state, totals, starts, stops, run_kinds, cumulative):
+
+    out = np.zeros((1, kernel.N_OUTPUTS))
+    for r in range(len(starts)):
+        t = starts[r]
+        stop = stops[r]
+        kind = run_kinds[r]
+
+        while t < stop and ((kind == CHARGE and state[kernel.S_STORAGE] < p[kernel.P_CAP_STORAGE]) or
+                            (kind == DISCHARGE and state[kernel.S_STORAGE] > 0)):
+            kernel.dispatch_hour(hourly[t:t + 1], 0, p, state, out)
+            for j in range(kernel.N_OUTPUTS):
+                totals[j] += out[0, j]
+            totals[kernel.N_OUTPUTS] += out[0, kernel.O_ELEC_USED] * hourly[t, kernel.H_PT_COST] / 1000
+            t += 1
+        if t == stop:
+            continue
+
+        totals[kernel.O_STORAGE] += state[kernel.S_STORAGE] * (stop - t)
+        if kind == CHARGE:
+            if p[kernel.P_SELLING] == 1:
+                h2_sold = cumulative[stop, C_H2_SOLD] - cumulative[t, C_H2_SOLD]
+                sold = cumulative[stop, C_AVAILABLE] - cumulative[t, C_AVAILABLE]
+                revenue = cumulative[stop, C_REVENUE] - cumulative[t, C_REVENUE]
+                totals[kernel.O_H2_SOLD] += h2_sold
+                totals[kernel.O_H2_PRODUCED] += h2_sold
+                totals[kernel.O_ELEC_SOLD] += sold
+                totals[kernel.O_ELEC_TOTAL] += sold
+                totals[kernel.O_REVENUE] += revenue
+                state[kernel.S_H2_SOLD] += h2_sold
+                state[kernel.S_REVENUE] += revenue
+        else:
+            if kind == DISCHARGE:
+                totals[kernel.O_ELEC_RECOVERED] += cumulative[stop, C_RECOVERED] - cumulative[t, C_RECOVERED]
+            state[kernel.S_TOTAL_DEFICITS] += cumulative[stop, C_DEFICIT] - cumulative[t, C_DEFICIT]
+
+
+# Function that classifies the hours of an hourly array for a parameter array
+# Returns the runs (starts, stops, kinds) and the arrays of classify_hours
+def classify(hourly, p):
+
+    n = hourly.shape[0]
+    kinds = np.empty(n, dtype=np.int8)
+    available, recovered, h2_sold, revenue = np.empty(n), np.empty(n), np.empty(n), np.empty(n)
+    cumulative = np.zeros((n + 1, N_CUMULATIVE))
+    classify_hours(hourly, p, kinds, available, recovered, h2_sold, revenue, cumulative)
+    return kind_runs(kinds), available, recovered, h2_sold, revenue, cumulative
+
+
+# Dispatches several parameter arrays (rows of P, like ratio_sweep.dispatch_ratios) keeping their totals
+# The hours are classified once for all the rows with the same CLASSIFY_PARAMETERS (e.g. all the storage ratios)
+def dispatch_batch(hourly, P, states, totals):
+
+    keys = [tuple(row) for row in P[:, CLASSIFY_PARAMETERS]]
+    for key in dict.fromkeys(keys):
+        rows = [k for k in range(len(keys)) if keys[k] == key]
+        (starts, stops, run_kinds), _, _, _, _, cumulative = classify(hourly, P[rows[0]])
+        for k in rows:
+            dispatch_runs_totals(hourly, P[k], states[k], totals[k], starts, stops, run_kinds, cumulative)
+
+
+# Function that runs the dispatch over a full hourly array by runs of hours
+# Returns the hourly outputs, the final state and the number of hours stepped with the kernel
+def dispatch_segments(hourly, p, state=None):
+
+    state = kernel.initial_state(p) if state is None else state.copy()
+    out = np.zeros((hourly.shape[0], kernel.N_OUTPUTS))
+
+    (starts, stops, run_kinds), available, recovered, h2_sold, revenue, cumulative = classify(hourly, p)
+    stepped = dispatch_runs(hourly, p, state, out, starts, stops, run_kinds, available, recovered, h2_sold, revenue, cumulative)
+    return out, state, stepped
+
+
+# Same as kernel.run_dispatch (hourly outputs and final state, the given state is not modified)
+def run_segments(hourly, p, state=None):
+
+    out, state, _ = dispatch_segments(hourly, p, state)
+    return out, state
+
+
+# Segment version of results_simulation of sim8 (selling=True) or sim7 (selling=False)
+# Returns the same (df, summary) as the legacy simulations
+def results_simulation(scenario, year, storage_ratio, threshold_selling, selling=True):
+
+    from system_parameters import case_parameters
+    from schema import hourly_data
+
+    df = hourly_data(scenario, year)
+    params = case_parameters(scenario, year, storage_ratio, threshold_selling, selling=selling)
+    return kernel.results_from_dataframe(df, params, selling=selling, run=run_segments, validated=True)
@@ -0,0 +1,209 @@
+# SHARED DATA
+#
+# This file is the data plane of the parallel sweeps. The hourly arrays
+# of a scenario-year and the parameters of the cases are placed once in
+# shared memory (or in a memory-mapped file of a folder) and the workers
+# attach to them by name, read-only, instead of receiving a pickled copy
+# of the dataframe with every task. The results are written by the
+# workers straight into output blocks allocated by the main process
+# (states, totals and, if asked, the hourly outputs of every case), so
+# a task only carries a few names and the rows it has to run.
+#
+#   with DataPlane() as plane:
+#       hourly = plane.hourly("GA", 2040)          # published once
+#       totals, array = plane.allocate((n, 12))    # filled by the workers
+#
+# The blocks are removed when the plane is closed (the memory-mapped
+# files stay in their folder, so other processes can keep reading them).
+
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import dispatch_kernel as kernel
+from schema import hourly_data
+from ratio_sweep import dispatch_ratios, parameter_matrix, sweep_summaries, ratio_parameters, T_COST
+
+# Blocks this process is attached to: {name or path: (SharedMemory or None, array)}
+_attached = {}
+
+
+# Function that attaches to a block published by another process (once per process)
+# descriptor is the dictionary returned by DataPlane.publish / allocate; the array is read-only unless writable
+def attach(descriptor, writable=False):
+
+    key = descriptor["path"] or descriptor["name"]
+    if key not in _attached:
+        shape, dtype = tuple(descriptor["shape"]), np.dtype(descriptor["dtype"])
+        if descriptor["path"]:
+            _attached[key] = (None, np.memmap(descriptor["path"], dtype=dtype, mode="r+", shape=shape))
+        else:
+            block = shared_memory.SharedMemory(name=descriptor["name"])
+            _attached[key] = (block, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+
+    array = _attached[key][1].view()
+    array.flags.writeable = writable
+    return array
+
+
+# Function that detaches this process from all the blocks (the blocks themselves are kept)
+def detach_all():
+
+    for block, _ in _attached.values():
+        if block is not None:
+            block.close()
+    _attached.clear()
+
+
+# Shared blocks owned by the main process
+class DataPlane:
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.blocks = {}
+        self.descriptors = {}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    # Allocates an empty (zero) block; returns its descriptor and the array of this process
+    def allocate(self, shape, dtype=np.float64, key=None):
+
+        shape = tuple(int(n) for n in shape)
+        nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+        name = f"h2_{os.getpid()}_{uuid.uuid4().hex[:12]}"
+
+        if self.directory:
+            path = os.path.join(self.directory, f"{key or name}.bin")
+            array = np.memmap(path, dtype=dtype, mode="w+", shape=shape)
+            block = None
+        else:
+            path = None
+            block = shared_memory.SharedMemory(name=name, create=True, size=nbytes)
+            array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            array[...] = 0
+
+        descriptor = {"name": name, "path": path, "shape": shape, "dtype": np.dtype(dtype).str}
+        self.blocks[name] = (block, path)
+        _attached[path or name] = (block, array)
+        if key is not None:
+            self.descriptors[key] = descriptor
+        return descriptor, array
+
+    # Copies an array into a new block (once per key); returns its descriptor
+    def publish(self, key, values):
+
+        if key not in self.descriptors:
+            values = np.ascontiguousarray(values)
+            _, array = self.allocate(values.shape, values.dtype, key)
+            array[...] = values
+        return self.descriptors[key]
+
+    # Publishes the hourly array of a scenario and year (HOURLY_COLUMNS of the kernel)
+    def hourly(self, scenario, year):
+
+        key = f"hourly_{scenario}_{year}"
+        if key not in self.descriptors:
+            self.publish(key, kernel.hourly_array(hourly_data(scenario, year), validated=True))
+        return self.descriptors[key]
+
+    # Removes the shared blocks (the arrays of this process must not be used after closing)
+    def close(self):
+
+        for name, (block, path) in self.blocks.items():
+            _, array = _attached.pop(path or name, (None, None))
+            if block is None:
+                array.flush()
+                continue
+            del array
+            try:
+                block.close()
+            except BufferError:
+                pass  # an array still points to the block, the memory is released with it
+            block.unlink()
+        self.blocks = {}
+        self.descriptors = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Runs the rows [start, stop) of a sweep in a worker: reads the shared hourly array and parameters and writes
+# the states, totals and (optionally) hourly outputs of its rows in the shared output blocks
+def _sweep_rows(hourly, P, states, totals, outputs, start, stop, segments):
+
+    hourly = attach(hourly)
+    P = attach(P)
+    states = attach(states, writable=True)
+    totals = attach(totals, writable=True)
+
+    if outputs is not None:
+        outputs = attach(outputs, writable=True)
+        for k in range(start, stop):
+            kernel.dispatch_range(hourly, P[k], states[k], outputs[k], 0, hourly.shape[0])
+            for j in range(kernel.N_OUTPUTS):
+                totals[k, j] = outputs[k, :, j].sum()
+            totals[k, T_COST] = (outputs[k, :, kernel.O_ELEC_USED] * hourly[:, kernel.H_PT_COST] / 1000).sum()
+    elif segments:
+        from segment_dispatch import dispatch_batch
+        dispatch_batch(hourly, P[start:stop], states[start:stop], totals[start:stop])
+    else:
+        dispatch_ratios(hourly, P[start:stop], states[start:stop], totals[start:stop])
+    return stop - start
+
+
+# Function that runs a sweep over several processes with the shared data plane
+# params_list are system_parameters dictionaries of the same scenario and year; with hourly_outputs the hourly
+# outputs of every case are kept (cases x hours x kernel.OUTPUT_COLUMNS), otherwise only the totals
+# Returns the summaries (as ratio_sweep.sweep_from_hourly) and the hourly outputs (or None)
+def parallel_sweep(scenario, year, params_list, selling=True, power_limits=False, segments=False, workers=None,
+                   hourly_outputs=False, directory=None):
+
+    workers = workers or os.cpu_count() or 1
+    P_local, states_local, totals_local = parameter_matrix(params_list, selling, power_limits)
+    n_cases = len(params_list)
+
+    with DataPlane(directory) as plane:
+        hourly = plane.hourly(scenario, year)
+        P = plane.publish("parameters", P_local)
+        states, states_array = plane.allocate(states_local.shape, key="states")
+        totals, totals_array = plane.allocate(totals_local.shape, key="totals")
+        outputs, outputs_array = None, None
+        if hourly_outputs:
+            outputs, outputs_array = plane.allocate((n_cases, hourly["shape"][0], kernel.N_OUTPUTS), key="outputs")
+
+        bounds = np.linspace(0, n_cases, min(workers, n_cases) + 1).astype(int)
+        tasks = [(hourly, P, states, totals, outputs, start, stop, segments) for start, stop in zip(bounds[:-1], bounds[1:])]
+        if workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=len(tasks)) as executor:
+                list(executor.map(_sweep_rows, *zip(*tasks)))
+        else:
+            for task in tasks:
+                _sweep_rows(*task)
+
+        df_summary = sweep_summaries(params_list, P_local, states_array, totals_array)
+        # The only copy of the outputs, out of the shared block before it is removed
+        hourly_results = np.array(outputs_array) if hourly_outputs else None
+        del states_array, totals_array, outputs_array
+
+    return df_summary, hourly_results
+
+
+# Function that runs the sweep of storage ratios of ratio_sweep over several processes
+def results_sweep(scenario, year, threshold_selling, storage_ratios=range(0, 101), selling=True, workers=None, segments=False):
+
+    params_list = ratio_parameters(scenario, year, threshold_selling, list(storage_ratios), selling=selling)
+    df_summary, _ = parallel_sweep(scenario, year, params_list, selling=selling, segments=segments, workers=workers)
+    return df_summary
+
+
+# Function that turns the hourly outputs of one case of parallel_sweep into a dataframe
+def case_outputs(hourly_results, case):
+
+    return pd.DataFrame(hourly_results[case], columns=kernel.OUTPUT_COLUMNS)
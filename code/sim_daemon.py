@@ -0,0 +1,259 @@
+# SIMULATION DAEMON
+#
+# This file keeps a simulation process running in the background, so the
+# start-up of python and pandas, the reading of the excels and the
+# compilation of the kernel are paid once instead of on every run. The
+# sheets read stay in memory (extract_data) and a job is a small json
+# request, answered in milliseconds once the sheets of its scenario and
+# year have been read (sim8-kernel takes ~15 ms; the legacy hourly loops
+# of sim7 / sim8 / sim10 still take the time of their loop).
+#
+# The daemon listens on localhost (HTTP) or on a Unix socket:
+#   http://127.0.0.1:8765    POST the job as json, GET /status (the other commands are POST only)
+#   unix:/tmp/h2sim.sock     one json job per line, one json answer per line
+#
+# Jobs (any simulation of h2sim):
+#   {"simulation": "sim8", "case": {"scenario": "NT", "year": 2040, "storage_ratio": 100, "threshold": 17.58}}
+#   {"simulation": "sim8", "case": {...}, "hourly": true}          also returns the hourly results
+#   {"simulation": "sim8", "grid": {"scenario": ["NT", "GA"], "year": [2030], ...}}
+#   {"command": "preload", "scenarios": ["NT", "GA"], "years": [2030, 2040]}
+#   {"command": "status"}
+#   {"command": "shutdown"}
+#
+# The jobs are run one at a time (the simulations share the sheets in
+# memory); the prints of the simulation are returned in "output".
+#
+# pandas is only imported by the daemon, so the client stays quick.
+
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.request import Request, urlopen
+
+DEFAULT_ADDRESS = "http://127.0.0.1:8765"
+
+
+# Converts the values json does not know (numpy numbers, dates) for the answers
+def _json_value(value):
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+# Daemon that keeps the data of the simulations in memory and runs the jobs
+class SimulationDaemon:
+
+    def __init__(self):
+        self.started = time.time()
+        self.jobs = 0
+        self.running = True
+
+    # Reads the hourly sheets of the scenarios and years, the tables of extract_data and the H2 prices
+    # Every excel is opened once and the different excels are read at the same time
+    def preload(self, scenarios=("NT", "GA", "DE"), years=(2030, 2040, 2050)):
+
+        import extract_data
+        from schema import validate_hourly
+
+        tables = {f"{scenario} {year}": (str(year), f"{scenario}.xlsx", "Index") for scenario in scenarios for year in years}
+        tables.update(extract_data.TABLES)
+        tables["H2 prices"] = ("Prices", "H2_prices.xlsx", "Year")
+        frames = extract_data.load_tables(tables)
+        for scenario in scenarios:
+            for year in years:
+                validate_hourly(frames[f"{scenario} {year}"], f"{scenario}.xlsx, sheet {year}")
+        extract_data.df_electrolyzers
+        return {"sheets": len(extract_data._loaded)}
+
+    def status(self):
+
+        import extract_data
+
+        return {
+            "pid": os.getpid(),
+            "uptime (s)": time.time() - self.started,
+            "jobs": self.jobs,
+            "sheets": [f"{file_path}, sheet {sheet_name}" for file_path, sheet_name, _ in extract_data._loaded],
+        }
+
+    # Runs one case of a simulation; with hourly the hourly results are returned as well
+    def run_simulation(self, simulation, case, hourly=False):
+
+        import h2sim
+        import pandas as pd
+        from work_queue import case_summaries
+
+        if simulation not in h2sim.SIMULATIONS:
+            raise ValueError(f"Unknown simulation '{simulation}' (valid: {', '.join(h2sim.SIMULATIONS)})")
+        folder, module_name, function_name, arguments = h2sim.SIMULATIONS[simulation]
+        missing = [name for name in arguments if name not in case]
+        if missing:
+            raise ValueError(f"{simulation} needs: {', '.join(missing)}")
+
+        function = getattr(h2sim.load_module(folder, module_name), function_name)
+        result = function(*[case[name] for name in arguments])
+
+        answer = {"results": case_summaries(case, result)}
+        if hourly:
+            df = result[0] if isinstance(result, tuple) else result
+            if isinstance(df, pd.DataFrame):
+                answer["columns"] = [str(column) for column in df.columns]
+                answer["hourly"] = df.to_numpy().tolist()
+        return answer
+
+    # Answers a job (dictionary) with a dictionary; the errors of the job are answered, not raised
+    def handle(self, job):
+
+        start = time.perf_counter()
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                command = job.get("command", "run")
+                if command == "status":
+                    answer = self.status()
+                elif command == "preload":
+                    answer = self.preload(**{key: job[key] for key in ("scenarios", "years") if key in job})
+                elif command == "shutdown":
+                    self.running = False
+                    answer = {}
+                elif command == "run" and "simulation" not in job:
+                    import h2sim
+                    raise ValueError(f"The job has no simulation (valid: {', '.join(h2sim.SIMULATIONS)})")
+                elif command == "run" and "grid" in job:
+                    from work_queue import grid_cases
+                    cases = grid_cases(**job["grid"])
+                    answer = {"results": [row for case in cases for row in self.run_simulation(job["simulation"], case)["results"]]}
+                elif command == "run":
+                    answer = self.run_simulation(job["simulation"], job.get("case", {}), job.get("hourly", False))
+                else:
+                    raise ValueError(f"Unknown command '{command}'")
+            answer["ok"] = True
+            self.jobs += 1
+        except Exception as e:
+            answer = {"ok": False, "error": repr(e)}
+
+        answer["output"] = output.getvalue()
+        answer["seconds"] = time.perf_counter() - start
+        return answer
+
+
+# HTTP: POST / with the job, GET /status
+# GET only reads the status, the commands that change the daemon (preload, shutdown) must be POSTed
+class _HTTPHandler(BaseHTTPRequestHandler):
+
+    def _answer(self, answer, status=None):
+        body = json.dumps(answer, default=_json_value).encode()
+        self.send_response(status or (200 if answer["ok"] else 400))
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        command = self.path.strip("/") or "status"
+        if command != "status":
+            return self._answer({"ok": False, "error": f"GET only answers /status, POST {{\"command\": \"{command}\"}} instead"}, 405)
+        self._answer(self.server.simulations.handle({"command": "status"}))
+
+    def do_POST(self):
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        except ValueError as e:
+            return self._answer({"ok": False, "error": f"The job is not valid json: {e}"})
+        self._answer(self.server.simulations.handle(job))
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Unix socket: one json job per line, one json answer per line (several jobs per connection)
+class _SocketHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                answer = self.server.simulations.handle(json.loads(line))
+            except ValueError as e:
+                answer = {"ok": False, "error": f"The job is not valid json: {e}"}
+            self.wfile.write(json.dumps(answer, default=_json_value).encode() + b"\n")
+            self.wfile.flush()
+            if not self.server.simulations.running:
+                break
+
+
+# Function that opens the server of an address ("http://HOST:PORT" or "unix:PATH")
+def open_server(address):
+
+    if address.startswith("unix:"):
+        path = address[len("unix:"):]
+        if os.path.exists(path):
+            os.remove(path)
+        return socketserver.UnixStreamServer(path, _SocketHandler)
+    if address.startswith("http://"):
+        host, port = address[len("http://"):].rstrip("/").rsplit(":", 1)
+        if host not in ("127.0.0.1", "localhost", "::1"):
+            raise ValueError(f"The daemon only listens on localhost, not on {host}")
+        return HTTPServer((host, int(port)), _HTTPHandler)
+    raise ValueError(f"Unknown address '{address}' (use http://127.0.0.1:PORT or unix:PATH)")
+
+
+# Function that runs the daemon until a shutdown job (or Ctrl+C)
+# preload is (scenarios, years) to read before the first job, or None
+def serve(address=DEFAULT_ADDRESS, preload=None):
+
+    daemon = SimulationDaemon()
+    if preload is not None:
+        start = time.perf_counter()
+        daemon.preload(*preload)
+        print(f"Dados carregados em {time.perf_counter() - start:.1f} s")
+
+    server = open_server(address)
+    server.simulations = daemon
+    server.timeout = 0.5
+    print(f"A aguardar trabalhos em {address} (pid {os.getpid()})")
+    try:
+        with server:
+            while daemon.running:
+                server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if address.startswith("unix:") and os.path.exists(address[len("unix:"):]):
+            os.remove(address[len("unix:"):])
+    return daemon.jobs
+
+
+# Function that sends a job to a running daemon and returns its answer (dictionary)
+def submit(job, address=DEFAULT_ADDRESS, timeout=3600):
+
+    data = json.dumps(job, default=_json_value).encode()
+    if address.startswith("unix:"):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.settimeout(timeout)
+            connection.connect(address[len("unix:"):])
+            connection.sendall(data + b"\n")
+            with connection.makefile("rb") as answer:
+                return json.loads(answer.readline())
+
+    request = Request(address.rstrip("/") + "/", data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urlopen(request, timeout=timeout) as answer:
+            return json.loads(answer.read())
+    except Exception as e:
+        # Errors of the job come back with status 400 and their answer in the body
+        if hasattr(e, "read"):
+            return json.loads(e.read())
+        raise
+
+
+if __name__ == "__main__":
+    serve(preload=(["NT", "GA", "DE"], [2030, 2040, 2050]))
@@ -0,0 +1,184 @@
+# SYSTEM PARAMETERS
+#
+# This file gathers the technical and economic parameters of the
+# hydrogen system (electrolyzers, compressors, storage, fuel cells)
+# for a scenario, year and storage configuration, in the same way
+# the economic model simulations (sim5 - sim8) build them, so that
+# the newer dispatch modes can share a single definition.
+
+import os
+
+import pandas as pd
+import extract_data
+from extract_data import get_data
+
+LHV_H2 = 33.33  # kWh/kg
+
+# Threshold sheets already read: {path: (modification time, df)}
+_thresholds = {}
+
+
+# Function that returns the installed capacity dataframe of a scenario
+def installed_capacity(scenario):
+
+    if scenario == "NT":
+        return extract_data.df_NT_installed_cap
+    elif scenario == "DE":
+        return extract_data.df_DE_installed_cap
+    elif scenario == "GA":
+        return extract_data.df_GA_installed_cap
+    else:
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+
+# Function that converts the percentage of storage in salt caverns into the share of each technology
+def storage_shares(storage_ratio):
+
+    if storage_ratio == 100:
+        return 1.0, 0.0
+    elif storage_ratio == 0:
+        return 0.0, 1.0
+    else:
+        storage_saltCaverns_percentage = storage_ratio/100
+        return storage_saltCaverns_percentage, 1.0 - storage_saltCaverns_percentage
+
+
+# Function that reads the fuel cell and storage capacities sized by sim4 for a given threshold
+# (the same lookup done by sim7 and sim8 in "sim7_thresholdValues.xlsx")
+def sized_capacities(scenario, year, threshold_selling, thresholds_file="sim7_thresholdValues.xlsx"):
+
+    # The sheet is read again only when the file changes (the daemon keeps it between jobs)
+    modified = os.path.getmtime(thresholds_file)
+    if thresholds_file not in _thresholds or _thresholds[thresholds_file][0] != modified:
+        _thresholds[thresholds_file] = (modified, pd.read_excel(thresholds_file, "Thresholds"))
+    thresholds_df = _thresholds[thresholds_file][1]
+
+    row_match = thresholds_df[
+        (thresholds_df["Scenario"] == scenario) &
+        (thresholds_df["Year"] == year) &
+        (thresholds_df["Threshold Value"].round(2) == round(threshold_selling, 2))
+    ]
+
+    if len(row_match) != 1:
+        raise ValueError(f"Configuração não encontrada para {scenario} {year} com threshold {threshold_selling}")
+
+    cap_fuel_cell = row_match["Fuel Cells Capacity (MW)"].values[0]
+    cap_storage = row_match["Storage Capacity (MWh)"].values[0]
+    return cap_fuel_cell, cap_storage
+
+
+# Function that builds the dictionary of parameters used by the economic model
+# cap_fuel_cell is in MW and cap_storage in MWh (LHV), as in the sim4 sizing results.
+# If h2_sellingPrice is None the price is read from "H2_prices.xlsx" (only needed when selling H2)
+# cap_electrolyzer (MW) replaces the installed capacity of the scenario when it is given
+def system_parameters(scenario, year, storage_ratio, threshold_selling, cap_fuel_cell, cap_storage, h2_sellingPrice=0.0,
+                      cap_electrolyzer=None):
+
+    installed_cap_df = installed_capacity(scenario)
+    storage_saltCaverns_percentage, storage_pressurisedTanks_percentage = storage_shares(storage_ratio)
+
+    df_electrolyzers = extract_data.df_electrolyzers
+    df_compressors_saltCaverns = extract_data.df_compressors_saltCaverns
+    df_storage_saltCaverns = extract_data.df_storage_saltCaverns
+    df_storage_pressurisedTanks = extract_data.df_storage_pressurisedTanks
+    df_fuel_cells = extract_data.df_fuel_cells
+
+    if h2_sellingPrice is None:
+        h2_prices_df = get_data("Prices", "H2_prices.xlsx", "Year")
+        h2_sellingPrice = h2_prices_df.loc[year, "H2 Cost [€/kg]"]
+
+    # Electrolyzers
+    eff_electrolyzer = df_electrolyzers.loc[year, "Efficiency (kWh/kgH2)"]
+    capex_anual_electrolyzer = df_electrolyzers.loc[year, "CAPEX (€/kW)"] / df_electrolyzers.loc[year, "Lifetime (hours)"]
+    opex_electrolyzer = df_electrolyzers.loc[year, "OPEX yearly (€/kW/year)"]
+    if cap_electrolyzer is None:
+        cap_electrolyzer = installed_cap_df.loc[year, "Electrolyzers (MW)"]
+
+    # Compressors for Salt Caverns
+    eff_compressors_saltCaverns = df_compressors_saltCaverns.loc[year, "Efficiency (%)"]
+    comsumption_compressors_saltCaverns = df_compressors_saltCaverns.loc[year, "Consumption (kWh/kgH2)"]
+    capex_anual_compressors_saltCaverns = df_compressors_saltCaverns.loc[year, "CAPEX (€/kW)"] / df_compressors_saltCaverns.loc[year, "Lifetime (hours)"]
+    opex_compressors_saltCaverns = df_compressors_saltCaverns.loc[year, "OPEX yearly (€/kW/year)"]
+    cap_compressors_saltCaverns = (cap_electrolyzer * 1000) / eff_electrolyzer * comsumption_compressors_saltCaverns * storage_saltCaverns_percentage
+
+    # Salt Caverns
+    eff_storage_saltCaverns = df_storage_saltCaverns.loc[year, "Efficiency (%)"]
+    capex_anual_storage_saltCaverns = df_storage_saltCaverns.loc[year, "CAPEX (€/kgH2)"] / df_storage_saltCaverns.loc[year, "Lifetime (hours)"]
+    opex_storage_saltCaverns = df_storage_saltCaverns.loc[year, "OPEX yearly (€/kW/year)"]
+
+    # Pressurized Tanks
+    eff_storage_pressurisedTanks = df_storage_pressurisedTanks.loc[year, "Efficiency (%)"]
+    capex_anual_storage_pressurisedTanks = df_storage_pressurisedTanks.loc[year, "CAPEX (€/kgH2)"] / df_storage_pressurisedTanks.loc[year, "Lifetime (hours)"]
+    opex_storage_pressurisedTanks = df_storage_pressurisedTanks.loc[year, "OPEX yearly (€/kW/year)"]
+
+    # Fuel Cells
+    eff_fuel_cell = df_fuel_cells.loc[year, "Efficiency (%)"]
+    capex_anual_fuel_cell = df_fuel_cells.loc[year, "CAPEX (€/kW)"] / df_fuel_cells.loc[year, "Lifetime (hours)"]
+    opex_fuel_cell = df_fuel_cells.loc[year, "OPEX yearly (€/kW/year)"]
+
+    cap_storage_kg = cap_storage * 1000 / LHV_H2
+
+    capex_total = (
+        capex_anual_electrolyzer * cap_electrolyzer * 1000 +
+        capex_anual_compressors_saltCaverns * cap_compressors_saltCaverns +
+        capex_anual_storage_pressurisedTanks * cap_storage_kg * storage_pressurisedTanks_percentage +
+        capex_anual_storage_saltCaverns * cap_storage_kg * storage_saltCaverns_percentage +
+        capex_anual_fuel_cell * cap_fuel_cell * 1000
+    )
+
+    opex_total = (
+        opex_electrolyzer * cap_electrolyzer * 1000 +
+        opex_compressors_saltCaverns * cap_compressors_saltCaverns +
+        opex_storage_pressurisedTanks * cap_storage_kg * storage_pressurisedTanks_percentage +
+        opex_storage_saltCaverns * cap_storage_kg * storage_saltCaverns_percentage +
+        opex_fuel_cell * cap_fuel_cell * 1000
+    )
+
+    eff_total_equipments = (
+        eff_fuel_cell *
+        (
+            eff_storage_saltCaverns * storage_saltCaverns_percentage +
+            eff_storage_pressurisedTanks * storage_pressurisedTanks_percentage
+        ) *
+        (
+            eff_compressors_saltCaverns * storage_saltCaverns_percentage
+        ) *
+        (
+            LHV_H2 /
+            eff_electrolyzer
+        )
+    )
+
+    return {
+        "scenario": scenario,
+        "year": year,
+        "storage_ratio": storage_ratio,
+        "storage_saltCaverns_percentage": storage_saltCaverns_percentage,
+        "storage_pressurisedTanks_percentage": storage_pressurisedTanks_percentage,
+        "eff_electrolyzer": eff_electrolyzer,
+        "cap_electrolyzer": cap_electrolyzer,
+        "eff_compressors_saltCaverns": eff_compressors_saltCaverns,
+        "comsumption_compressors_saltCaverns": comsumption_compressors_saltCaverns,
+        "eff_storage_saltCaverns": eff_storage_saltCaverns,
+        "eff_storage_pressurisedTanks": eff_storage_pressurisedTanks,
+        "eff_fuel_cell": eff_fuel_cell,
+        "cap_fuel_cell": cap_fuel_cell,
+        "cap_storage": cap_storage,
+        "cap_storage_kg": cap_storage_kg,
+        "cap_storage_caverns": cap_storage_kg * storage_saltCaverns_percentage,
+        "cap_storage_tanks": cap_storage_kg * storage_pressurisedTanks_percentage,
+        "capex_total": capex_total,
+        "opex_total": opex_total,
+        "eff_total_equipments": eff_total_equipments,
+        "threshold_selling": threshold_selling,
+        "threshold_buying": threshold_selling * eff_total_equipments,
+        "h2_sellingPrice": h2_sellingPrice,
+    }
+
+
+# Function that builds the parameters of a sim7/sim8 case, including the capacities sized by sim4
+def case_parameters(scenario, year, storage_ratio, threshold_selling, selling=False):
+
+    cap_fuel_cell, cap_storage = sized_capacities(scenario, year, threshold_selling)
+    return system_parameters(scenario, year, storage_ratio, threshold_selling, cap_fuel_cell, cap_storage,
+                             h2_sellingPrice=None if selling else 0.0)
@@ -0,0 +1,190 @@
+# THRESHOLDS
+#
+# This file derives the price thresholds of the simulations from the
+# hourly sheets instead of the hand-kept "Threshold", "Sim7 Thresholds"
+# and "Sim8 Thresholds" sheets of every scenario workbook. The statistics
+# of a scenario-year (average cost, average cost during deficits, the
+# percentiles and the deficit-weighted cost) come out of one pass over the
+# hourly array of the kernel and are kept in the threshold registry
+# ("threshold_registry.csv", next to the excels) with the fingerprint of
+# the hourly data they were computed from: when a sheet changes, its
+# thresholds are computed again the next time they are asked for.
+#
+# The manual thresholds are decisions, not statistics: they are set in
+# the registry (set_manual_threshold) and kept when the statistics are
+# recomputed; without one, the value of the workbook sheet is used.
+#
+# Only the years with an hourly sheet in the scenario workbook are derived
+# (NT has no 2035). The sweeps size the fuel cells and storage of every
+# threshold from the sim4 sizing results; check_sizing stops a sweep whose
+# derived thresholds have not been sized yet.
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import dispatch_kernel as kernel
+import extract_data
+from checkpoint import run_fingerprint
+from schema import hourly_data
+
+REGISTRY_FILE = "threshold_registry.csv"
+
+# Hours with a PT balance below this (kWh) are deficit hours, as in the kernel (surplus from 1 kWh)
+DEFICIT_BELOW_KWH = 1
+
+# Columns of the threshold sheets (and of the registry)
+AVERAGE = "Avg Electricity Cost [€/MWh]"
+DEFICIT = "Avg Electricity Cost During Deficits [€/MWh]"
+MANUAL = "Manual Threshold [€/MWh]"
+PERCENTILES = [10, 25, 50, 75, 90]
+DERIVED_COLUMNS = [
+    AVERAGE,
+    DEFICIT,
+    "Avg Electricity Cost During Surplus [€/MWh]",
+    "Deficit-Weighted Electricity Cost [€/MWh]",
+    "Surplus-Weighted Electricity Cost [€/MWh]",
+] + [f"P{q} Electricity Cost [€/MWh]" for q in PERCENTILES] + [f"P{q} Electricity Cost During Deficits [€/MWh]" for q in PERCENTILES]
+REGISTRY_COLUMNS = ["Scenario", "Years", "Fingerprint"] + DERIVED_COLUMNS + [MANUAL]
+
+# Registry read in this session: {path: df}
+_registries = {}
+
+
+# Function that computes the threshold statistics of an hourly array (kernel.HOURLY_COLUMNS)
+# The deficit hours are the hours the kernel treats as deficit (PT balance under 1 kWh); the weighted costs weight
+# every hour by its MWh
+def threshold_statistics(hourly):
+
+    costs = hourly[:, kernel.H_PT_COST]
+    balance = hourly[:, kernel.H_BALANCE_PT]
+    deficit = balance * 1000 < DEFICIT_BELOW_KWH
+    surplus = ~deficit
+    deficit_costs = costs[deficit]
+
+    percentiles = np.percentile(costs, PERCENTILES) if len(costs) else np.full(len(PERCENTILES), np.nan)
+    deficit_percentiles = np.percentile(deficit_costs, PERCENTILES) if deficit.any() else np.full(len(PERCENTILES), np.nan)
+    deficit_energy = np.abs(balance[deficit])
+    surplus_energy = balance[surplus]
+
+    values = [
+        costs.mean() if len(costs) else np.nan,
+        deficit_costs.mean() if deficit.any() else np.nan,
+        costs[surplus].mean() if surplus.any() else np.nan,
+        (deficit_costs * deficit_energy).sum() / deficit_energy.sum() if deficit_energy.sum() > 0 else np.nan,
+        (costs[surplus] * surplus_energy).sum() / surplus_energy.sum() if surplus_energy.sum() > 0 else np.nan,
+    ] + list(percentiles) + list(deficit_percentiles)
+    return dict(zip(DERIVED_COLUMNS, values))
+
+
+# Function that reads the registry (once per session); returns an empty registry when there is no file
+def load_registry(path=None):
+
+    path = path or os.path.join(extract_data.BASE_DIR, REGISTRY_FILE)
+    if path not in _registries:
+        if os.path.exists(path):
+            _registries[path] = pd.read_csv(path, dtype={"Scenario": str, "Fingerprint": str}, float_precision="round_trip")
+        else:
+            _registries[path] = pd.DataFrame(columns=REGISTRY_COLUMNS)
+    return _registries[path]
+
+
+# Function that writes the registry (to a temporary file and then moved)
+def save_registry(df_registry, path=None):
+
+    path = path or os.path.join(extract_data.BASE_DIR, REGISTRY_FILE)
+    df_registry = df_registry.sort_values(["Scenario", "Years"]).reset_index(drop=True)
+    df_registry.to_csv(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+    _registries[path] = df_registry
+    return path
+
+
+# Function that returns the registry row of a scenario and year, computing the statistics again when the
+# hourly data (or the deficit boundary) changed since they were stored (the manual threshold of the row is kept)
+def registry_thresholds(scenario, year, path=None):
+
+    df_registry = load_registry(path)
+    hourly = kernel.hourly_array(hourly_data(scenario, year), validated=True)
+    fingerprint = run_fingerprint(hourly, np.array([DEFICIT_BELOW_KWH], dtype=float)).hex()
+
+    found = (df_registry["Scenario"] == scenario) & (df_registry["Years"] == year)
+    if found.any() and df_registry.loc[found, "Fingerprint"].iloc[0] == fingerprint:
+        return df_registry.loc[found].iloc[0].to_dict()
+
+    row = {"Scenario": scenario, "Years": year, "Fingerprint": fingerprint}
+    row.update(threshold_statistics(hourly))
+    row[MANUAL] = df_registry.loc[found, MANUAL].iloc[0] if found.any() else np.nan
+    save_registry(pd.concat([df_registry.loc[~found], pd.DataFrame([row], columns=REGISTRY_COLUMNS)], ignore_index=True), path)
+    return row
+
+
+# Function that sets the manual threshold of a scenario and year in the registry
+def set_manual_threshold(scenario, year, threshold, path=None):
+
+    registry_thresholds(scenario, year, path)
+    df_registry = load_registry(path).copy()
+    found = (df_registry["Scenario"] == scenario) & (df_registry["Years"] == year)
+    df_registry.loc[found, MANUAL] = threshold
+    save_registry(df_registry, path)
+
+
+# Function that returns the years with an hourly sheet in the workbook of a scenario (all of them if there is no workbook,
+# so the missing file is reported by hourly_data)
+def available_years(scenario, years):
+
+    workbook = os.path.join(extract_data.BASE_DIR, f"{scenario}.xlsx")
+    if not os.path.exists(workbook):
+        return list(years)
+    with pd.ExcelFile(workbook, engine=extract_data.ENGINE) as excel:
+        sheets = set(excel.sheet_names)
+    missing = [year for year in years if str(year) not in sheets]
+    if missing:
+        print(f" {scenario}.xlsx has no sheet for {', '.join(map(str, missing))}, the thresholds of those years are not derived.")
+    return [year for year in years if str(year) in sheets]
+
+
+# Function that builds a threshold sheet (one row per year, with "Years" and the columns of the sheets) from the
+# registry; the manual thresholds missing from the registry are read from the sheet of the workbook when it exists
+# The years without an hourly sheet in the workbook are left out
+def threshold_table(scenario, years, threshold_sheet_name=None, path=None):
+
+    years = available_years(scenario, years)
+    df = pd.DataFrame([registry_thresholds(scenario, year, path) for year in years], columns=REGISTRY_COLUMNS)
+    if df[MANUAL].isna().any() and threshold_sheet_name is not None:
+        try:
+            df_sheet = pd.read_excel(os.path.join(extract_data.BASE_DIR, f"{scenario}.xlsx"), threshold_sheet_name)
+            manual = df_sheet.set_index("Years")[MANUAL]
+            df[MANUAL] = df[MANUAL].fillna(df["Years"].map(manual))
+        except (FileNotFoundError, ValueError, KeyError):
+            print(f" No manual thresholds for {scenario} in '{threshold_sheet_name}'.")
+    return df.drop(columns=["Scenario", "Fingerprint"])
+
+
+# Function that checks that every threshold of a threshold sheet has its fuel cells and storage sized in the sizing
+# file the simulation reads (sim7_thresholdValues.xlsx for sim7 / sim8, sim4_threshold_results.xlsx for sim6)
+# The simulations skip a case without sizing, so a sweep with derived thresholds would do nothing: this raises instead
+def check_sizing(scenario, df_thresholds, thresholds_file):
+
+    from system_parameters import sized_capacities
+
+    missing = []
+    for _, row in df_thresholds.iterrows():
+        for threshold in (row[AVERAGE], row[DEFICIT], row[MANUAL]):
+            if pd.isna(threshold):
+                continue
+            try:
+                sized_capacities(scenario, int(row["Years"]), threshold, thresholds_file)
+            except ValueError:
+                missing.append(f"{int(row['Years'])} ({threshold:.2f} €/MWh)")
+    if missing:
+        raise ValueError(f"{thresholds_file} has no sizing for the {scenario} thresholds {', '.join(missing)}: "
+                         f"size them with the sim4 sweep (h2sim.py sweep sim4 --derived-thresholds) and add them to the file")
+
+
+# Function that derives the thresholds of every scenario and year (and stores them in the registry)
+def results_thresholds(scenarios=("NT", "GA", "DE"), years=(2030, 2035, 2040, 2050)):
+
+    df = pd.concat([threshold_table(scenario, years).assign(Scenario=scenario) for scenario in scenarios], ignore_index=True)
+    return df[["Scenario"] + [column for column in df.columns if column != "Scenario"]]
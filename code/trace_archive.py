@@ -0,0 +1,327 @@
+# TRACE ARCHIVE
+#
+# This file keeps the full hourly traces of every run of a sweep ("Storage
+# H2 [kg]", "H2_produced [kg]", "Elec_recovered [kWh]", ...), not only the
+# summaries, in a folder of compressed columnar files (one per run id)
+# instead of excels, which are too big and too slow for hundreds of cases.
+#
+# A run file is split in chunks of hours (a month by default) and every
+# column of a chunk is stored on its own:
+#   - the values are byte-shuffled (the 1st bytes of all the values, then
+#     the 2nd, ...), so the exponents and the zeros sit together, and are
+#     delta-encoded first when that compresses better (storage levels,
+#     dates and other slowly moving columns)
+#   - the bytes are compressed with zstd (when the zstandard package is
+#     installed) or zlib
+# The "Date/Hour" labels are not stored when they can be rebuilt from the
+# dates of the hours. The values are kept exactly unless decimals is
+# given: the floats are then stored as integers of that resolution
+# (archive_sweep keeps 3 decimals, grams and Wh), which takes the noise
+# of the last bits out and makes the traces about 10x smaller than xlsx.
+# The offsets of the chunks are in a json footer at the end of the file
+# (as in Parquet), so a run, a few columns or a date range are read
+# without decompressing the rest.
+#
+#   archive = TraceArchive("traces")
+#   archive.write("GA_2040_ratio60", df, year=2040, metadata=summary)
+#   archive.read("GA_2040_ratio60", ["Storage H2 [kg]"], start="2040-07-01", end="2040-07-31")
+
+import json
+import os
+import re
+import struct
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from calendar_index import calendar_features
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+MAGIC = b"H2TR"
+VERSION = 1
+# length of the json footer, magic (the last bytes of a run file)
+FOOTER = struct.Struct("<Q4s")
+CODEC = "zstd" if zstandard is not None else "zlib"
+
+# Hours of a chunk (31 days)
+CHUNK_HOURS = 24 * 31
+
+# Hidden columns of a run file: the index of the dataframe and the dates of the hours
+INDEX_COLUMN = "__index__"
+DATE_COLUMN = "__date__"
+
+# Format of the "Date/Hour" labels of the sheets ("01Jan 00:00")
+LABEL_FORMAT = "%d%b %H:%M"
+
+
+def _compress(data, codec):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=9).compress(data)
+    return zlib.compress(data, 9)
+
+
+def _decompress(data, codec):
+    if codec == "zstd":
+        if zstandard is None:
+            raise ImportError("This archive was written with zstd, it needs the zstandard package (pip install zstandard)")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+# Function that encodes the values of one column of a chunk; returns the filter used and the compressed bytes
+# Numbers are byte-shuffled (with delta encoding when it compresses better), text is stored as lines
+def _encode(values, codec):
+
+    if values.dtype.kind in "OUS":
+        return "text", _compress("\n".join(str(value) for value in values).encode("utf-8"), codec)
+
+    width = values.dtype.itemsize
+    integers = np.ascontiguousarray(values).view(f"<u{width}")
+    # The differences of the bit patterns wrap around, so the delta is exact for floats too
+    encoded = {
+        "shuffle": _compress(integers.view(np.uint8).reshape(-1, width).T.tobytes(), codec),
+        "delta": _compress(np.diff(integers, prepend=integers.dtype.type(0)).view(np.uint8).reshape(-1, width).T.tobytes(), codec),
+    }
+    name = min(encoded, key=lambda key: len(encoded[key]))
+    return name, encoded[name]
+
+
+# Function that decodes the bytes of one column of a chunk (inverse of _encode)
+def _decode(data, filter_name, dtype, rows, codec):
+
+    data = _decompress(data, codec)
+    if filter_name == "text":
+        return np.array(data.decode("utf-8").split("\n") if rows else [], dtype=object)
+
+    dtype = np.dtype(dtype)
+    width = dtype.itemsize
+    integers = np.frombuffer(data, dtype=np.uint8).reshape(width, rows).T.copy().view(f"<u{width}").ravel()
+    if filter_name == "delta":
+        integers = np.cumsum(integers, dtype=integers.dtype)
+    return integers.view(dtype)
+
+
+# Converts the values json does not know (numpy numbers, dates) for the metadata
+def _json_value(value):
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+# Folder of run files, one per run id
+class TraceArchive:
+
+    def __init__(self, directory, codec=CODEC, chunk_hours=CHUNK_HOURS, decimals=None):
+        self.directory = directory
+        self.codec = codec
+        self.chunk_hours = chunk_hours
+        self.decimals = decimals
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, run_id):
+        return os.path.join(self.directory, re.sub(r"[^\w.=-]+", "_", str(run_id)) + ".trace")
+
+    # Writes the hourly dataframe of a run (replacing an older run with the same id)
+    # year gives the dates of the "Date/Hour" labels of the sheets ("01Jan 00:00"), for the reads by date;
+    # metadata is a dictionary kept with the run (the summary of the case, for example)
+    def write(self, run_id, df, year=None, metadata=None):
+
+        columns = {INDEX_COLUMN: df.index.to_numpy()}
+        for column in df.columns:
+            values = df[column].to_numpy()
+            if values.dtype.kind not in "biufMOUS":
+                raise ValueError(f"Column '{column}' of run {run_id} has values of type {values.dtype}, which cannot be archived")
+            columns[str(column)] = values
+
+        dates = None
+        if "Date/Hour" in df.columns and df["Date/Hour"].dtype.kind == "M":
+            dates = df["Date/Hour"].to_numpy().astype("datetime64[ns]")
+        elif "Date/Hour" in df.columns and year is not None:
+            dates = calendar_features(year, df["Date/Hour"].to_numpy())["Date/Hour"]
+        if dates is not None:
+            columns[DATE_COLUMN] = dates
+
+        descriptions = []
+        for name, values in columns.items():
+            description = {"name": name, "dtype": "object" if values.dtype.kind in "OUS" else values.dtype.str}
+            if name == "Date/Hour" and dates is not None and values.dtype.kind in "OUS" \
+                    and (pd.DatetimeIndex(dates).strftime(LABEL_FORMAT) == values.astype(str)).all():
+                description["format"] = LABEL_FORMAT
+                columns[name] = None
+            elif self.decimals is not None and values.dtype.kind == "f" and np.isfinite(values).all():
+                description["decimals"] = self.decimals
+                columns[name] = np.round(values * 10.0 ** self.decimals).astype(np.int64)
+            descriptions.append(description)
+
+        footer = {
+            "run": str(run_id),
+            "version": VERSION,
+            "codec": self.codec,
+            "rows": len(df),
+            "index": df.index.name,
+            "columns": descriptions,
+            "chunks": [],
+            "metadata": metadata or {},
+        }
+
+        path = self._path(run_id)
+        with open(path + ".tmp", "wb") as f:
+            for start in range(0, len(df), self.chunk_hours):
+                stop = min(start + self.chunk_hours, len(df))
+                chunk = {"start": start, "stop": stop, "columns": {}}
+                if dates is not None:
+                    chunk["first"], chunk["last"] = str(dates[start]), str(dates[stop - 1])
+                for name, values in columns.items():
+                    if values is None:
+                        chunk["columns"][name] = [f.tell(), 0, "dates"]
+                        continue
+                    filter_name, data = _encode(values[start:stop], self.codec)
+                    chunk["columns"][name] = [f.tell(), len(data), filter_name]
+                    f.write(data)
+                footer["chunks"].append(chunk)
+            data = json.dumps(footer, default=_json_value).encode("utf-8")
+            f.write(data)
+            f.write(FOOTER.pack(len(data), MAGIC))
+        os.replace(path + ".tmp", path)
+        return path
+
+    # Reads the footer of a run (columns, chunks and metadata)
+    def footer(self, run_id):
+
+        path = self._path(run_id)
+        if not os.path.exists(path):
+            raise ValueError(f"There is no run {run_id} in {self.directory}")
+        with open(path, "rb") as f:
+            f.seek(-FOOTER.size, os.SEEK_END)
+            length, magic = FOOTER.unpack(f.read(FOOTER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a trace archive file")
+            f.seek(-FOOTER.size - length, os.SEEK_END)
+            footer = json.loads(f.read(length))
+        if footer["version"] != VERSION:
+            raise ValueError(f"{path} has version {footer['version']}, only version {VERSION} can be read")
+        return footer
+
+    # Function that lists the run ids of the archive
+    def run_ids(self):
+
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(".trace"))
+        return [self.footer(name[:-len(".trace")])["run"] for name in names]
+
+    # Lists the runs with their hours, size on disk and metadata (one row per run)
+    def runs(self):
+
+        rows = []
+        for run_id in self.run_ids():
+            footer = self.footer(run_id)
+            rows.append(dict({"Run": run_id, "Hours": footer["rows"], "Size (kB)": os.path.getsize(self._path(run_id)) / 1024},
+                             **footer["metadata"]))
+        return pd.DataFrame(rows)
+
+    # Reads a run (or some of its columns); start and end are hours of the run (positions, end excluded)
+    # or dates (both included, the run needs its dates: a "Date/Hour" of dates or the year when written)
+    def read(self, run_id, columns=None, start=None, end=None):
+
+        footer = self.footer(run_id)
+        descriptions = {column["name"]: column for column in footer["columns"]}
+        dtypes = {name: column["dtype"] for name, column in descriptions.items()}
+        names = [name for name in dtypes if not name.startswith("__")] if columns is None else list(columns)
+        missing = [name for name in names if name not in dtypes]
+        if missing:
+            raise ValueError(f"Run {run_id} has no columns {', '.join(missing)}")
+
+        by_date = any(isinstance(bound, (str, pd.Timestamp, np.datetime64)) for bound in (start, end))
+        if by_date and DATE_COLUMN not in dtypes:
+            raise ValueError(f"Run {run_id} was written without dates, read it by hours")
+
+        chunks = footer["chunks"]
+        if by_date:
+            first = pd.Timestamp(start) if start is not None else None
+            last = pd.Timestamp(end) if end is not None else None
+            chunks = [chunk for chunk in chunks if (first is None or pd.Timestamp(chunk["last"]) >= first)
+                      and (last is None or pd.Timestamp(chunk["first"]) <= last)]
+        else:
+            first = 0 if start is None else start
+            last = footer["rows"] if end is None else end
+            chunks = [chunk for chunk in chunks if chunk["stop"] > first and chunk["start"] < last]
+
+        labels = any("format" in descriptions[name] for name in names)
+        wanted = [INDEX_COLUMN] + names + ([DATE_COLUMN] if (by_date or labels) and DATE_COLUMN not in names else [])
+        values = {name: [] for name in wanted}
+        with open(self._path(run_id), "rb") as f:
+            for chunk in chunks:
+                rows = chunk["stop"] - chunk["start"]
+                for name in wanted:
+                    offset, length, filter_name = chunk["columns"][name]
+                    if filter_name == "dates":
+                        continue
+                    f.seek(offset)
+                    dtype = np.int64 if "decimals" in descriptions[name] else dtypes[name]
+                    values[name].append(_decode(f.read(length), filter_name, dtype, rows, footer["codec"]))
+
+        values = {name: np.concatenate(parts) if parts else np.array([], dtype=dtypes[name]) for name, parts in values.items()}
+        for name in names:
+            if "decimals" in descriptions[name]:
+                values[name] = (values[name] / 10.0 ** descriptions[name]["decimals"]).astype(dtypes[name])
+            elif "format" in descriptions[name]:
+                values[name] = pd.DatetimeIndex(values[DATE_COLUMN]).strftime(descriptions[name]["format"]).to_numpy(dtype=object)
+        positions = np.concatenate([np.arange(chunk["start"], chunk["stop"]) for chunk in chunks]) if chunks else np.array([], dtype=int)
+        if by_date:
+            keep = np.ones(len(positions), dtype=bool)
+            if first is not None:
+                keep &= values[DATE_COLUMN] >= first.to_datetime64()
+            if last is not None:
+                keep &= values[DATE_COLUMN] <= last.to_datetime64()
+        else:
+            keep = (positions >= first) & (positions < last)
+
+        df = pd.DataFrame({name: values[name][keep] for name in names},
+                          index=pd.Index(values[INDEX_COLUMN][keep], name=footer["index"]))
+        return df
+
+    # Reads one column of several runs (all by default) side by side, one column per run, for plotting
+    def column(self, column, run_ids=None, start=None, end=None):
+
+        run_ids = self.run_ids() if run_ids is None else run_ids
+        return pd.DataFrame({run_id: self.read(run_id, [column], start, end)[column] for run_id in run_ids})
+
+
+# Function that runs the sweep of storage ratios (shared_data) keeping the hourly traces of every ratio
+# The runs are named SCENARIO_YEAR_thTHRESHOLD_ratioRATIO and keep the summary of the ratio as metadata;
+# the traces are kept with `decimals` decimals (None keeps them exactly)
+# Returns the summaries of the sweep and the runs of the archive
+def archive_sweep(archive_dir, scenario, year, threshold_selling, storage_ratios=range(0, 101), selling=True, workers=None,
+                  decimals=3):
+
+    from ratio_sweep import ratio_parameters
+    from schema import hourly_data
+    from shared_data import parallel_sweep, case_outputs
+
+    params_list = ratio_parameters(scenario, year, threshold_selling, list(storage_ratios), selling=selling)
+    df_summary, hourly_results = parallel_sweep(scenario, year, params_list, selling=selling, workers=workers, hourly_outputs=True)
+
+    df_hourly = hourly_data(scenario, year)
+    archive = TraceArchive(archive_dir, decimals=decimals)
+    for case, summary in enumerate(df_summary.to_dict("records")):
+        df = case_outputs(hourly_results, case)
+        df.index = df_hourly.index
+        df.insert(0, "Date/Hour", df_hourly["Date/Hour"].to_numpy())
+        run_id = f"{scenario}_{year}_th{threshold_selling:g}_ratio{params_list[case]['storage_ratio']:g}"
+        archive.write(run_id, df, year=year, metadata=summary)
+
+    df_runs = archive.runs()
+    print(f"{len(df_summary)} traces em {archive_dir} ({df_runs['Size (kB)'].sum() / 1024:.1f} MB)")
+    return df_summary, df_runs
+
+
+# Function that runs the archived sweep of one scenario, year and threshold (folder "traces")
+def results_archive(scenario, year, threshold_selling):
+
+    return archive_sweep("traces", scenario, year, threshold_selling)
@@ -0,0 +1,395 @@
+# WORK QUEUE
+#
+# This file spreads a sweep over several machines. The cases of the sweep
+# (scenario, year, threshold, storage, ...) are grouped in work units and
+# published to a queue; workers on any node take units, run them with
+# the simulations of h2sim and push the summaries back to the queue.
+#
+# Three queues with the same methods are available:
+#   spool:DIR           folder of json files (a shared disk)
+#   sqlite:FILE         SQLite database (one machine or a disk with working locks)
+#   redis://HOST:PORT   Redis server (or any server with the same protocol),
+#                       needs the redis package; "redis-server" runs one locally
+#
+# Every unit has an id made from its contents, so publishing the same
+# sweep again does not duplicate it and running a unit twice stores the
+# same result. A worker holds a unit for a lease (seconds); units of
+# workers that fail or disappear go back to the queue until they have
+# been tried max_attempts times.
+
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import time
+
+import pandas as pd
+
+STATUSES = ["pending", "running", "done", "failed"]
+
+
+# Function that gives the id of a work unit (the same cases always give the same id)
+def unit_id(simulation, cases):
+
+    contents = json.dumps({"simulation": simulation, "cases": cases}, sort_keys=True, default=float)
+    return hashlib.sha1(contents.encode()).hexdigest()[:16]
+
+
+# Function that builds every combination of the given values, e.g. grid_cases(scenario=["NT"], year=[2030, 2040])
+def grid_cases(**values):
+
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*values.values())]
+
+
+# Function that groups the cases of a simulation in work units of at most cases_per_unit cases
+# Cases of the same scenario and year go together, so the worker reads their hourly sheet once
+def sweep_units(simulation, cases, cases_per_unit=4):
+
+    cases = sorted(cases, key=lambda case: (str(case.get("scenario")), str(case.get("year"))))
+    units = []
+    for _, group in itertools.groupby(cases, key=lambda case: (case.get("scenario"), case.get("year"))):
+        group = list(group)
+        for start in range(0, len(group), cases_per_unit):
+            chunk = group[start:start + cases_per_unit]
+            units.append({"id": unit_id(simulation, chunk), "simulation": simulation, "cases": chunk})
+    return units
+
+
+# Queue of json files in a folder: pending/, running/, done/, failed/ and results/
+# A unit is taken by moving its file to running/ with the end of the lease in the name (moves are atomic)
+class SpoolQueue:
+
+    def __init__(self, spool_dir, max_attempts=3):
+        self.spool_dir = spool_dir
+        self.max_attempts = max_attempts
+        for folder in STATUSES + ["results"]:
+            os.makedirs(os.path.join(spool_dir, folder), exist_ok=True)
+
+    def _path(self, folder, name):
+        return os.path.join(self.spool_dir, folder, name)
+
+    def _write(self, path, contents):
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w") as f:
+            json.dump(contents, f, default=float)
+        os.replace(temporary, path)
+
+    def _running(self):
+        # running/<id>.<end of the lease>.json
+        running = []
+        for name in os.listdir(self._path("running", "")):
+            if name.endswith(".json"):
+                identifier, lease_until = name[:-len(".json")].split(".", 1)
+                running.append((name, identifier, float(lease_until)))
+        return running
+
+    def publish(self, units):
+        known = {name.split(".")[0] for status in STATUSES for name in os.listdir(self._path(status, ""))}
+        new = 0
+        for unit in units:
+            if unit["id"] not in known:
+                self._write(self._path("pending", f"{unit['id']}.json"), dict(unit, attempts=0))
+                known.add(unit["id"])
+                new += 1
+        return new
+
+    # Units whose lease ended go back to pending
+    def requeue_expired(self):
+        now = time.time()
+        for name, identifier, lease_until in self._running():
+            if lease_until < now:
+                try:
+                    os.rename(self._path("running", name), self._path("pending", f"{identifier}.json"))
+                except FileNotFoundError:
+                    pass # finished or requeued by another worker
+
+    def claim(self, worker, lease=3600):
+        self.requeue_expired()
+        for name in sorted(os.listdir(self._path("pending", ""))):
+            if not name.endswith(".json"):
+                continue
+            identifier = name[:-len(".json")]
+            running = self._path("running", f"{identifier}.{time.time() + lease:.3f}.json")
+            try:
+                os.rename(self._path("pending", name), running)
+            except FileNotFoundError:
+                continue # taken by another worker
+
+            with open(running) as f:
+                unit = json.load(f)
+            if unit["attempts"] >= self.max_attempts:
+                os.rename(running, self._path("failed", name))
+                continue
+            unit["attempts"] += 1
+            unit["worker"] = worker
+            self._write(running, unit)
+            return unit
+        return None
+
+    def _finish(self, identifier, status, unit=None):
+        for name, running_id, _ in self._running():
+            if running_id == identifier:
+                try:
+                    os.rename(self._path("running", name), self._path(status, f"{identifier}.json"))
+                except FileNotFoundError:
+                    pass
+                if unit is not None:
+                    self._write(self._path(status, f"{identifier}.json"), unit)
+
+    def complete(self, identifier, result):
+        self._write(self._path("results", f"{identifier}.json"), result)
+        self._finish(identifier, "done")
+
+    def fail(self, identifier, error):
+        for name, running_id, _ in self._running():
+            if running_id == identifier:
+                with open(self._path("running", name)) as f:
+                    unit = json.load(f)
+                unit["error"] = error
+                self._finish(identifier, "failed" if unit["attempts"] >= self.max_attempts else "pending", unit)
+
+    def progress(self):
+        return {status: sum(name.endswith(".json") for name in os.listdir(self._path(status, ""))) for status in STATUSES}
+
+    def results(self):
+        results = []
+        for name in sorted(os.listdir(self._path("results", ""))):
+            if name.endswith(".json"):
+                with open(self._path("results", name)) as f:
+                    results.append(json.load(f))
+        return results
+
+
+# Queue in a SQLite database, every change is one transaction
+class SQLiteQueue:
+
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        with self._connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS units (id TEXT PRIMARY KEY, unit TEXT, status TEXT, attempts INTEGER, "
+                "worker TEXT, lease_until REAL, error TEXT)"
+            )
+            connection.execute("CREATE TABLE IF NOT EXISTS results (id TEXT PRIMARY KEY, result TEXT)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=60)
+
+    def publish(self, units):
+        with self._connect() as connection:
+            before = connection.execute("SELECT COUNT(*) FROM units").fetchone()[0]
+            connection.executemany(
+                "INSERT OR IGNORE INTO units (id, unit, status, attempts) VALUES (?, ?, 'pending', 0)",
+                [(unit["id"], json.dumps(unit, default=float)) for unit in units]
+            )
+            return connection.execute("SELECT COUNT(*) FROM units").fetchone()[0] - before
+
+    def claim(self, worker, lease=3600):
+        connection = self._connect()
+        try:
+            connection.isolation_level = None
+            connection.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            # Units whose lease ended go back to pending, or fail if they were tried too many times
+            connection.execute("UPDATE units SET status = 'pending' WHERE status = 'running' AND lease_until < ?", (now,))
+            connection.execute("UPDATE units SET status = 'failed' WHERE status = 'pending' AND attempts >= ?", (self.max_attempts,))
+            row = connection.execute("SELECT id, unit, attempts FROM units WHERE status = 'pending' ORDER BY rowid LIMIT 1").fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE units SET status = 'running', attempts = attempts + 1, worker = ?, lease_until = ? WHERE id = ?",
+                    (worker, now + lease, row[0])
+                )
+            connection.execute("COMMIT")
+        finally:
+            connection.close()
+
+        if row is None:
+            return None
+        return dict(json.loads(row[1]), attempts=row[2] + 1, worker=worker)
+
+    def complete(self, identifier, result):
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO results (id, result) VALUES (?, ?)", (identifier, json.dumps(result, default=float)))
+            connection.execute("UPDATE units SET status = 'done' WHERE id = ?", (identifier,))
+
+    def fail(self, identifier, error):
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE units SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, error = ? "
+                "WHERE id = ? AND status = 'running'",
+                (self.max_attempts, error, identifier)
+            )
+
+    def progress(self):
+        with self._connect() as connection:
+            counts = dict(connection.execute("SELECT status, COUNT(*) FROM units GROUP BY status").fetchall())
+        return {status: counts.get(status, 0) for status in STATUSES}
+
+    def results(self):
+        with self._connect() as connection:
+            return [json.loads(row[0]) for row in connection.execute("SELECT result FROM results ORDER BY id")]
+
+
+# Queue in a Redis server: the units and results are hashes, pending a list, running a sorted set by end of the lease
+class RedisQueue:
+
+    # Takes the first pending unit and registers its lease in one step
+    CLAIM = """
+    local identifier = redis.call('RPOP', KEYS[1])
+    if identifier then redis.call('ZADD', KEYS[2], ARGV[1], identifier) end
+    return identifier
+    """
+
+    def __init__(self, url, max_attempts=3, prefix="h2sim"):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("The redis queue needs the redis package (pip install redis)")
+        self.server = redis.Redis.from_url(url, decode_responses=True)
+        self.max_attempts = max_attempts
+        self.keys = {name: f"{prefix}:{name}" for name in ["units", "pending", "running", "attempts", "done", "failed", "errors", "results"]}
+        self.claim_script = self.server.register_script(self.CLAIM)
+
+    def publish(self, units):
+        new = 0
+        for unit in units:
+            if self.server.hsetnx(self.keys["units"], unit["id"], json.dumps(unit, default=float)):
+                self.server.lpush(self.keys["pending"], unit["id"])
+                new += 1
+        return new
+
+    def requeue_expired(self):
+        for identifier in self.server.zrangebyscore(self.keys["running"], "-inf", time.time()):
+            if self.server.zrem(self.keys["running"], identifier):
+                self.server.rpush(self.keys["pending"], identifier)
+
+    def claim(self, worker, lease=3600):
+        self.requeue_expired()
+        while True:
+            identifier = self.claim_script(keys=[self.keys["pending"], self.keys["running"]], args=[time.time() + lease])
+            if identifier is None:
+                return None
+            attempts = self.server.hincrby(self.keys["attempts"], identifier, 1)
+            if attempts > self.max_attempts:
+                self.server.zrem(self.keys["running"], identifier)
+                self.server.sadd(self.keys["failed"], identifier)
+                continue
+            return dict(json.loads(self.server.hget(self.keys["units"], identifier)), attempts=attempts, worker=worker)
+
+    def complete(self, identifier, result):
+        self.server.hset(self.keys["results"], identifier, json.dumps(result, default=float))
+        self.server.sadd(self.keys["done"], identifier)
+        self.server.zrem(self.keys["running"], identifier)
+
+    def fail(self, identifier, error):
+        if not self.server.zrem(self.keys["running"], identifier):
+            return # the lease had already ended
+        self.server.hset(self.keys["errors"], identifier, error)
+        if int(self.server.hget(self.keys["attempts"], identifier) or 0) >= self.max_attempts:
+            self.server.sadd(self.keys["failed"], identifier)
+        else:
+            self.server.rpush(self.keys["pending"], identifier)
+
+    def progress(self):
+        return {
+            "pending": self.server.llen(self.keys["pending"]),
+            "running": self.server.zcard(self.keys["running"]),
+            "done": self.server.scard(self.keys["done"]),
+            "failed": self.server.scard(self.keys["failed"]),
+        }
+
+    def results(self):
+        return [json.loads(result) for _, result in sorted(self.server.hgetall(self.keys["results"]).items())]
+
+
+# Function that opens a queue from its description ("spool:DIR", "sqlite:FILE" or "redis://HOST:PORT/DB")
+def open_queue(spec, max_attempts=3):
+
+    if spec.startswith("spool:"):
+        return SpoolQueue(spec[len("spool:"):], max_attempts)
+    if spec.startswith("sqlite:"):
+        return SQLiteQueue(spec[len("sqlite:"):], max_attempts)
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisQueue(spec, max_attempts)
+    raise ValueError(f"Unknown queue: {spec}")
+
+
+# Function that copies the excels to a folder of this node and reads them from there
+# Only the excels that changed since the last copy are copied again
+def local_data_cache(cache_dir):
+
+    import extract_data
+
+    os.makedirs(cache_dir, exist_ok=True)
+    for name in os.listdir(extract_data.BASE_DIR):
+        source = os.path.join(extract_data.BASE_DIR, name)
+        target = os.path.join(cache_dir, name)
+        if name.endswith(".xlsx") and (not os.path.exists(target) or os.path.getmtime(target) < os.path.getmtime(source)):
+            shutil.copy2(source, target)
+    extract_data.BASE_DIR = cache_dir
+
+
+# Function that runs one case of a simulation of h2sim and returns its summary (with the arguments of the case)
+def run_case(simulation, case):
+
+    import h2sim
+
+    folder, module_name, function_name, arguments = h2sim.SIMULATIONS[simulation]
+    function = getattr(h2sim.load_module(folder, module_name), function_name)
+    return case_summaries(case, function(*[case[name] for name in arguments]))
+
+
+# Function that turns the result of a simulation (df, summary), a summary or a dataframe of summaries
+# into a list of summaries with the arguments of the case
+def case_summaries(case, result):
+
+    summary = result[1] if isinstance(result, tuple) else result
+    if isinstance(summary, pd.DataFrame):
+        return [dict(case, **row) for row in summary.to_dict("records")]
+    return [dict(case, **summary)]
+
+
+# Function that takes units from the queue and runs them until the queue is empty
+# The sheets read stay in memory (extract_data), so units of the same scenario and year reuse them
+def run_worker(queue, worker=None, lease=3600, cache_dir=None, wait=True, poll=10):
+
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    if cache_dir:
+        local_data_cache(cache_dir)
+
+    completed = 0
+    while True:
+        unit = queue.claim(worker, lease)
+        if unit is None:
+            progress = queue.progress()
+            # Units held by other workers come back to the queue if their lease ends
+            if wait and progress["running"] > 0:
+                time.sleep(poll)
+                continue
+            break
+
+        print(f"{worker}: unit {unit['id']} ({unit['simulation']}, {len(unit['cases'])} cases, attempt {unit['attempts']})")
+        try:
+            summaries = [summary for case in unit["cases"] for summary in run_case(unit["simulation"], case)]
+        except Exception as e:
+            print(f"Erro na unidade {unit['id']}: {e}")
+            queue.fail(unit["id"], repr(e))
+            continue
+
+        queue.complete(unit["id"], {"id": unit["id"], "worker": worker, "summaries": summaries})
+        completed += 1
+        progress = queue.progress()
+        print(f"{worker}: {progress['done']} done, {progress['pending']} pending, {progress['running']} running, {progress['failed']} failed")
+
+    return completed
+
+
+# Function that joins the summaries of all the finished units in one dataframe
+def collect_results(queue):
+
+    return pd.DataFrame([summary for result in queue.results() for summary in result["summaries"]])